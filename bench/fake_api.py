@@ -0,0 +1,123 @@
+"""
+An in-process stand-in for the Telegram Bot API.
+
+FakeBotAPI plugs into telegram.Bot as its request object, so handlers run
+against a real Bot and real Update objects while every API call is answered
+locally after a configurable delay. A fraction of calls can be answered with
+429 Too Many Requests to exercise RetryAfter handling.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Bench Bot", "username": "bench_bot"}
+
+ADMIN_RIGHTS = {
+    "can_be_edited": False,
+    "is_anonymous": False,
+    "can_manage_chat": True,
+    "can_delete_messages": True,
+    "can_manage_video_chats": True,
+    "can_restrict_members": True,
+    "can_promote_members": False,
+    "can_change_info": True,
+    "can_invite_users": True,
+    "can_post_stories": False,
+    "can_edit_stories": False,
+    "can_delete_stories": False,
+}
+
+# Methods that are never rate limited, so the bot can always start up
+_NEVER_LIMITED = {"getMe", "getUpdates", "deleteWebhook", "setWebhook"}
+
+
+class FakeBotAPI(BaseRequest):
+    """
+    Answers Bot API calls locally.
+
+    :param latency: Base delay of every call in seconds.
+    :param jitter: Extra random delay of up to this many seconds.
+    :param rate_limit_probability: Chance that a call is answered with 429.
+    :param retry_after: The retry_after value sent with a 429.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rate_limit_probability: float = 0.0,
+                 retry_after: int = 1, seed: int | None = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self._random = random.Random(seed)
+        self._ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> float | None:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: RequestData | None = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if endpoint not in _NEVER_LIMITED and self._random.random() < self.rate_limit_probability:
+            self.rate_limited[endpoint] += 1
+            return 429, json.dumps({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }).encode()
+
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, parameters)}).encode()
+
+    def _message(self, parameters: dict) -> dict:
+        chat_id = int(parameters.get("chat_id", 0))
+        return {
+            "message_id": int(parameters.get("message_id") or next(self._ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+            "text": parameters.get("text", ""),
+        }
+
+    def _result(self, endpoint: str, parameters: dict):
+        if endpoint == "getMe":
+            return {**BOT_USER, "can_join_groups": True, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if endpoint == "getChatMember":
+            if int(parameters.get("user_id", 0)) == BOT_USER["id"]:
+                return {"status": "administrator", "user": BOT_USER, **ADMIN_RIGHTS}
+            return {"status": "member", "user": {"id": int(parameters["user_id"]), "is_bot": False,
+                                                 "first_name": "User"}}
+        if endpoint in ("createChatInviteLink", "revokeChatInviteLink"):
+            return {
+                "invite_link": parameters.get("invite_link") or f"https://t.me/+bench{next(self._ids)}",
+                "creator": BOT_USER,
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": endpoint == "revokeChatInviteLink",
+                "expire_date": parameters.get("expire_date"),
+                "member_limit": parameters.get("member_limit"),
+            }
+        if endpoint in ("sendMessage", "editMessageText", "sendDocument"):
+            return self._message(parameters)
+        # banChatMember, unbanChatMember, setWebhook, ...
+        return True
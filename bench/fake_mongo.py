@@ -0,0 +1,373 @@
+"""
+An in-memory stand-in for the small part of pymongo that storage/mongo.py uses.
+
+It is only meant for the offline benchmarks: documents live in plain dicts, the
+`_id` and any `create_index` field get a lazily sorted index so range scans stay
+fast at a million documents, and every operation can be given an artificial
+latency to mimic a network round trip.
+"""
+import bisect
+import heapq
+import threading
+import time
+from types import SimpleNamespace
+
+import pymongo
+from pymongo.errors import DuplicateKeyError
+
+
+def _compare(value, operator, operand) -> bool:
+    if operator == "$in":
+        return value in operand
+    if operator == "$ne":
+        return value != operand
+    if operator == "$exists":
+        return (value is not None) == bool(operand)
+    if operator == "$mod":
+        return value is not None and value % operand[0] == operand[1]
+    if value is None:
+        return False
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$lt":
+        return value < operand
+    if operator == "$lte":
+        return value <= operand
+    raise NotImplementedError(f"Query operator {operator} is not supported by the fake database")
+
+
+def _matches(doc: dict, query: dict | None) -> bool:
+    if not query:
+        return True
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(doc, sub_query) for sub_query in condition):
+                return False
+        elif isinstance(condition, dict) and condition and next(iter(condition)).startswith("$"):
+            value = doc.get(key)
+            if not all(_compare(value, operator, operand) for operator, operand in condition.items()):
+                return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+
+def _apply_update(doc: dict, update: dict, inserting: bool) -> None:
+    for operator, fields in update.items():
+        if operator == "$set" or (operator == "$setOnInsert" and inserting):
+            doc.update(fields)
+        elif operator == "$inc":
+            for field, amount in fields.items():
+                doc[field] = doc.get(field, 0) + amount
+        elif operator == "$unset":
+            for field in fields:
+                doc.pop(field, None)
+        elif operator != "$setOnInsert":
+            raise NotImplementedError(f"Update operator {operator} is not supported by the fake database")
+
+
+def _project(doc: dict, projection: dict | None) -> dict:
+    if not projection:
+        return dict(doc)
+    return {field: doc[field] for field in ("_id", *projection) if field in doc and projection.get(field, 1)}
+
+
+class _SortedIndex:
+    """
+    Ascending index over one field. It is rebuilt only when documents are inserted or
+    the field changes; deleted documents are skipped lazily while scanning.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self._entries = []
+        self._head = 0
+        self.dirty = True
+
+    def scan(self, docs: dict, lower=None, inclusive: bool = False):
+        """Yields live documents in ascending field order, starting after (or at) `lower`."""
+        if self.dirty:
+            self._entries = sorted(
+                ((doc[self.field], _id) for _id, doc in docs.items() if doc.get(self.field) is not None),
+                key=lambda entry: entry[0]
+            )
+            self._head = 0
+            self.dirty = False
+
+        i = self._head
+        if lower is not None:
+            find = bisect.bisect_left if inclusive else bisect.bisect_right
+            i = max(i, find(self._entries, lower, key=lambda entry: entry[0]))
+        while i < len(self._entries):
+            value, _id = self._entries[i]
+            doc = docs.get(_id)
+            if doc is None or doc.get(self.field) != value:
+                # Stale entry; leading ones are skipped for good
+                if i == self._head:
+                    self._head += 1
+            else:
+                yield doc
+            i += 1
+
+
+class FakeCursor:
+    def __init__(self, collection: "FakeCollection", query: dict | None, projection: dict | None):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = None
+        self._limit = 0
+
+    def sort(self, key, direction: int = 1) -> "FakeCursor":
+        if isinstance(key, list):
+            key, direction = key[0]
+        self._sort = (key, direction)
+        return self
+
+    def limit(self, limit: int) -> "FakeCursor":
+        self._limit = limit
+        return self
+
+    def __iter__(self):
+        return iter(self._collection._find(self._query, self._projection, self._sort, self._limit))
+
+
+class FakeCollection:
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self._docs = {}
+        self._indexes = {"_id": _SortedIndex("_id")}
+        self._lock = threading.RLock()
+
+    # --- helpers ---
+
+    def _wait(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _mark_changed(self, fields) -> None:
+        for field in fields:
+            index = self._indexes.get(field)
+            if index is not None:
+                index.dirty = True
+
+    def _find(self, query, projection, sort, limit) -> list:
+        self._wait()
+        with self._lock:
+            if sort and sort[1] == 1 and sort[0] in self._indexes:
+                field = sort[0]
+                # Bounds on the sorted field let the scan start late and stop early
+                bound = query.get(field, {}) if query else {}
+                if not isinstance(bound, dict):
+                    bound = {}
+                upper = bound.get("$lte")
+                lower = bound.get("$gt", bound.get("$gte"))
+                results = []
+                for doc in self._indexes[field].scan(self._docs, lower, inclusive="$gte" in bound):
+                    if upper is not None and doc[field] > upper:
+                        break
+                    if _matches(doc, query):
+                        results.append(_project(doc, projection))
+                        if limit and len(results) >= limit:
+                            break
+                return results
+
+            matching = [doc for doc in self._docs.values() if _matches(doc, query)]
+            if sort:
+                field, direction = sort
+                if limit:
+                    pick = heapq.nsmallest if direction == 1 else heapq.nlargest
+                    matching = pick(limit, matching, key=lambda doc: doc.get(field))
+                else:
+                    matching.sort(key=lambda doc: doc.get(field), reverse=direction == -1)
+            if limit:
+                matching = matching[:limit]
+            return [_project(doc, projection) for doc in matching]
+
+    def _upsert_doc(self, query: dict) -> dict:
+        return {key: value for key, value in query.items() if not key.startswith("$") and not isinstance(value, dict)}
+
+    def _update(self, query, update, upsert, many=False):
+        if query and "_id" in query and not isinstance(query["_id"], dict):
+            doc = self._docs.get(query["_id"])
+            matched = [doc] if doc is not None and _matches(doc, query) else []
+        else:
+            matched = [doc for doc in self._docs.values() if _matches(doc, query)]
+        if not many:
+            matched = matched[:1]
+
+        changed_fields = [field for fields in update.values() for field in fields]
+        for doc in matched:
+            _apply_update(doc, update, inserting=False)
+        if matched:
+            self._mark_changed(changed_fields)
+            return SimpleNamespace(matched_count=len(matched), modified_count=len(matched), upserted_id=None)
+
+        if upsert:
+            doc = self._upsert_doc(query or {})
+            _apply_update(doc, update, inserting=True)
+            self._insert(doc)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    def _insert(self, doc: dict) -> None:
+        if "_id" not in doc:
+            doc["_id"] = id(doc)
+        if doc["_id"] in self._docs:
+            raise DuplicateKeyError(f"Duplicate _id {doc['_id']!r} in {self.name}")
+        self._docs[doc["_id"]] = doc
+        self._mark_changed(doc.keys())
+
+    # --- pymongo Collection API ---
+
+    def create_index(self, keys, **kwargs) -> str:
+        field = keys if isinstance(keys, str) else keys[0][0]
+        with self._lock:
+            self._indexes.setdefault(field, _SortedIndex(field))
+        return f"{field}_1"
+
+    def find(self, query: dict | None = None, projection: dict | None = None) -> FakeCursor:
+        return FakeCursor(self, query, projection)
+
+    def find_one(self, query: dict | None = None, projection: dict | None = None, sort=None):
+        results = self._find(query, projection, sort[0] if sort else None, 1)
+        return results[0] if results else None
+
+    def insert_one(self, doc: dict):
+        self._wait()
+        with self._lock:
+            self._insert(dict(doc))
+        return SimpleNamespace(inserted_id=doc.get("_id"))
+
+    def insert_many(self, docs: list, ordered: bool = True):
+        self._wait()
+        with self._lock:
+            for doc in docs:
+                self._insert(dict(doc))
+        return SimpleNamespace(inserted_ids=[doc.get("_id") for doc in docs])
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False):
+        self._wait()
+        with self._lock:
+            return self._update(query, update, upsert)
+
+    def update_many(self, query: dict, update: dict, upsert: bool = False):
+        self._wait()
+        with self._lock:
+            return self._update(query, update, upsert, many=True)
+
+    def find_one_and_update(self, query: dict, update: dict, upsert: bool = False,
+                            return_document: bool = pymongo.ReturnDocument.BEFORE, projection=None):
+        self._wait()
+        with self._lock:
+            existing = self._docs.get(query["_id"]) if "_id" in query else None
+            before = dict(existing) if existing is not None and _matches(existing, query) else None
+            result = self._update(query, update, upsert)
+            if return_document == pymongo.ReturnDocument.BEFORE:
+                return _project(before, projection) if before else None
+            _id = before["_id"] if before else result.upserted_id
+            return _project(self._docs[_id], projection) if _id is not None else None
+
+    def delete_one(self, query: dict):
+        return self._delete(query, many=False)
+
+    def delete_many(self, query: dict):
+        return self._delete(query, many=True)
+
+    def _delete(self, query, many):
+        self._wait()
+        with self._lock:
+            if query and list(query) == ["$or"] and all("_id" in sub for sub in query["$or"]):
+                # Fast path for the removal sweeper's {"$or": [{"_id": ..., ...}]} deletes
+                ids = [sub["_id"] for sub in query["$or"]
+                       if sub["_id"] in self._docs and _matches(self._docs[sub["_id"]], sub)]
+            elif query and "_id" in query and not isinstance(query["_id"], dict):
+                doc = self._docs.get(query["_id"])
+                ids = [query["_id"]] if doc is not None and _matches(doc, query) else []
+            else:
+                ids = [_id for _id, doc in self._docs.items() if _matches(doc, query)]
+            if not many:
+                ids = ids[:1]
+            for _id in ids:
+                del self._docs[_id]
+            return SimpleNamespace(deleted_count=len(ids))
+
+    def bulk_write(self, operations: list, ordered: bool = True):
+        self._wait()
+        with self._lock:
+            for operation in operations:
+                if isinstance(operation, pymongo.UpdateOne):
+                    self._update(operation._filter, operation._doc, operation._upsert)
+                elif isinstance(operation, pymongo.UpdateMany):
+                    self._update(operation._filter, operation._doc, operation._upsert, many=True)
+                elif isinstance(operation, pymongo.InsertOne):
+                    self._insert(dict(operation._doc))
+                elif isinstance(operation, pymongo.ReplaceOne) and list(operation._filter) == ["_id"]:
+                    # Only replacing by _id, which is all storage/mongo.py does
+                    doc = dict(operation._doc)
+                    if operation._filter["_id"] in self._docs:
+                        self._docs[operation._filter["_id"]] = doc
+                        self._mark_changed(doc.keys())
+                    elif operation._upsert:
+                        self._insert(doc)
+                else:
+                    raise NotImplementedError(f"{type(operation).__name__} is not supported by the fake database")
+        return SimpleNamespace(acknowledged=True)
+
+    def count_documents(self, query: dict) -> int:
+        self._wait()
+        with self._lock:
+            if not query:
+                return len(self._docs)
+            return sum(1 for doc in self._docs.values() if _matches(doc, query))
+
+    def estimated_document_count(self) -> int:
+        return len(self._docs)
+
+
+class FakeDatabase:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._collections = {}
+
+    def get_collection(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, self.latency)
+        return self._collections[name]
+
+    def command(self, command: str, *args, **kwargs) -> dict:
+        return {"ok": 1.0}
+
+    __getitem__ = get_collection
+
+
+class FakeMongoClient:
+    """Drop-in for pymongo.MongoClient; every client shares the same in-memory data."""
+
+    latency = 0.0
+    _databases = {}
+
+    def __init__(self, *args, **kwargs):
+        self.admin = FakeDatabase()
+
+    def get_database(self, name: str) -> FakeDatabase:
+        if name not in self._databases:
+            self._databases[name] = FakeDatabase(self.latency)
+        return self._databases[name]
+
+    __getitem__ = get_database
+
+    def close(self) -> None:
+        pass
+
+
+def install(latency: float = 0.0) -> None:
+    """
+    Makes `from pymongo import MongoClient` return the fake client. Must be called
+    before storage/mongo.py is imported.
+    """
+    FakeMongoClient.latency = latency
+    pymongo.MongoClient = FakeMongoClient
@@ -0,0 +1,335 @@
+"""
+Replays a capture recorded with CAPTURE_PATH (see capture.py) against the real
+handlers, FakeBotAPI and an in-memory stand-in for MongoDB (or a real storage
+backend picked with --storage), to find where a traffic spike overwhelms the bot:
+
+    python -m bench.replay capture.jsonl.gz --speed 1
+    python -m bench.replay capture.jsonl.gz --speed 10 --removals
+    python -m bench.replay capture.jsonl.gz --speed 0 --max-backlog 5000
+
+Updates arrive at their recorded pace divided by --speed; --speed 0 feeds them as
+fast as the bot takes them, keeping at most --max-backlog unfinished. Printed are
+the arrival to completion latencies per kind of update (start, track_joins, other
+commands), the time spent in each handler and the backlog for every second of the
+replay. A backlog that keeps growing means the bot cannot keep up at that speed.
+With --removals, the removals scheduled during the replay are made due afterwards
+and swept, measured per member.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from bench.fake_api import FakeBotAPI
+from bench.run import BENCH_TOKEN, ADMIN_ID, CHANNEL_ID, Result, timed
+
+
+def update_kind(data: dict) -> str:
+    """The name an update is reported under: start, track_joins, the command or the update type."""
+    if "chat_member" in data:
+        return "track_joins"
+    message = data.get("message")
+    if message is not None:
+        text = message.get("text") or ""
+        if text.startswith("/"):
+            return text.split(maxsplit=1)[0][1:].split("@")[0] or "other"
+        return "message"
+    return next((key for key in data if key != "update_id"), "other")
+
+
+def capture_summary(path: str) -> tuple:
+    """The most frequent chat_member chat (the channel) and the users seen, read in one pass."""
+    from capture import read_capture
+
+    chats = Counter()
+    user_ids = set()
+    for _, data in read_capture(path):
+        member = data.get("chat_member")
+        if member is not None:
+            chats[member["chat"]["id"]] += 1
+            user_ids.add(member["new_chat_member"]["user"]["id"])
+        message = data.get("message")
+        if message is not None and "from" in message:
+            user_ids.add(message["from"]["id"])
+    user_ids.discard(ADMIN_ID)
+    channel_id = chats.most_common(1)[0][0] if chats else CHANNEL_ID
+    return channel_id, sorted(user_ids)
+
+
+class Replay:
+    """Feeds captured updates to the application on schedule and tracks the backlog."""
+
+    def __init__(self, application, speed: float, max_backlog: int):
+        self.application = application
+        self.speed = speed
+        self.max_backlog = max_backlog
+        self.results = {}
+        self.arrived = 0
+        self.completed = 0
+        # (second, arrived, completed, backlog, running, waiting) once per second of the replay
+        self.timeline = []
+        self._tasks = set()
+        self._done = asyncio.Event()
+
+    @property
+    def backlog(self) -> int:
+        return self.arrived - self.completed
+
+    async def _process(self, update, kind: str, arrived_at: float) -> None:
+        processor = self.application.update_processor
+        try:
+            await processor.process_update(update, self.application.process_update(update))
+        finally:
+            self.results[kind].latencies.append(time.perf_counter() - arrived_at)
+            self.completed += 1
+            self._done.set()
+
+    async def _record_timeline(self, started_at: float) -> None:
+        processor = self.application.update_processor
+        second = 0
+        while True:
+            second += 1
+            await asyncio.sleep(max(0.0, started_at + second - time.perf_counter()))
+            self.timeline.append(
+                (second, self.arrived, self.completed, self.backlog, processor.in_progress(), processor.waiting())
+            )
+
+    async def run(self, captured) -> float:
+        """Replays (epoch seconds, update dict) pairs and returns the wall time."""
+        from telegram import Update
+
+        started_at = time.perf_counter()
+        recorder = asyncio.create_task(self._record_timeline(started_at))
+        first_at = None
+        try:
+            for captured_at, data in captured:
+                if first_at is None:
+                    first_at = captured_at
+                if self.speed > 0:
+                    arrive_at = started_at + (captured_at - first_at) / self.speed
+                    await asyncio.sleep(max(0.0, arrive_at - time.perf_counter()))
+                    # Measured from the scheduled arrival, so a late feeder still shows up as latency
+                    arrived_at = arrive_at
+                else:
+                    while self.backlog >= self.max_backlog:
+                        self._done.clear()
+                        await self._done.wait()
+                    arrived_at = time.perf_counter()
+
+                kind = update_kind(data)
+                if kind not in self.results:
+                    self.results[kind] = Result(kind)
+                update = Update.de_json(data, self.application.bot)
+                self.arrived += 1
+                task = asyncio.create_task(self._process(update, kind, arrived_at))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+            while self._tasks:
+                await asyncio.gather(*self._tasks)
+        finally:
+            recorder.cancel()
+
+        wall_time = time.perf_counter() - started_at
+        for result in self.results.values():
+            result.wall_time = wall_time
+        return wall_time
+
+
+def print_timeline(timeline: list, rows: int) -> None:
+    """Prints the backlog per second, thinned out to about `rows` lines (the peak is always shown)."""
+    if not timeline:
+        return
+    step = max(1, len(timeline) // rows)
+    peak = max(timeline, key=lambda row: row[3])
+    print(f"{'second':>7} {'arrived':>9} {'completed':>10} {'backlog':>9} {'running':>8} {'waiting':>8}")
+    for row in timeline:
+        if row[0] % step == 0 or row is peak or row is timeline[-1]:
+            print(f"{row[0]:>7} {row[1]:>9} {row[2]:>10} {row[3]:>9} {row[4]:>8} {row[5]:>8}")
+    print(f"Peak backlog: {peak[3]} updates after {peak[0]} seconds")
+
+
+async def run(args: argparse.Namespace) -> list:
+    # Imported here so the environment and the fake database are in place first
+    import database
+    import jobs
+    from broadcaster import broadcaster
+    from capture import read_capture
+    from counters import counters
+    from known_users import known_users
+    from link_pool import invite_link_pool
+    from notifications import join_notifier
+    from shortener import shortener_client
+    from telegram.ext import Application, ExtBot
+    from main import register_handlers
+    from metrics import InstrumentedRequest, instrument_handlers, handler_latency, render
+    from scheduler import OutboundScheduler
+    from concurrency import OrderedUpdateProcessor
+
+    channel_id, user_ids = capture_summary(args.capture)
+    if args.channel_id is not None:
+        channel_id = args.channel_id
+
+    api = FakeBotAPI(
+        latency=args.api_latency,
+        jitter=args.api_jitter,
+        rate_limit_probability=args.rate_limit,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    bot = ExtBot(BENCH_TOKEN, request=InstrumentedRequest(api), rate_limiter=OutboundScheduler(rate=args.api_rate))
+    application = Application.builder().bot(bot).concurrent_updates(OrderedUpdateProcessor(args.concurrency)).build()
+    register_handlers(application)
+    instrument_handlers(application)
+    await application.initialize()
+    await database.connect()
+    await database.ensure_indexes()
+    await shortener_client.start()
+
+    settings = {
+        "channel_id": channel_id,
+        "invite_duration_seconds": args.invite_duration,
+        "join_notify_mode": args.join_mode,
+    }
+    if args.shortener_latency is not None:
+        async def fake_shortener_request(api_url: str, params: dict, long_url: str):
+            await asyncio.sleep(args.shortener_latency)
+            return f"https://short.bench/{abs(hash(long_url))}", False
+        shortener_client._request = fake_shortener_request
+        settings.update(shortener_domain="short.bench", shortener_api="bench")
+    await database.update_admin_settings(settings)
+
+    if args.existing_users:
+        # As if everyone in the capture had started the bot before it was recorded
+        for i in range(0, len(user_ids), 100_000):
+            database.storage.insert_users(
+                [{"_id": user_id, "has_received_free_link": True, "last_link_timestamp": None}
+                 for user_id in user_ids[i:i + 100_000]]
+            )
+    await known_users.load()
+
+    replay = Replay(application, args.speed, args.max_backlog)
+    before = handler_latency.snapshot()
+    results = []
+
+    try:
+        wall_time = await replay.run(read_capture(args.capture))
+        results.extend(sorted(replay.results.values(), key=lambda result: len(result.latencies), reverse=True))
+
+        if args.removals:
+            result = Result("removals")
+            now = time.time()
+            # Everything scheduled during the replay becomes due now
+            for doc in await database.get_due_removals(float("inf"), 10**9):
+                database.storage.set_removal(doc["user_id"], doc["channel_id"], now - 1)
+            jobs.remove_member = timed(jobs.remove_member, result)
+            started_at = time.perf_counter()
+            await jobs.remove_member_job(SimpleNamespace(bot=application.bot, job_queue=application.job_queue))
+            result.wall_time = time.perf_counter() - started_at
+            results.append(result)
+    finally:
+        await broadcaster.close()
+        await join_notifier.flush(application.bot)
+        await invite_link_pool.close()
+        await shortener_client.close()
+        await database.user_writes.close()
+        await counters.close()
+        await application.shutdown()
+        await database.disconnect()
+
+    if args.metrics:
+        print(render())
+
+    speed = f"{args.speed:g}x" if args.speed > 0 else "as fast as possible"
+    print(f"Replayed {replay.arrived} updates at {speed} in {wall_time:.2f}s "
+          f"(channel {channel_id}, {len(user_ids)} users in the capture)")
+    print()
+    print_timeline(replay.timeline, args.timeline_rows)
+    print()
+
+    print(f"{'handler':<24} {'calls':>9} {'total':>10} {'avg ms':>9}")
+    for labels, (count, total) in sorted(handler_latency.snapshot().items()):
+        old_count, old_total = before.get(labels, (0, 0.0))
+        if count > old_count:
+            calls, seconds = count - old_count, total - old_total
+            print(f"{'/'.join(map(str, labels)):<24} {calls:>9} {seconds:>9.2f}s {seconds / calls * 1000:>9.2f}")
+    print()
+
+    calls = ", ".join(f"{method}={count}" for method, count in api.calls.most_common())
+    limited = sum(api.rate_limited.values())
+    print(f"Bot API calls: {calls}")
+    print(f"Answered with 429: {limited}")
+    return results
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Replays a captured update stream against the bot.")
+    parser.add_argument("capture", help="Capture file written with CAPTURE_PATH.")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed relative to the recording, e.g. 1 or 10; 0 replays as fast as possible.")
+    parser.add_argument("--max-backlog", type=int, default=10_000,
+                        help="With --speed 0, unfinished updates at which feeding pauses.")
+    parser.add_argument("--existing-users", action="store_true",
+                        help="Insert every user in the capture into the database before replaying.")
+    parser.add_argument("--removals", action="store_true",
+                        help="Afterwards, make the removals scheduled during the replay due and sweep them.")
+    parser.add_argument("--channel-id", type=int, default=None,
+                        help="Channel to configure; defaults to the chat most chat_member updates are for.")
+    parser.add_argument("--invite-duration", type=int, default=3600, help="invite_duration_seconds to configure.")
+    parser.add_argument("--concurrency", type=int, default=64, help="Updates processed at the same time.")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="Seconds per Bot API call.")
+    parser.add_argument("--api-jitter", type=float, default=0.01, help="Extra random seconds per Bot API call.")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of Bot API calls answered with 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after sent with a 429.")
+    parser.add_argument("--api-rate", type=float, default=30.0, help="Bot API calls per second allowed by the scheduler.")
+    parser.add_argument("--storage", choices=("mongo", "sqlite", "memory"), default="mongo",
+                        help="Storage backend; mongo uses the in-memory stand-in for MongoDB, sqlite a temporary file.")
+    parser.add_argument("--db-latency", type=float, default=0.001,
+                        help="Seconds per database operation of the MongoDB stand-in.")
+    parser.add_argument("--shortener-latency", type=float, default=None,
+                        help="Configure a fake shortener that answers after this many seconds.")
+    parser.add_argument("--join-mode", choices=("realtime", "digest"), default="realtime")
+    parser.add_argument("--timeline-rows", type=int, default=30, help="About how many backlog rows to print.")
+    parser.add_argument("--metrics", action="store_true", help="Print the Prometheus metrics after the run.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    if args.speed < 0:
+        parser.error("--speed must not be negative")
+    if args.max_backlog < 1:
+        parser.error("--max-backlog must be at least 1")
+    return args
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=args.log_level.upper())
+
+    # Never pick up real credentials from .env; captures record the admin as ADMIN_ID
+    os.environ["TELEGRAM_BOT_TOKEN"] = BENCH_TOKEN
+    os.environ["ADMIN_USER_ID"] = str(ADMIN_ID)
+    os.environ["STORAGE_BACKEND"] = args.storage
+    os.environ["MONGO_DB_URI"] = "mongodb://bench.invalid"
+    # A replay must not capture itself
+    os.environ["CAPTURE_PATH"] = ""
+    if args.storage == "mongo":
+        from bench import fake_mongo
+        fake_mongo.install(args.db_latency)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["SQLITE_PATH"] = os.path.join(directory, "bench.db")
+        results = asyncio.run(run(args))
+
+    print()
+    print(f"{'update kind':<16} {'ops':>9} {'wall':>10} {'throughput':>12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for result in results:
+        print(result.report())
+
+
+if __name__ == "__main__":
+    main()
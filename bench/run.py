@@ -0,0 +1,329 @@
+"""
+Offline benchmarks for the bot.
+
+Runs the real handlers and jobs against FakeBotAPI and an in-memory stand-in for
+MongoDB (or a real storage backend picked with --storage), so no network,
+Telegram token or MongoDB is needed:
+
+    python -m bench.run --users 100000 --api-latency 0.03 --db-latency 0.001
+    python -m bench.run --users 100000 --storage sqlite
+
+Scenarios:
+    start_new        /start from users who are not in the database yet
+    start_returning  /start from existing users (direct or shortened link)
+    start_repeated   bursts of five /starts from the same existing user
+    track_joins      chat_member updates for users joining the channel
+    broadcast        /broadcast to every user, measured per message
+    removals         the expiry sweeper removing due members, measured per member
+
+For every scenario the number of operations, wall time, throughput and
+p50/p95/p99 latency are printed.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+
+from bench.fake_api import FakeBotAPI, BOT_USER
+
+BENCH_TOKEN = f"{BOT_USER['id']}:bench"
+ADMIN_ID = 1
+CHANNEL_ID = -1001234567890
+# Simulated users get IDs from here on, so they never collide with the admin
+FIRST_USER_ID = 10_000
+
+SCENARIOS = ("start_new", "start_returning", "start_repeated", "track_joins", "broadcast", "removals")
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Result:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.wall_time = 0.0
+
+    def report(self) -> str:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        throughput = count / self.wall_time if self.wall_time else 0.0
+        p50, p95, p99 = (percentile(latencies, f) * 1000 for f in (0.50, 0.95, 0.99))
+        return (
+            f"{self.name:<16} {count:>9} {self.wall_time:>9.2f}s {throughput:>10.1f}/s "
+            f"{p50:>9.2f} {p95:>9.2f} {p99:>9.2f}"
+        )
+
+
+def timed(func, result: Result):
+    """Wraps a coroutine function so every call's duration is added to `result`."""
+    async def wrapper(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            result.latencies.append(time.perf_counter() - started_at)
+    return wrapper
+
+
+def _user(user_id: int) -> dict:
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+
+def start_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+def command_update(update_id: int, user_id: int, text: str) -> dict:
+    update = start_update(update_id, user_id)
+    update["message"]["text"] = text
+    update["message"]["entities"][0]["length"] = len(text.split()[0])
+    return update
+
+
+def join_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "chat_member": {
+            "chat": {"id": CHANNEL_ID, "type": "channel", "title": "Bench Channel"},
+            "from": _user(user_id),
+            "date": int(time.time()),
+            "old_chat_member": {"status": "left", "user": _user(user_id)},
+            "new_chat_member": {"status": "member", "user": _user(user_id)},
+        },
+    }
+
+
+async def process_updates(application, updates: list, concurrency: int, result: Result) -> None:
+    """Feeds updates to the application with at most `concurrency` in flight."""
+    from telegram import Update
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process(data: dict) -> None:
+        async with semaphore:
+            update = Update.de_json(data, application.bot)
+            started_at = time.perf_counter()
+            # Through the update processor like in production, so one user's updates wait for each other
+            await application.update_processor.process_update(update, application.process_update(update))
+            result.latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(process(data) for data in updates))
+    result.wall_time = time.perf_counter() - started_at
+
+
+async def run(args: argparse.Namespace) -> list:
+    # Imported here so the environment and the fake database are in place first
+    import database
+    import jobs
+    from broadcaster import broadcaster
+    from counters import counters
+    from known_users import known_users
+    from link_pool import invite_link_pool
+    from notifications import join_notifier
+    from shortener import shortener_client
+    from telegram import Update
+    from telegram.ext import Application, ExtBot
+    from main import register_handlers
+    from metrics import InstrumentedRequest, instrument_handlers, render
+    from scheduler import OutboundScheduler
+    from concurrency import OrderedUpdateProcessor
+
+    api = FakeBotAPI(
+        latency=args.api_latency,
+        jitter=args.api_jitter,
+        rate_limit_probability=args.rate_limit,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    # Instrumented and scheduled like production, so the benchmark includes that overhead
+    bot = ExtBot(BENCH_TOKEN, request=InstrumentedRequest(api), rate_limiter=OutboundScheduler(rate=args.api_rate))
+    application = Application.builder().bot(bot).concurrent_updates(OrderedUpdateProcessor(args.concurrency)).build()
+    register_handlers(application)
+    instrument_handlers(application)
+    await application.initialize()
+    await database.connect()
+    await database.ensure_indexes()
+    await shortener_client.start()
+
+    settings = {"channel_id": CHANNEL_ID, "invite_duration_seconds": 3600, "join_notify_mode": args.join_mode}
+    if args.shortener_latency is not None:
+        async def fake_shortener_request(api_url: str, params: dict, long_url: str):
+            await asyncio.sleep(args.shortener_latency)
+            return f"https://short.bench/{abs(hash(long_url))}", False
+        shortener_client._request = fake_shortener_request
+        settings.update(shortener_domain="short.bench", shortener_api="bench")
+    await database.update_admin_settings(settings)
+
+    # Existing users, inserted directly so that large populations load quickly
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    for i in range(0, len(user_ids), 100_000):
+        database.storage.insert_users(
+            [{"_id": user_id, "has_received_free_link": True, "last_link_timestamp": None}
+             for user_id in user_ids[i:i + 100_000]]
+        )
+    # Loaded at startup in production, so join events are matched in memory
+    await known_users.load()
+
+    rng = random.Random(args.seed)
+    requests = min(args.requests, args.users)
+    update_ids = iter(range(1, 10**12))
+    results = []
+
+    try:
+        if "start_new" in args.scenarios:
+            result = Result("start_new")
+            new_ids = range(FIRST_USER_ID + args.users, FIRST_USER_ID + args.users + requests)
+            await process_updates(
+                application, [start_update(next(update_ids), user_id) for user_id in new_ids],
+                args.concurrency, result
+            )
+            results.append(result)
+
+        if "start_returning" in args.scenarios:
+            result = Result("start_returning")
+            await process_updates(
+                application, [start_update(next(update_ids), user_id) for user_id in rng.sample(user_ids, requests)],
+                args.concurrency, result
+            )
+            results.append(result)
+
+        if "start_repeated" in args.scenarios:
+            result = Result("start_repeated")
+            await process_updates(
+                application, [start_update(next(update_ids), user_id)
+                              for user_id in rng.sample(user_ids, max(1, requests // 5)) for _ in range(5)],
+                args.concurrency, result
+            )
+            results.append(result)
+
+        if "track_joins" in args.scenarios:
+            result = Result("track_joins")
+            await process_updates(
+                application, [join_update(next(update_ids), user_id) for user_id in rng.sample(user_ids, requests)],
+                args.concurrency, result
+            )
+            results.append(result)
+
+        if "broadcast" in args.scenarios:
+            result = Result("broadcast")
+            broadcaster.rate = args.broadcast_rate
+            broadcaster._send = timed(broadcaster._send, result)
+            started_at = time.perf_counter()
+            await application.process_update(Update.de_json(
+                command_update(next(update_ids), ADMIN_ID, "/broadcast Benchmark message"), application.bot
+            ))
+            await broadcaster.wait()
+            result.wall_time = time.perf_counter() - started_at
+            results.append(result)
+
+        if "removals" in args.scenarios:
+            result = Result("removals")
+            now = time.time()
+            # Replaces the removals the /start scenarios already scheduled for some of these users
+            for user_id in rng.sample(user_ids, requests):
+                database.storage.set_removal(user_id, CHANNEL_ID, now - 1)
+            jobs.remove_member = timed(jobs.remove_member, result)
+            started_at = time.perf_counter()
+            await jobs.remove_member_job(SimpleNamespace(bot=application.bot, job_queue=application.job_queue))
+            result.wall_time = time.perf_counter() - started_at
+            results.append(result)
+    finally:
+        await broadcaster.close()
+        await join_notifier.flush(application.bot)
+        await invite_link_pool.close()
+        await shortener_client.close()
+        await database.user_writes.close()
+        await counters.close()
+        await application.shutdown()
+        await database.disconnect()
+
+    if args.metrics:
+        print(render())
+
+    calls = ", ".join(f"{method}={count}" for method, count in api.calls.most_common())
+    limited = sum(api.rate_limited.values())
+    print(f"Bot API calls: {calls}")
+    print(f"Answered with 429: {limited}")
+    return results
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the bot.")
+    parser.add_argument("--users", type=int, default=10_000, help="Existing users in the database (1k-1M).")
+    parser.add_argument("--requests", type=int, default=10_000,
+                        help="Updates (or removals) per scenario, at most --users.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma separated subset of: {', '.join(SCENARIOS)}.")
+    parser.add_argument("--concurrency", type=int, default=100, help="Updates processed at the same time.")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="Seconds per Bot API call.")
+    parser.add_argument("--api-jitter", type=float, default=0.01, help="Extra random seconds per Bot API call.")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Fraction of Bot API calls answered with 429.")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after sent with a 429.")
+    parser.add_argument("--api-rate", type=float, default=1000.0,
+                        help="Bot API calls per second allowed by the scheduler (the bot default is much lower).")
+    parser.add_argument("--storage", choices=("mongo", "sqlite", "memory"), default="mongo",
+                        help="Storage backend; mongo uses the in-memory stand-in for MongoDB, sqlite a temporary file.")
+    parser.add_argument("--db-latency", type=float, default=0.001,
+                        help="Seconds per database operation of the MongoDB stand-in.")
+    parser.add_argument("--shortener-latency", type=float, default=None,
+                        help="Configure a fake shortener that answers after this many seconds.")
+    parser.add_argument("--broadcast-rate", type=float, default=1000.0,
+                        help="Broadcast messages per second (the bot default is much lower).")
+    parser.add_argument("--join-mode", choices=("realtime", "digest"), default="realtime")
+    parser.add_argument("--metrics", action="store_true", help="Print the Prometheus metrics after the run.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=args.log_level.upper())
+
+    # Never pick up real credentials from .env
+    os.environ["TELEGRAM_BOT_TOKEN"] = BENCH_TOKEN
+    os.environ["ADMIN_USER_ID"] = str(ADMIN_ID)
+    os.environ["STORAGE_BACKEND"] = args.storage
+    os.environ["MONGO_DB_URI"] = "mongodb://bench.invalid"
+    if args.storage == "mongo":
+        from bench import fake_mongo
+        fake_mongo.install(args.db_latency)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["SQLITE_PATH"] = os.path.join(directory, "bench.db")
+        results = asyncio.run(run(args))
+
+    print(f"{'scenario':<16} {'ops':>9} {'wall':>10} {'throughput':>12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for result in results:
+        print(result.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import time
+from telegram import Bot
+from telegram.error import TelegramError
+
+from config import BROADCAST_RATE, BROADCAST_BATCH_SIZE, BROADCAST_CHECKPOINT_SIZE, BROADCAST_PROGRESS_INTERVAL
+from database import (
+    count_reachable_users, get_user_ids_after, create_broadcast, get_running_broadcast, update_broadcast
+)
+from ratelimit import TokenBucket
+from cluster import owns_shard
+from scheduler import PRIORITY_BROADCAST
+from reachability import is_permanent_failure, mark_unreachable
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+def _progress_bar(done: int, total: int, bar_length: int = 10) -> str:
+    progress = min(1.0, done / total) if total else 1.0
+    filled_length = int(bar_length * progress)
+    return '█' * filled_length + '░' * (bar_length - filled_length)
+
+
+def format_status(broadcast: dict) -> str:
+    """Builds the progress text shown to the admin for a broadcast."""
+    done = broadcast["sent"] + broadcast["failed"]
+    total = broadcast["total"]
+
+    if broadcast["status"] == "done":
+        header = "✅ Broadcast complete!"
+    elif broadcast["status"] == "cancelled":
+        header = "🛑 Broadcast cancelled."
+    else:
+        header = "📣 Broadcast in progress..."
+
+    text = (
+        f"{header}\n{_progress_bar(done, total)}\n"
+        f"Sent: {broadcast['sent']}/{total}\n"
+        f"Failed: {broadcast['failed']}"
+    )
+    if broadcast["status"] == "running":
+        text += "\nIf the bot restarts, the last few users before the restart may get the message twice."
+    return text
+
+
+class Broadcaster:
+    """
+    Sends a message to every reachable user. User IDs are streamed from the database in
+    batches and each batch is sent concurrently under a token-bucket rate limit.
+
+    Delivery is at least once: progress (the last user whose message and all earlier
+    ones are done) is saved every `checkpoint_size` users, and a broadcast resumes from
+    there after a restart, so the users after that checkpoint, up to `checkpoint_size`
+    plus the messages in flight, may get the message twice.
+
+    Messages go out at the lowest priority, so they only use the Bot API budget that
+    user-facing calls leave over. Only one broadcast runs at a time.
+    """
+
+    def __init__(
+        self,
+        rate: float = BROADCAST_RATE,
+        batch_size: int = BROADCAST_BATCH_SIZE,
+        checkpoint_size: int = BROADCAST_CHECKPOINT_SIZE,
+    ):
+        self.rate = rate
+        self.batch_size = batch_size
+        self.checkpoint_size = max(1, checkpoint_size)
+        self.current = None
+        self._task = None
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, bot: Bot, text: str, chat_id: int) -> dict | None:
+        """
+        Starts a new broadcast and reports progress by editing a status message in `chat_id`.
+        Returns None if there are no users to broadcast to.
+        """
+        total = await count_reachable_users()
+        if not total:
+            return None
+
+        status_message = await bot.send_message(chat_id=chat_id, text=f"📣 Starting broadcast... Sent to 0/{total}.")
+        broadcast = {
+            "_id": int(time.time() * 1000),
+            "text": text,
+            "status": "running",
+            "total": total,
+            "sent": 0,
+            "failed": 0,
+            "last_user_id": None,
+            "chat_id": chat_id,
+            "status_message_id": status_message.message_id,
+            "started_at": time.time(),
+        }
+        await create_broadcast(broadcast)
+        self._launch(bot, broadcast)
+        return broadcast
+
+    async def resume(self, bot: Bot) -> None:
+        """
+        Continues a broadcast that was interrupted by a restart. Called once at startup.
+        """
+        broadcast = await get_running_broadcast()
+        if broadcast and not self.is_running():
+            logger.info(
+                "Resuming broadcast %s after user %s (%s sent, %s failed).",
+                broadcast["_id"], broadcast["last_user_id"], broadcast["sent"], broadcast["failed"]
+            )
+            self._launch(bot, broadcast)
+
+    async def wait(self) -> None:
+        """Waits until the running broadcast has finished."""
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def cancel(self) -> bool:
+        """Stops the running broadcast. Returns False if none is running."""
+        if not self.is_running():
+            return False
+        self.current["status"] = "cancelled"
+        self._task.cancel()
+        await update_broadcast(self.current["_id"], {"status": "cancelled"})
+        return True
+
+    async def close(self) -> None:
+        """
+        Stops the broadcast task at shutdown without marking it cancelled, so it is
+        resumed from its last checkpoint on the next start.
+        """
+        if self.is_running():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def _launch(self, bot: Bot, broadcast: dict) -> None:
+        self.current = broadcast
+        self._task = asyncio.create_task(self._run(bot, broadcast))
+
+    async def _send(self, bot: Bot, bucket: TokenBucket, user_id: int, text: str) -> bool:
+        await bucket.acquire()
+        try:
+            # The scheduler already waited out and retried any RetryAfter
+            await bot.send_message(
+                chat_id=user_id, text=text, parse_mode='HTML', rate_limit_args={"priority": PRIORITY_BROADCAST}
+            )
+            return True
+        except TelegramError as e:
+            if is_permanent_failure(e):
+                # Skipped by every later broadcast
+                await mark_unreachable(user_id, e)
+            else:
+                logger.warning("Failed to send broadcast to user %s: %s", user_id, e)
+            return False
+
+    async def _checkpoint(self, broadcast: dict) -> None:
+        # A user may have joined after the broadcast started
+        broadcast["total"] = max(broadcast["total"], broadcast["sent"] + broadcast["failed"])
+        await update_broadcast(broadcast["_id"], {
+            "sent": broadcast["sent"],
+            "failed": broadcast["failed"],
+            "last_user_id": broadcast["last_user_id"],
+            "total": broadcast["total"],
+        })
+
+    async def _edit_status(self, bot: Bot, broadcast: dict) -> None:
+        try:
+            await bot.edit_message_text(
+                chat_id=broadcast["chat_id"],
+                message_id=broadcast["status_message_id"],
+                text=format_status(broadcast),
+                rate_limit_args={"priority": PRIORITY_BROADCAST}
+            )
+        except TelegramError:
+            pass  # Ignore if editing fails (e.g., message not modified)
+
+    async def _run(self, bot: Bot, broadcast: dict) -> None:
+        bucket = TokenBucket(self.rate)
+        last_edit_at = time.monotonic()
+
+        try:
+            while True:
+                if not owns_shard():
+                    # Another worker has taken over; it resumes from the last checkpoint
+                    logger.warning(
+                        "Broadcast %s stopped because this worker no longer owns its shard.", broadcast["_id"]
+                    )
+                    return
+
+                batch = await get_user_ids_after(broadcast["last_user_id"], self.batch_size)
+                if not batch:
+                    break
+
+                sends = [asyncio.create_task(self._send(bot, bucket, user_id, broadcast["text"])) for user_id in batch]
+                try:
+                    # Awaited in user order, so every message up to last_user_id is done when it is saved
+                    for done, (user_id, send) in enumerate(zip(batch, sends), 1):
+                        if await send:
+                            broadcast["sent"] += 1
+                        else:
+                            broadcast["failed"] += 1
+                        broadcast["last_user_id"] = user_id
+                        if done % self.checkpoint_size == 0 or done == len(batch):
+                            await self._checkpoint(broadcast)
+                finally:
+                    for send in sends:
+                        send.cancel()
+
+                if time.monotonic() - last_edit_at >= BROADCAST_PROGRESS_INTERVAL:
+                    await self._edit_status(bot, broadcast)
+                    last_edit_at = time.monotonic()
+
+            broadcast["status"] = "done"
+            broadcast["finished_at"] = time.time()
+            await update_broadcast(broadcast["_id"], {"status": "done", "finished_at": broadcast["finished_at"]})
+            logger.info(
+                "Broadcast %s finished: %s sent, %s failed.",
+                broadcast["_id"], broadcast["sent"], broadcast["failed"]
+            )
+        except asyncio.CancelledError:
+            if broadcast["status"] != "cancelled":
+                # Shutting down: keep the checkpoint so the broadcast resumes on restart
+                raise
+        except Exception as e:
+            logger.error("Broadcast %s stopped because of an error: %s", broadcast["_id"], e, exc_info=True)
+            return
+
+        await self._edit_status(bot, broadcast)
+
+
+# The single broadcaster shared by the whole bot
+broadcaster = Broadcaster()
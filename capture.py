@@ -0,0 +1,171 @@
+"""
+Opt-in recording of incoming updates for offline load tests (see bench/replay.py).
+
+Each update is anonymized and appended to CAPTURE_PATH as one JSON line in a gzip
+stream: {"t": epoch seconds, "u": update}. User and chat IDs are replaced by
+pseudonyms that are stable for the life of the process, so repeated /starts and
+the joins that follow them still belong together; the admin becomes 1. Names,
+usernames, message text other than the command itself and invite links are
+dropped.
+"""
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config import ADMIN_ID, CAPTURE_PATH, CAPTURE_FLUSH_SECONDS, CAPTURE_MAX_PENDING, WORKER_INDEX
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Pseudonym of the admin, matching the ADMIN_USER_ID the replay tool runs with
+CAPTURED_ADMIN_ID = 1
+# Pseudonyms start here, so they never collide with the admin's
+FIRST_PSEUDONYM = 10_000
+
+# Fields that can identify a person, replaced by a placeholder or dropped
+_PLACEHOLDERS = {"first_name": "User", "title": "Chat"}
+_DROPPED = {"last_name", "username", "language_code", "invite_link", "bio", "caption", "photo", "contact",
+            "location", "reply_to_message", "forward_origin", "is_premium"}
+
+
+class Anonymizer:
+    """Replaces IDs with keyed hashes and strips personal fields from update dicts."""
+
+    def __init__(self, key: bytes | None = None):
+        # A new key per process: pseudonyms cannot be reversed or matched with other captures
+        self._key = key or os.urandom(32)
+
+    def pseudonym(self, value: int) -> int:
+        if value == ADMIN_ID:
+            return CAPTURED_ADMIN_ID
+        digest = hmac.new(self._key, str(value).encode(), hashlib.sha256).digest()
+        pseudonym = FIRST_PSEUDONYM + int.from_bytes(digest[:5], "big")
+        # Channels and groups have negative IDs, which the handlers rely on
+        return -pseudonym if value < 0 else pseudonym
+
+    def _text(self, message: dict) -> None:
+        text = message.get("text")
+        if text is None:
+            return
+        command = text.split(maxsplit=1)[0] if text.startswith("/") else ""
+        message["text"] = command
+        message["entities"] = (
+            [{"type": "bot_command", "offset": 0, "length": len(command)}] if command else []
+        )
+
+    def anonymize(self, data):
+        if isinstance(data, list):
+            return [self.anonymize(item) for item in data]
+        if not isinstance(data, dict):
+            return data
+        result = {}
+        for key, value in data.items():
+            if key in _DROPPED:
+                continue
+            if key in _PLACEHOLDERS:
+                result[key] = _PLACEHOLDERS[key]
+            elif key in ("id", "user_id", "chat_id") and isinstance(value, int):
+                result[key] = self.pseudonym(value)
+            else:
+                result[key] = self.anonymize(value)
+        if "text" in result:
+            self._text(result)
+        return result
+
+
+class UpdateRecorder:
+    """
+    Appends anonymized updates to a gzip file. The handler only queues the update;
+    anonymizing, encoding and writing happen on a thread every `flush_seconds`.
+    If the writer falls behind by `max_pending` updates, new ones are dropped.
+    A capture cut off by a crash is still readable up to the last flush.
+    """
+
+    def __init__(self, path: str, flush_seconds: float = CAPTURE_FLUSH_SECONDS,
+                 max_pending: int = CAPTURE_MAX_PENDING):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.recorded = 0
+        self.dropped = 0
+        self._anonymizer = Anonymizer()
+        self._pending = []
+        self._file = None
+        self._task = None
+        # A write cancelled on the event loop still finishes on its thread, so file access is serialized here
+        self._file_lock = threading.Lock()
+
+    async def handle(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """TypeHandler callback; registered in a group of its own so the real handlers still run."""
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((round(time.time(), 3), update.to_dict()))
+
+    def _write(self, batch: list) -> None:
+        lines = [
+            json.dumps({"t": at, "u": self._anonymizer.anonymize(data)}, separators=(",", ":"), ensure_ascii=False)
+            for at, data in batch
+        ]
+        with self._file_lock:
+            self._file.write(("\n".join(lines) + "\n").encode())
+            # Sync flush, so everything written so far can be decompressed even if the process dies
+            self._file.flush()
+
+    def _close_file(self) -> None:
+        with self._file_lock:
+            self._file.close()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+            self.recorded += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error("Could not write %s captured updates to %s: %s", len(batch), self.path, e)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    def start(self) -> None:
+        self._file = gzip.open(self.path, "ab")
+        self._task = asyncio.create_task(self._flush_periodically())
+        logger.info("Capturing anonymized updates to %s.", self.path)
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(None, self._close_file)
+        logger.info("Captured %s updates to %s (%s dropped).", self.recorded, self.path, self.dropped)
+
+
+def read_capture(path: str):
+    """Yields (epoch seconds, update dict) from a capture, stopping quietly at a truncated end."""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        try:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    yield entry["t"], entry["u"]
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+            logger.warning("Capture %s ends with an incomplete record, which was skipped.", path)
+
+
+# The recorder, if CAPTURE_PATH is set; "{worker}" in it is replaced by the worker index
+update_recorder = UpdateRecorder(CAPTURE_PATH.format(worker=WORKER_INDEX)) if CAPTURE_PATH else None
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from telegram.ext import Application
+
+from config import WORKER_INDEX, SHARD_LEASE_SECONDS, SHARD_SYNC_SECONDS
+from database import acquire_lease, release_lease, get_admin_settings, refresh_admin_settings
+from permissions import invalidate_permissions
+from sharding import is_sharded
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class ShardLease:
+    """
+    Makes sure that at most one process at a time serves a shard, e.g. while an old
+    and a new worker overlap during a deploy. The lease is a document in the leases
+    collection which the holder renews every `ttl / 3` seconds. A holder that stops
+    renewing loses it after `ttl` seconds, and a waiting process takes over.
+
+    The holder stops trusting the lease `ttl` seconds after it last renewed it. Expiry
+    in the database is compared with the other hosts' clocks, so `ttl` has to be well
+    above the clock difference between the hosts.
+    """
+
+    def __init__(self, name: str, ttl: float = SHARD_LEASE_SECONDS):
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # time.monotonic() after which the lease must be assumed lost
+        self._valid_until = 0.0
+        self._task = None
+
+    def is_held(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    async def _try_acquire(self) -> bool:
+        started_at = time.monotonic()
+        if await acquire_lease(self.name, self.owner, self.ttl):
+            self._valid_until = started_at + self.ttl
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        """Waits until the lease is ours."""
+        waiting = False
+        while True:
+            try:
+                if await self._try_acquire():
+                    logger.info("Acquired lease %s as %s.", self.name, self.owner)
+                    return
+                if not waiting:
+                    logger.warning("Lease %s is held by another process, waiting for it.", self.name)
+                    waiting = True
+            except Exception as e:
+                logger.error("Could not acquire lease %s: %s", self.name, e)
+            await asyncio.sleep(self.ttl / 3)
+
+    def keep_alive(self, on_lost) -> None:
+        """Renews the lease in the background and calls `on_lost()` if it is lost."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._renew(on_lost))
+
+    async def _renew(self, on_lost) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if not await self._try_acquire():
+                    self._valid_until = 0.0
+            except Exception as e:
+                logger.warning("Could not renew lease %s: %s", self.name, e)
+            if not self.is_held():
+                logger.error("Lost lease %s.", self.name)
+                on_lost()
+                return
+
+    async def release(self) -> None:
+        """Stops renewing and gives the lease up, so a successor does not have to wait for it to expire."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._valid_until:
+            self._valid_until = 0.0
+            try:
+                await release_lease(self.name, self.owner)
+            except Exception as e:
+                logger.warning("Could not release lease %s: %s", self.name, e)
+
+
+# The lease on this worker's shard
+shard_lease = ShardLease(f"shard:{WORKER_INDEX}")
+_sync_task = None
+
+
+def owns_shard() -> bool:
+    """
+    True while this process may act for its users: always when not sharded,
+    otherwise only while it holds the shard lease. Checked before removals and
+    broadcast batches so a worker that lost its lease stops right away.
+    """
+    return not is_sharded() or shard_lease.is_held()
+
+
+async def _sync_settings() -> None:
+    """
+    Reloads the admin settings every SHARD_SYNC_SECONDS, so a change the admin made
+    through another worker reaches this one's caches quickly. The invite link pool
+    notices changed settings by itself; the permission cache is reset when the
+    channel changed.
+    """
+    while True:
+        await asyncio.sleep(SHARD_SYNC_SECONDS)
+        try:
+            channel_id = (await get_admin_settings()).get("channel_id")
+            settings = await refresh_admin_settings()
+            if settings.get("channel_id") != channel_id:
+                logger.info("Channel changed to %s by another worker.", settings.get("channel_id"))
+                invalidate_permissions()
+        except Exception as e:
+            logger.warning("Could not sync admin settings: %s", e)
+
+
+async def start_shard(application: Application) -> None:
+    """
+    Called once at startup in sharded mode. Waits for the shard lease, then keeps it
+    renewed and keeps the shared caches in sync. The application stops if the lease
+    is lost, so another worker never runs this shard's removals at the same time.
+    """
+    global _sync_task
+    if not is_sharded():
+        return
+
+    await shard_lease.acquire()
+    shard_lease.keep_alive(application.stop_running)
+    _sync_task = asyncio.create_task(_sync_settings())
+
+
+async def stop_shard() -> None:
+    """Stops syncing and releases the shard lease. Called at shutdown."""
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        _sync_task = None
+    await shard_lease.release()
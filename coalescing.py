@@ -0,0 +1,71 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from config import START_REUSE_SECONDS
+
+
+class Coalescer:
+    """
+    Runs at most one call per key at a time. Callers that arrive while a call for
+    their key is in flight wait for it and get the same result. Results other than
+    None are remembered for `reuse_seconds`, so repeated calls shortly afterwards
+    get them too, as long as `is_reusable(result)` still holds.
+    """
+
+    def __init__(self, reuse_seconds: float):
+        self.reuse_seconds = reuse_seconds
+        self._in_flight = {}
+        # key -> (result, stored at); oldest first, so expired entries are always at the front
+        self._recent = OrderedDict()
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - self.reuse_seconds
+        while self._recent:
+            key, (_, stored_at) = next(iter(self._recent.items()))
+            if stored_at > cutoff:
+                break
+            del self._recent[key]
+
+    def forget(self, key) -> None:
+        """Drops the remembered result for `key`, e.g. because it has been used up."""
+        self._recent.pop(key, None)
+
+    async def run(self, key, factory, is_reusable=None):
+        """
+        Returns a recent or in-flight result for `key`, or awaits `factory()` and
+        shares its result with everyone who asks for the same key meanwhile.
+        """
+        self._prune(time.monotonic())
+        recent = self._recent.get(key)
+        if recent is not None and (is_reusable is None or is_reusable(recent[0])):
+            return recent[0]
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+        future.set_result(result)
+        if result is not None and self.reuse_seconds > 0:
+            self._recent[key] = (result, time.monotonic())
+            self._recent.move_to_end(key)
+        return result
+
+
+# Shares the invite link of a /start with repeated /starts from the same user
+start_links = Coalescer(START_REUSE_SECONDS)
@@ -0,0 +1,102 @@
+import asyncio
+import inspect
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import CONCURRENT_UPDATES
+
+
+def ordering_key(update: object):
+    """
+    The updates that must be processed in order share a key: everything from one
+    user, joins and leaves of one channel member, and the bot's own status changes
+    in one chat. Updates without a key are processed without waiting for others.
+    """
+    if not isinstance(update, Update):
+        return None
+    if update.my_chat_member:
+        return ("chat", update.my_chat_member.chat.id)
+    if update.chat_member:
+        # Keyed by the member rather than the whole channel, so joins of different
+        # users run in parallel while one user's /start and join stay in order
+        return ("user", update.chat_member.new_chat_member.user.id)
+    if update.effective_user:
+        return ("user", update.effective_user.id)
+    if update.effective_chat:
+        return ("chat", update.effective_chat.id)
+    return None
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to `max_concurrent_updates` updates at the same time, so a /start
+    waiting on the shortener or the Bot API no longer holds up everyone queued
+    behind it. Updates with the same ordering_key() still run one after another,
+    in the order they were received.
+
+    An update first waits for its key and only then for a free slot, so a burst
+    from one user takes a single slot and cannot starve other users.
+    """
+
+    def __init__(self, max_concurrent_updates: int = CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        # key -> [lock, number of updates holding or waiting for it]
+        self._keys = {}
+        self._waiting = 0
+        self._running = 0
+
+    def in_progress(self) -> int:
+        """Updates currently being processed."""
+        return self._running
+
+    def waiting(self) -> int:
+        """Updates waiting for an earlier update with the same key or for a free slot."""
+        return self._waiting
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        self._waiting -= 1
+        self._running += 1
+        try:
+            await coroutine
+        finally:
+            self._running -= 1
+
+    async def _process_in_order(self, key, update: object, coroutine) -> None:
+        # The application starts one task per update in arrival order, and nothing is
+        # awaited before the lock, so asyncio's first-come-first-served locks keep that order
+        entry = self._keys.get(key)
+        if entry is None:
+            entry = self._keys[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._keys[key]
+
+    async def process_update(self, update: object, coroutine) -> None:
+        key = ordering_key(update)
+        self._waiting += 1
+        try:
+            if key is None:
+                await super().process_update(update, coroutine)
+            else:
+                await self._process_in_order(key, update, coroutine)
+        except asyncio.CancelledError:
+            if inspect.getcoroutinestate(coroutine) == inspect.CORO_CREATED:
+                # Cancelled while waiting, e.g. at shutdown, so the handlers never ran
+                self._waiting -= 1
+                coroutine.close()
+            raise
+
+
+# The processor used by the application; CONCURRENT_UPDATES = 1 keeps updates strictly sequential
+update_processor = OrderedUpdateProcessor()
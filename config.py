@@ -1,3 +1,4 @@
+import hashlib
 import os
 from dotenv import load_dotenv
 
@@ -15,8 +16,213 @@ try:
 except (ValueError, TypeError):
     raise ValueError("Error: ADMIN_USER_ID environment variable aek valid integer nahi hai!")
 
-# MongoDB URI ko get karna
+# Data kahan rakha jayega: "mongo" (MongoDB), "sqlite" (isi machine par ek file) ya "memory" (sirf RAM, restart par sab khatam)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo").lower()
+if STORAGE_BACKEND not in ("mongo", "sqlite", "memory"):
+    raise ValueError("Error: STORAGE_BACKEND sirf mongo, sqlite ya memory ho sakta hai!")
+
+# MongoDB URI ko get karna (sirf mongo backend ke liye zaroori)
 MONGO_URI = os.getenv("MONGO_DB_URI")
-if not MONGO_URI:
+if STORAGE_BACKEND == "mongo" and not MONGO_URI:
     raise ValueError("Error: MONGO_DB_URI environment variable set nahi hai!")
 
+# SQLite backend ki database file ka path
+SQLITE_PATH = os.getenv("SQLITE_PATH", "bot.db")
+
+
+# Expiry sweeper ek baar mein kitne users ko remove karega
+REMOVAL_BATCH_SIZE = int(os.getenv("REMOVAL_BATCH_SIZE", "20"))
+
+# Network error ya flood limit ki wajah se fail hua removal itne seconds baad dobara try hoga
+REMOVAL_RETRY_SECONDS = int(os.getenv("REMOVAL_RETRY_SECONDS", "60"))
+# Bot ke paas channel mein ban karne ka right na ho to removal itne seconds baad dobara try hoga, jab tak admin right wapas na de
+REMOVAL_FORBIDDEN_RETRY_SECONDS = int(os.getenv("REMOVAL_FORBIDDEN_RETRY_SECONDS", "600"))
+
+# Koi removal pending na ho tab bhi sweeper itne seconds baad database check karega
+SWEEPER_MAX_SLEEP_SECONDS = int(os.getenv("SWEEPER_MAX_SLEEP_SECONDS", "300"))
+
+# Startup par database se connect karne ki maximum koshishen, aur har koshish ka timeout (seconds).
+# SQLite mein timeout yeh hai ki doosre process ka write khatam hone ka kitni der intezaar karein.
+DB_CONNECT_ATTEMPTS = int(os.getenv("DB_CONNECT_ATTEMPTS", "5"))
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+
+# Database calls ke liye background threads ki maximum sankhya (event loop block na ho)
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "8"))
+
+# Admin settings cache kitne seconds baad database se refresh hoga (0 = kabhi nahi)
+SETTINGS_CACHE_TTL = int(os.getenv("SETTINGS_CACHE_TTL", "60"))
+
+# Channel mein bot ki admin permissions ka check kitne seconds tak cache rahega
+PERMISSION_CACHE_TTL = int(os.getenv("PERMISSION_CACHE_TTL", "300"))
+
+# --- Shortener client ---
+# Har shortener request ka timeout (seconds)
+SHORTENER_TIMEOUT = float(os.getenv("SHORTENER_TIMEOUT", "5"))
+# Network error ya 5xx par kitni baar dobara try karna hai
+SHORTENER_MAX_RETRIES = int(os.getenv("SHORTENER_MAX_RETRIES", "2"))
+# Shortener domain ke liye maximum open connections
+SHORTENER_POOL_SIZE = int(os.getenv("SHORTENER_POOL_SIZE", "20"))
+# Lagataar itni failures ke baad shortener ko unhealthy maan kar direct link diya jayega
+SHORTENER_FAILURE_THRESHOLD = int(os.getenv("SHORTENER_FAILURE_THRESHOLD", "5"))
+# Unhealthy hone ke baad itne seconds tak shortener ko skip kiya jayega
+SHORTENER_RESET_SECONDS = int(os.getenv("SHORTENER_RESET_SECONDS", "60"))
+
+# --- Invite link pool ---
+# Maximum kitne ready-made invite links pool mein rakhne hain (0 = pool band). Pool utne hi links rakhta hai
+# jitne ek link ki validity ke andar istemal ho rahe hain, taaki kam traffic par links bekaar expire na hon.
+LINK_POOL_SIZE = int(os.getenv("LINK_POOL_SIZE", "10"))
+# Naya invite link kitne seconds tak valid rahega
+INVITE_LINK_TTL = int(os.getenv("INVITE_LINK_TTL", "600"))
+# Itne seconds se kam validity wale pooled links user ko nahi diye jayenge
+LINK_POOL_MIN_REMAINING = int(os.getenv("LINK_POOL_MIN_REMAINING", "300"))
+# Itne seconds ke andar dobara /start karne par user ko wahi (abhi bhi valid) link mil jayega (0 = band)
+START_REUSE_SECONDS = int(os.getenv("START_REUSE_SECONDS", "60"))
+
+# --- Broadcast ---
+# Broadcast ke dauran har second maximum kitne messages bhejne hain (Telegram limit ~30/s)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+# Ek baar mein database se kitne users uthane hain
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "100"))
+# Har itne users ko message jaane ke baad progress save hota hai. Restart par aakhri itne (aur jo bhej rahe the)
+# users ko message dobara mil sakta hai.
+BROADCAST_CHECKPOINT_SIZE = int(os.getenv("BROADCAST_CHECKPOINT_SIZE", "10"))
+# Progress message kitne seconds mein ek baar edit hoga
+BROADCAST_PROGRESS_INTERVAL = int(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# --- Telegram API scheduler ---
+# Poore bot ke liye har second maximum kitni Bot API calls (sharded mode mein workers mein barabar baant di jati hain)
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", "30"))
+# Ek user ki private chat mein har second maximum kitne messages, aur kitne messages ek saath (burst)
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+# Ek group ya channel mein har minute maximum kitne messages
+TELEGRAM_GROUP_RATE_PER_MINUTE = float(os.getenv("TELEGRAM_GROUP_RATE_PER_MINUTE", "20"))
+# Telegram RetryAfter (flood limit) bheje to ek request kitni baar dobara bheji jayegi
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))
+# Itne alag chats ko TELEGRAM_FLOOD_WINDOW_SECONDS ke andar RetryAfter mile, tabhi saari Bot API calls ruk jayengi
+TELEGRAM_FLOOD_CHATS = int(os.getenv("TELEGRAM_FLOOD_CHATS", "3"))
+TELEGRAM_FLOOD_WINDOW_SECONDS = float(os.getenv("TELEGRAM_FLOOD_WINDOW_SECONDS", "10"))
+
+# --- Unreachable users ---
+# Jo users bot ko block kar chuke hain ya account delete kar chuke hain, unhe itne din baad
+# "users" se archive collection mein move kar diya jayega (0 = archive band). /start karne par wapas aa jate hain.
+DEAD_USER_ARCHIVE_DAYS = int(os.getenv("DEAD_USER_ARCHIVE_DAYS", "0"))
+# Archive job kitne seconds mein ek baar chalega
+DEAD_USER_ARCHIVE_INTERVAL = int(os.getenv("DEAD_USER_ARCHIVE_INTERVAL", "86400"))
+
+# --- Serving mode ---
+# "polling" (default) ya "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError("Error: BOT_MODE sirf 'polling' ya 'webhook' ho sakta hai!")
+
+# Webhook ka public HTTPS base URL (e.g. https://mybot.example.com)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
+    raise ValueError("Error: webhook mode ke liye WEBHOOK_URL environment variable set nahi hai!")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "webhook").strip("/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+# Telegram har webhook request ke saath yeh secret bhejta hai; set na ho to token se banaya jata hai
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(BOT_TOKEN.encode()).hexdigest()
+
+# --- Sharded multi-worker mode ---
+# Users kitne worker processes (shards) mein baante jayenge (1 = sab kuch ek hi process mein).
+# 1 se zyada hone par router.py Telegram se updates leta hai (BOT_MODE ke hisaab se) aur har update
+# user ID ke hisaab se sahi worker ko bhejta hai; main.py har worker ke liye chalta hai.
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+if WORKER_COUNT < 1:
+    raise ValueError("Error: WORKER_COUNT kam se kam 1 hona chahiye!")
+# Yeh worker kaunsa shard hai (0 se WORKER_COUNT-1). Set na ho to Heroku ke DYNO (e.g. "worker.3") se nikala jata hai.
+_dyno_number = os.getenv("DYNO", "").rpartition(".")[2]
+WORKER_INDEX = int(os.getenv("WORKER_INDEX") or (int(_dyno_number) - 1 if _dyno_number.isdigit() else 0))
+if not 0 <= WORKER_INDEX < WORKER_COUNT:
+    raise ValueError("Error: WORKER_INDEX 0 se WORKER_COUNT-1 ke beech hona chahiye!")
+# Memory backend ka data ek hi process mein rehta hai, workers use share nahi kar sakte.
+# SQLite file sirf ek hi machine ke workers share kar sakte hain.
+if WORKER_COUNT > 1 and STORAGE_BACKEND == "memory":
+    raise ValueError("Error: sharded mode (WORKER_COUNT > 1) memory backend ke saath nahi chal sakta!")
+# Worker N apne status server par SHARD_BASE_PORT + N port par updates leta hai
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "8100"))
+# Router ke liye workers ke base URLs, comma se alag, shard ke order mein, e.g. "http://10.0.0.5:8100,http://10.0.0.6:8101".
+# Sharded mode mein zaroori hai: workers alag machines/dynos par ho sakte hain, isliye koi default nahi hai.
+SHARD_URLS = [url.strip().rstrip("/") for url in os.getenv("SHARD_URLS", "").split(",") if url.strip()]
+if WORKER_COUNT > 1 and len(SHARD_URLS) != WORKER_COUNT:
+    raise ValueError("Error: sharded mode mein SHARD_URLS set karna zaroori hai, utne hi URLs jitne WORKER_COUNT hai!")
+# Router har request ke saath yeh secret bhejta hai; set na ho to token se banaya jata hai
+SHARD_SECRET = os.getenv("SHARD_SECRET") or hashlib.sha256(f"shard:{BOT_TOKEN}".encode()).hexdigest()
+# Shard ka lease itne seconds ka hota hai; worker band ho jaye to itni der baad doosra process shard le sakta hai
+SHARD_LEASE_SECONDS = int(os.getenv("SHARD_LEASE_SECONDS", "30"))
+# Har worker itne seconds mein admin settings database se dobara padhta hai (doosre workers ke changes ke liye)
+SHARD_SYNC_SECONDS = float(os.getenv("SHARD_SYNC_SECONDS", "5"))
+# Router har worker ke liye maximum itne updates apne paas rakhega (worker down ho tab)
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "10000"))
+# Router ek request mein worker ko maximum itne updates bhejega
+SHARD_BATCH_SIZE = int(os.getenv("SHARD_BATCH_SIZE", "100"))
+
+# Health (/healthz), readiness (/readyz) aur Prometheus metrics (/metrics) ka local port (0 = band). Webhook mode mein default 8081 hai.
+# Sharded mode mein workers isi port par router se updates lete hain, isliye default SHARD_BASE_PORT + WORKER_INDEX hai.
+if WORKER_COUNT > 1:
+    STATUS_PORT = int(os.getenv("STATUS_PORT", str(SHARD_BASE_PORT + WORKER_INDEX)))
+    if not STATUS_PORT:
+        raise ValueError("Error: sharded mode mein workers ke liye STATUS_PORT 0 nahi ho sakta!")
+else:
+    STATUS_PORT = int(os.getenv("STATUS_PORT", "8081" if BOT_MODE == "webhook" else "0"))
+# Status server kis address par sunega. Default sirf isi machine se (metrics bahar expose nahi hote). Router doosri
+# machine par ho to "0.0.0.0" set karein; /updates aur /joins tab bhi sirf SHARD_SECRET header wali requests lete hain.
+STATUS_LISTEN = os.getenv("STATUS_LISTEN", "127.0.0.1")
+
+# Ek saath maximum kitne updates process honge (1 = ek ke baad ek). Ek hi user ke updates hamesha order mein chalte hain.
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+if CONCURRENT_UPDATES < 1:
+    raise ValueError("Error: CONCURRENT_UPDATES kam se kam 1 hona chahiye!")
+
+# --- Logging ---
+# Log level (DEBUG, INFO, WARNING, ...) aur format: "text" (normal lines) ya "json" (har line ek JSON object)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+if LOG_FORMAT not in ("text", "json"):
+    raise ValueError("Error: LOG_FORMAT sirf text ya json ho sakta hai!")
+# Background thread ke likhne se pehle maximum itni log lines queue mein rahengi; queue bhar jaye to nayi lines chhod di jati hain
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Ek jaisi log line (e.g. har user ke liye broadcast failure) LOG_RATE_INTERVAL seconds mein maximum itni baar likhi jayegi (0 = koi limit nahi)
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "20"))
+LOG_RATE_INTERVAL = float(os.getenv("LOG_RATE_INTERVAL", "60"))
+
+# --- /profile admin command ---
+# Profile maximum kitne seconds chal sakta hai
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+# Event loop ka stack har itne seconds mein sample hota hai
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+# Itne seconds se zyada event loop ko rokne wale callbacks report mein aate hain
+PROFILE_SLOW_CALLBACK_SECONDS = float(os.getenv("PROFILE_SLOW_CALLBACK_SECONDS", "0.1"))
+
+# --- Traffic capture (load tests ke liye, bench/replay.py dekhein) ---
+# Set ho to aane wale updates anonymize karke is gzip file mein jode jayenge (khali = band).
+# "{worker}" likhne par sharded mode mein har worker ki apni file banti hai, e.g. "capture-{worker}.jsonl.gz".
+CAPTURE_PATH = os.getenv("CAPTURE_PATH", "")
+# Captured updates har itne seconds mein file mein likhe jate hain
+CAPTURE_FLUSH_SECONDS = float(os.getenv("CAPTURE_FLUSH_SECONDS", "1"))
+# Likhne mein deri ho to maximum itne updates memory mein rukte hain, baaki chhod diye jate hain
+CAPTURE_MAX_PENDING = int(os.getenv("CAPTURE_MAX_PENDING", "10000"))
+
+# --- Write-behind buffer ---
+# Itne pending user updates hone par turant database mein likh diye jayenge
+WRITE_BUFFER_MAX_SIZE = int(os.getenv("WRITE_BUFFER_MAX_SIZE", "500"))
+# Warna har itne seconds mein ek baar bulk write hoga
+WRITE_BUFFER_FLUSH_SECONDS = float(os.getenv("WRITE_BUFFER_FLUSH_SECONDS", "5"))
+
+# --- Join notifications ---
+# Admin ko join notification kaise bhejna hai: "realtime" (har join par) ya "digest" (summary)
+JOIN_NOTIFY_MODE = os.getenv("JOIN_NOTIFY_MODE", "realtime").lower()
+# Digest mode mein kitne seconds ke joins ek message mein jayenge
+JOIN_DIGEST_WINDOW_SECONDS = int(os.getenv("JOIN_DIGEST_WINDOW_SECONDS", "300"))
+# Itne joins hote hi digest turant bhej diya jayega
+JOIN_DIGEST_MAX_BATCH = int(os.getenv("JOIN_DIGEST_MAX_BATCH", "200"))
+# Digest mein maximum kitne users ke naam dikhane hain
+JOIN_DIGEST_MAX_LISTED = int(os.getenv("JOIN_DIGEST_MAX_LISTED", "20"))
+# Realtime mode mein itne notifications bhejne baaki hon to naye joins digest mein jayenge (admin chat 1 message/second hi le sakta hai)
+JOIN_REALTIME_MAX_BACKLOG = int(os.getenv("JOIN_REALTIME_MAX_BACKLOG", "10"))
+
+# Stats counters kitne seconds mein ek baar database mein likhe jayenge
+COUNTER_FLUSH_SECONDS = float(os.getenv("COUNTER_FLUSH_SECONDS", "10"))
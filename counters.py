@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from config import COUNTER_FLUSH_SECONDS
+from database import increment_stats, get_stats, seed_user_total
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Events that are counted. "new_users" in the totals document is the all-time user count.
+NEW_USERS = "new_users"
+LINKS_FREE = "links_free"
+LINKS_SHORTENED = "links_shortened"
+LINKS_DIRECT = "links_direct"
+JOINS = "joins"
+REMOVALS = "removals"
+# Users found to have blocked the bot or deleted their account
+UNREACHABLE = "unreachable"
+
+EVENTS = (NEW_USERS, LINKS_FREE, LINKS_SHORTENED, LINKS_DIRECT, JOINS, REMOVALS, UNREACHABLE)
+
+
+def _hour_bucket(moment: datetime) -> str:
+    return "h:" + moment.strftime("%Y%m%d%H")
+
+
+def _day_bucket(moment: datetime) -> str:
+    return "d:" + moment.strftime("%Y%m%d")
+
+
+class Counters:
+    """
+    Pre-aggregated event counters. Increments are collected in memory and written
+    every `flush_seconds` as one bulk $inc into an all-time "totals" document plus
+    one document per UTC hour and per UTC day. Reading a 24h or 7d window is then a
+    fixed number of small documents, no matter how many users there are.
+    """
+
+    def __init__(self, flush_seconds: float = COUNTER_FLUSH_SECONDS):
+        self.flush_seconds = flush_seconds
+        # stats document ID -> field -> pending increment
+        self._pending = defaultdict(lambda: defaultdict(int))
+        self._timer = None
+
+    def incr(self, event: str, amount: int = 1) -> None:
+        """Counts `amount` occurrences of `event` right now."""
+        now = datetime.now(timezone.utc)
+        for doc_id in ("totals", _hour_bucket(now), _day_bucket(now)):
+            self._pending[doc_id][event] += amount
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_seconds)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Writes all pending increments to the database."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, defaultdict(lambda: defaultdict(int))
+        try:
+            await increment_stats({doc_id: dict(fields) for doc_id, fields in pending.items()})
+        except Exception as e:
+            logger.error("Failed to write stats counters, will retry: %s", e)
+            for doc_id, fields in pending.items():
+                for event, amount in fields.items():
+                    self._pending[doc_id][event] += amount
+            if self._timer is None or self._timer.done():
+                self._timer = asyncio.create_task(self._flush_later())
+
+    async def close(self) -> None:
+        """Cancels the timer and writes everything that is still pending. Called at shutdown."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    async def seed(self) -> None:
+        """Initializes the all-time user count for databases that existed before the counters."""
+        await seed_user_total(NEW_USERS)
+
+    async def summary(self) -> dict:
+        """
+        Returns all-time totals and sums over the last 24 hours and 7 days for every event,
+        including increments that have not been written yet.
+        """
+        now = datetime.now(timezone.utc)
+        hours = [_hour_bucket(now - timedelta(hours=i)) for i in range(24)]
+        days = [_day_bucket(now - timedelta(days=i)) for i in range(7)]
+        docs = await get_stats(["totals"] + hours + days)
+
+        def window(doc_ids: list) -> dict:
+            return {
+                event: sum(docs.get(doc_id, {}).get(event, 0) + self._pending.get(doc_id, {}).get(event, 0)
+                           for doc_id in doc_ids)
+                for event in EVENTS
+            }
+
+        return {"total": window(["totals"]), "24h": window(hours), "7d": window(days)}
+
+
+# The single set of counters shared by the whole bot
+counters = Counters()
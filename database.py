@@ -1,41 +1,396 @@
+import asyncio
 import logging
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
-from config import MONGO_URI
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from metrics import db_latency, db_errors
+from sharding import current_shard
+from storage import create_storage
+from config import (
+    STORAGE_BACKEND, DB_MAX_WORKERS, DB_CONNECT_ATTEMPTS, SETTINGS_CACHE_TTL,
+    WRITE_BUFFER_MAX_SIZE, WRITE_BUFFER_FLUSH_SECONDS
+)
 
 logger = logging.getLogger(__name__)
 
-# --- MongoDB Client Setup ---
-try:
-    client = MongoClient(MONGO_URI)
-    # The ismaster command is cheap and does not require auth. Used to check connection.
-    client.admin.command('ismaster')
-    logger.info("Successfully connected to MongoDB.")
-except ConnectionFailure as e:
-    logger.error(f"Could not connect to MongoDB: {e}")
-    # You might want to exit the bot if DB connection fails
-    raise
-
-# Define the database and collections
-db = client.get_database("TelegramBotDB") # You can change the database name if you want
-admin_settings = db.get_collection("admin_settings")
-users_collection = db.get_collection("users")
-
-# Helper function to get or create the admin settings document
-def get_admin_settings():
-    """
-    Retrieves the admin settings document. If it doesn't exist, it creates one with default values.
-    """
-    settings = admin_settings.find_one({"_id": 1})
-    if not settings:
-        # Create default settings if none exist
-        default_settings = {
-            "_id": 1,
-            "channel_id": None,
-            "shortener_api": None,
-            "shortener_domain": None,
-            "invite_duration_seconds": 86400  # Default: 1 day in seconds
-        }
-        admin_settings.insert_one(default_settings)
-        return default_settings
+# MongoDB and SQLite calls are blocking, so they are run on this bounded thread pool.
+# This keeps the event loop free while a query is waiting on the network or disk.
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="storage")
+
+# --- Storage Setup ---
+# The storage backend (see storage/) is created and opened by connect() during startup,
+# not at import, so importing this module never waits on the network.
+storage = None
+
+
+async def _run(method, *args, **kwargs):
+    """
+    Calls a storage method and awaits its result. Blocking backends run on the
+    database thread pool; the in-memory backend is called directly.
+    """
+    labels = (method.__name__,)
+    started = time.perf_counter()
+    try:
+        if not storage.blocking:
+            return method(*args, **kwargs)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, partial(method, *args, **kwargs))
+    except Exception:
+        db_errors.incr(labels)
+        raise
+    finally:
+        db_latency.observe(labels, time.perf_counter() - started)
+
+
+async def connect() -> None:
+    """
+    Creates the STORAGE_BACKEND storage and waits until it answers, retrying with
+    backoff up to DB_CONNECT_ATTEMPTS times. Must be awaited once at startup, before
+    anything else in this module is used.
+    """
+    global storage
+    if storage is not None:
+        return
+
+    new_storage = create_storage(STORAGE_BACKEND)
+    for attempt in range(1, DB_CONNECT_ATTEMPTS + 1):
+        try:
+            if new_storage.blocking:
+                await asyncio.get_running_loop().run_in_executor(_executor, new_storage.open)
+            else:
+                new_storage.open()
+            break
+        except Exception as e:
+            if attempt == DB_CONNECT_ATTEMPTS:
+                logger.error("Could not connect to %s after %s attempts: %s", new_storage.name, attempt, e)
+                raise
+            delay = min(2 ** attempt, 30)
+            logger.warning(
+                "Could not connect to %s (attempt %s), retrying in %s seconds: %s", new_storage.name, attempt, delay, e
+            )
+            await asyncio.sleep(delay)
+
+    storage = new_storage
+    logger.info("Successfully connected to %s.", storage.name)
+
+
+async def disconnect() -> None:
+    """Closes the storage. Called last at shutdown, after everything buffered was written."""
+    global storage
+    if storage is not None:
+        await _run(storage.close)
+        storage = None
+
+
+async def ensure_indexes() -> None:
+    """Creates the indexes the bot's queries rely on. Cheap when they already exist."""
+    await _run(storage.ensure_indexes)
+
+
+# --- Admin Settings ---
+
+# The settings document changes rarely but is read on every /start and every
+# join event, so it is kept in memory. Writes go through to the cache, and the
+# cache is reloaded after SETTINGS_CACHE_TTL seconds so other processes' changes
+# are picked up.
+_settings_cache = None
+_settings_loaded_at = 0.0
+# Bumped on every write so a reload that raced with a write does not overwrite it
+_settings_version = 0
+_settings_refresh_task = None
+_settings_lock = asyncio.Lock()
+
+
+def _settings_expired() -> bool:
+    return SETTINGS_CACHE_TTL > 0 and time.monotonic() - _settings_loaded_at > SETTINGS_CACHE_TTL
+
+
+async def refresh_admin_settings() -> dict:
+    """
+    Reloads the admin settings from the database into the cache.
+    """
+    global _settings_cache, _settings_loaded_at
+    version = _settings_version
+    settings = await _run(storage.load_settings)
+    if version == _settings_version:
+        _settings_cache = settings
+        _settings_loaded_at = time.monotonic()
     return settings
+
+
+async def get_admin_settings():
+    """
+    Returns the admin settings, creating them with default values if needed.
+    Served from the in-process cache; once the TTL has passed the cached copy is
+    still returned while a reload runs in the background.
+    The returned dict is shared and must not be modified by the caller.
+    """
+    global _settings_refresh_task
+
+    if _settings_cache is None:
+        async with _settings_lock:
+            if _settings_cache is None:
+                return await refresh_admin_settings()
+    elif _settings_expired() and (_settings_refresh_task is None or _settings_refresh_task.done()):
+        _settings_refresh_task = asyncio.create_task(refresh_admin_settings())
+    return _settings_cache
+
+
+async def update_admin_settings(fields: dict) -> None:
+    """
+    Sets the given fields on the admin settings document and in the cache.
+    """
+    global _settings_cache, _settings_version
+    await _run(storage.update_settings, fields)
+    _settings_version += 1
+    if _settings_cache is not None:
+        _settings_cache = {**_settings_cache, **fields}
+
+
+async def delete_admin_settings() -> bool:
+    """
+    Deletes the admin settings document. Returns True if a document was deleted.
+    The cache is cleared so the defaults are recreated on the next read.
+    """
+    global _settings_cache, _settings_version
+    deleted = await _run(storage.delete_settings)
+    _settings_version += 1
+    _settings_cache = None
+    return deleted
+
+
+# --- Users ---
+
+async def get_user(user_id: int):
+    """Returns the user document, or None if the user is not in the database."""
+    return await _run(storage.get_user, user_id)
+
+
+async def get_or_create_user(user_id: int) -> tuple[dict, bool]:
+    """
+    Returns the user document and whether it was just created, atomically. A user
+    who was marked unreachable is reachable again, since they just talked to the
+    bot. A user who was archived is restored.
+    """
+    return await _run(storage.get_or_create_user, user_id)
+
+
+async def update_user(user_id: int, fields: dict) -> None:
+    """Sets the given fields on a single user right away."""
+    await _run(storage.update_users, {user_id: fields})
+
+
+class WriteBehindBuffer:
+    """
+    Collects non-critical user field updates in memory and writes them as one
+    batch, either when `max_size` users are pending or after
+    `flush_seconds`. Several updates to the same user are merged into one.
+    """
+
+    def __init__(self, max_size: int = WRITE_BUFFER_MAX_SIZE, flush_seconds: float = WRITE_BUFFER_FLUSH_SECONDS):
+        self.max_size = max_size
+        self.flush_seconds = flush_seconds
+        self._pending = {}
+        self._timer = None
+        # Flushes started because the buffer was full, kept so they are not garbage collected
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def set(self, user_id: int, fields: dict) -> None:
+        """Queues setting the given fields on a user."""
+        self._pending.setdefault(user_id, {}).update(fields)
+        if len(self._pending) >= self.max_size:
+            task = asyncio.create_task(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_seconds)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Writes all pending updates to the database."""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await _run(storage.update_users, pending)
+        except Exception as e:
+            logger.error("Write-behind flush of %s user updates failed, will retry: %s", len(pending), e)
+            # Put the updates back without overwriting anything newer that arrived meanwhile
+            for user_id, fields in pending.items():
+                self._pending[user_id] = {**fields, **self._pending.get(user_id, {})}
+            if self._timer is None or self._timer.done():
+                self._timer = asyncio.create_task(self._flush_later())
+
+    async def close(self) -> None:
+        """
+        Cancels the timer, waits for flushes in progress and writes everything that
+        is still pending, including updates a failed flush put back. Called at shutdown.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+        await self.flush()
+
+
+# Buffer for user fields that can be written lazily, like last_link_timestamp
+user_writes = WriteBehindBuffer()
+
+
+async def count_users() -> int:
+    """Returns the total number of users who have started the bot."""
+    return await _run(storage.count_users)
+
+
+async def count_reachable_users() -> int:
+    """Returns the number of users who have not been marked unreachable."""
+    return await _run(storage.count_users, reachable_only=True)
+
+
+async def get_user_ids_after(last_id, limit: int, include_unreachable: bool = False) -> list:
+    """
+    Returns up to `limit` IDs of reachable users (or of all users, with
+    `include_unreachable`) greater than `last_id` in ascending order. Pass None as
+    `last_id` to start from the beginning.
+    """
+    return await _run(storage.get_user_ids_after, last_id, limit, include_unreachable)
+
+
+async def iter_user_ids(batch_size: int = 1000, include_unreachable: bool = False):
+    """
+    Yields every reachable (or every) user ID in ascending order. IDs are fetched in
+    batches by range, so only one batch is held in memory at a time.
+    """
+    last_id = None
+    while True:
+        batch = await get_user_ids_after(last_id, batch_size, include_unreachable)
+        if not batch:
+            return
+        for user_id in batch:
+            yield user_id
+        last_id = batch[-1]
+
+
+async def archive_unreachable_users(before: float, limit: int) -> int:
+    """
+    Moves up to `limit` of this worker's users that were marked unreachable before
+    `before` (epoch seconds) to the archive. Returns how many were moved.
+    """
+    return await _run(storage.archive_unreachable_users, before, limit, current_shard())
+
+
+# --- Pending Removals ---
+
+async def set_removal(user_id: int, channel_id: int, remove_at: float) -> None:
+    """
+    Stores the removal deadline for a user. Setting it again for the same user
+    and channel replaces the earlier deadline.
+    """
+    await _run(storage.set_removal, user_id, channel_id, remove_at)
+
+
+async def get_due_removals(now: float, limit: int) -> list:
+    """
+    Returns up to `limit` removals of this worker's users whose deadline is at or
+    before `now`, oldest first.
+    """
+    return await _run(storage.get_due_removals, now, limit, current_shard())
+
+
+async def delete_removals(removals: list) -> None:
+    """
+    Deletes the given removal entries, skipping any whose deadline was moved
+    after they were read.
+    """
+    if not removals:
+        return
+    await _run(storage.delete_removals, removals)
+
+
+async def postpone_removal(removal: dict, remove_at: float) -> None:
+    """
+    Moves the deadline of a removal entry to `remove_at`, unless its deadline was
+    moved after it was read.
+    """
+    await _run(storage.postpone_removal, removal, remove_at)
+
+
+async def count_pending_removals() -> int:
+    """Returns the number of pending removals, cheaply and possibly approximately."""
+    return await _run(storage.count_pending_removals)
+
+
+async def get_next_removal_time():
+    """Returns the earliest pending removal deadline of this worker's users, or None if nothing is pending."""
+    return await _run(storage.get_next_removal_time, current_shard())
+
+
+# --- Broadcasts ---
+
+async def create_broadcast(broadcast: dict) -> None:
+    """Stores a new broadcast and its progress checkpoint."""
+    await _run(storage.create_broadcast, broadcast)
+
+
+async def get_running_broadcast():
+    """Returns the broadcast that is still in progress, or None."""
+    return await _run(storage.get_running_broadcast)
+
+
+async def update_broadcast(broadcast_id, fields: dict) -> None:
+    """Sets the given fields (progress, status) on a broadcast."""
+    await _run(storage.update_broadcast, broadcast_id, fields)
+
+
+# --- Stats Counters ---
+
+async def increment_stats(increments: dict) -> None:
+    """
+    Applies counter increments in one batch. `increments` maps a stats document
+    ID (e.g. "totals" or an hourly bucket) to a dict of field -> amount.
+    """
+    if not increments:
+        return
+    await _run(storage.increment_stats, increments)
+
+
+async def get_stats(doc_ids: list) -> dict:
+    """Returns the requested stats documents, keyed by their ID."""
+    return await _run(storage.get_stats, doc_ids)
+
+
+async def seed_user_total(field: str) -> None:
+    """
+    Initializes the all-time user counter from the stored users. This counts the
+    users once, the first time the counters are used on an existing database.
+    """
+    totals = (await get_stats(["totals"])).get("totals")
+    if totals and field in totals:
+        return
+    user_count = await count_users()
+    await _run(storage.set_stat, "totals", field, user_count)
+    logger.info("Seeded the user counter with %s existing users.", user_count)
+
+
+# --- Leases ---
+
+async def acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    """
+    Takes the lease `name` for `owner`, or renews it if `owner` already holds it, so
+    that it is valid for another `ttl` seconds. Returns False if someone else holds
+    a lease that has not expired yet.
+    """
+    return await _run(storage.acquire_lease, name, owner, time.time(), ttl)
+
+
+async def release_lease(name: str, owner: str) -> None:
+    """Gives up the lease `name` if `owner` still holds it."""
+    await _run(storage.release_lease, name, owner)
@@ -1,11 +1,20 @@
+import io
 import logging
+import time
 from functools import wraps
 from telegram import Update
 from telegram.ext import ContextTypes
-import asyncio
 
-from config import ADMIN_ID
-from database import admin_settings, users_collection
+from config import ADMIN_ID, PROFILE_MAX_SECONDS
+from database import get_admin_settings, update_admin_settings, delete_admin_settings
+from permissions import invalidate_permissions
+from link_pool import invite_link_pool
+from broadcaster import broadcaster, format_status
+from profiling import profiler
+from notifications import join_notifier, get_join_notify_mode, JOIN_NOTIFY_MODES
+from counters import (
+    counters, NEW_USERS, LINKS_FREE, LINKS_SHORTENED, LINKS_DIRECT, JOINS, REMOVALS, UNREACHABLE
+)
 
 logger = logging.getLogger(__name__)
 
@@ -27,11 +36,9 @@ async def set_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     """Sets the target channel ID."""
     try:
         channel_id = int(context.args[0])
-        admin_settings.update_one(
-            {"_id": 1},
-            {"$set": {"channel_id": channel_id}},
-            upsert=True
-        )
+        await update_admin_settings({"channel_id": channel_id})
+        invalidate_permissions()
+        invite_link_pool.flush(context.bot)
         await update.message.reply_text(f"✅ Channel ID successfully set to `{channel_id}`.")
     except (IndexError, ValueError):
         await update.message.reply_text("⚠️ Please use the correct format: `/setch <channel_id>`")
@@ -39,8 +46,8 @@ async def set_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 @admin_only
 async def my_set_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Checks the currently set channel ID."""
-    settings = admin_settings.find_one({"_id": 1})
-    channel_id = settings.get("channel_id") if settings else None
+    settings = await get_admin_settings()
+    channel_id = settings.get("channel_id")
     if channel_id:
         await update.message.reply_text(f"ℹ️ The current channel ID is: `{channel_id}`")
     else:
@@ -51,11 +58,8 @@ async def set_domain(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     """Sets the URL shortener domain."""
     try:
         domain = context.args[0]
-        admin_settings.update_one(
-            {"_id": 1},
-            {"$set": {"shortener_domain": domain}},
-            upsert=True
-        )
+        await update_admin_settings({"shortener_domain": domain})
+        invite_link_pool.flush(context.bot)
         await update.message.reply_text(f"✅ Shortener domain successfully set to `{domain}`.")
     except IndexError:
         await update.message.reply_text("⚠️ Please use the correct format: `/setdomain <domain.com>`")
@@ -65,11 +69,8 @@ async def set_api(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sets the URL shortener API key."""
     try:
         api_key = context.args[0]
-        admin_settings.update_one(
-            {"_id": 1},
-            {"$set": {"shortener_api": api_key}},
-            upsert=True
-        )
+        await update_admin_settings({"shortener_api": api_key})
+        invite_link_pool.flush(context.bot)
         await update.message.reply_text("✅ Shortener API key has been set successfully.")
     except IndexError:
         await update.message.reply_text("⚠️ Please use the correct format: `/setapi <api_key>`")
@@ -99,85 +100,144 @@ async def set_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             await update.message.reply_text("⚠️ Invalid unit! Please use `s`, `m`, `h`, or `d`.")
             return
 
-        admin_settings.update_one(
-            {"_id": 1},
-            {"$set": {"invite_duration_seconds": seconds}},
-            upsert=True
-        )
+        await update_admin_settings({"invite_duration_seconds": seconds})
         await update.message.reply_text(f"✅ User access duration set to `{value} {unit}` ({seconds} seconds).")
     except (IndexError, ValueError):
         await update.message.reply_text("⚠️ Invalid format! Use `/settime <number> <unit>`.")
 
+@admin_only
+async def set_join_mode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Switches join notifications between realtime messages and periodic digests."""
+    if not context.args:
+        settings = await get_admin_settings()
+        await update.message.reply_text(
+            f"ℹ️ Join notifications are in `{get_join_notify_mode(settings)}` mode.\n"
+            "Use `/joinmode realtime` or `/joinmode digest` to change it."
+        )
+        return
+
+    mode = context.args[0].lower()
+    if mode not in JOIN_NOTIFY_MODES:
+        await update.message.reply_text("⚠️ Please use the correct format: `/joinmode <realtime|digest>`")
+        return
+
+    await update_admin_settings({"join_notify_mode": mode})
+    if mode == "realtime":
+        # Don't hold back joins that were already collected for the next digest
+        await join_notifier.flush(context.bot)
+    await update.message.reply_text(f"✅ Join notifications set to `{mode}` mode.")
+
 @admin_only
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Gets the total number of users who have started the bot."""
-    user_count = users_collection.count_documents({})
-    await update.message.reply_text(f"📊 Total users in the bot: **{user_count}**")
+    """
+    Shows user, link, join, removal and unreachable user counts for all time, the last
+    24 hours and the last 7 days.
+    """
+    summary = await counters.summary()
+    total, last_day, last_week = summary["total"], summary["24h"], summary["7d"]
+
+    def row(label: str, event: str) -> str:
+        return f"{label}: {last_day[event]} / {last_week[event]} / {total[event]}"
+
+    await update.message.reply_text(
+        f"📊 Total users in the bot: {total[NEW_USERS]}\n\n"
+        f"Last 24h / 7d / all time\n"
+        f"{row('🆕 New users', NEW_USERS)}\n"
+        f"{row('🎁 Free links', LINKS_FREE)}\n"
+        f"{row('💰 Shortened links', LINKS_SHORTENED)}\n"
+        f"{row('🔗 Direct links', LINKS_DIRECT)}\n"
+        f"{row('✅ Joins', JOINS)}\n"
+        f"{row('🚪 Removals', REMOVALS)}\n"
+        f"{row('🚫 Blocked/deleted users', UNREACHABLE)}"
+    )
 
 @admin_only
 async def delete_all_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Deletes and resets all admin settings from the database."""
     try:
-        result = admin_settings.delete_one({"_id": 1})
-        if result.deleted_count > 0:
+        deleted = await delete_admin_settings()
+        invalidate_permissions()
+        invite_link_pool.flush(context.bot)
+        if deleted:
             await update.message.reply_text("✅ All admin settings have been successfully deleted.")
             logger.info("Admin settings have been deleted by the admin.")
         else:
             await update.message.reply_text("ℹ️ No settings found to delete.")
     except Exception as e:
-        logger.error(f"Error while deleting settings: {e}")
+        logger.error("Error while deleting settings: %s", e)
         await update.message.reply_text("❌ An error occurred while deleting settings.")
 
 @admin_only
 async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Broadcasts a message to all users of the bot."""
+    """
+    Broadcasts a message to all users of the bot.
+    `/broadcast status` shows the progress and `/broadcast cancel` stops it.
+    """
     if not context.args:
-        await update.message.reply_text("⚠️ Please provide a message to broadcast: `/broadcast <message>`")
+        await update.message.reply_text(
+            "⚠️ Please provide a message to broadcast: `/broadcast <message>`\n"
+            "Use `/broadcast status` or `/broadcast cancel` for a running broadcast."
+        )
+        return
+
+    if len(context.args) == 1 and context.args[0].lower() == "status":
+        if broadcaster.current:
+            await update.message.reply_text(format_status(broadcaster.current))
+        else:
+            await update.message.reply_text("ℹ️ No broadcast has been started yet.")
+        return
+
+    if len(context.args) == 1 and context.args[0].lower() == "cancel":
+        if await broadcaster.cancel():
+            await update.message.reply_text("🛑 Broadcast is being cancelled.")
+        else:
+            await update.message.reply_text("ℹ️ No broadcast is running.")
+        return
+
+    if broadcaster.is_running():
+        await update.message.reply_text(
+            "⚠️ A broadcast is already running. Use `/broadcast status` or `/broadcast cancel`."
+        )
         return
-    
+
     message_to_send = " ".join(context.args)
-    
-    all_users_cursor = users_collection.find({}, {"_id": 1})
-    all_user_ids = [user["_id"] for user in all_users_cursor]
-    
-    if not all_user_ids:
+
+    # The broadcast runs in the background so the bot keeps answering other updates
+    if not await broadcaster.start(context.bot, message_to_send, update.effective_chat.id):
         await update.message.reply_text("There are no users to broadcast to.")
-        return
 
-    total_users = len(all_user_ids)
-    sent_count = 0
-    failed_count = 0
-    
-    status_message = await update.message.reply_text(f"📣 Starting broadcast... Sent to 0/{total_users}.")
-    
-    for i, user_id in enumerate(all_user_ids):
-        try:
-            await context.bot.send_message(chat_id=user_id, text=message_to_send, parse_mode='HTML')
-            sent_count += 1
-        except Exception as e:
-            failed_count += 1
-            logger.warning(f"Failed to send broadcast to user {user_id}: {e}")
-        
-        # Update status message every 10 users or at the end
-        if (i + 1) % 10 == 0 or (i + 1) == total_users:
-            progress = (i + 1) / total_users
-            bar_length = 10
-            filled_length = int(bar_length * progress)
-            bar = '█' * filled_length + '░' * (bar_length - filled_length)
-            
-            try:
-                await status_message.edit_text(
-                    f"📣 Broadcast in progress...\n`{bar}`\n"
-                    f"Sent: {sent_count}/{total_users}\n"
-                    f"Failed: {failed_count}",
-                    parse_mode='MarkdownV2'
-                )
-            except Exception:
-                pass  # Ignore if editing fails (e.g., message not modified)
-        await asyncio.sleep(0.1) # Avoid hitting rate limits
-
-    await status_message.edit_text(
-        f"✅ Broadcast complete!\n\n"
-        f"Successfully sent: {sent_count}\n"
-        f"Failed to send: {failed_count}"
+async def _send_profile(bot, chat_id: int, seconds: int) -> None:
+    try:
+        report = await profiler.run(seconds)
+    except Exception as e:
+        logger.error("Profiling failed: %s", e, exc_info=True)
+        await bot.send_message(chat_id=chat_id, text=f"❌ Profiling failed: {e}")
+        return
+    filename = time.strftime("profile-%Y%m%d-%H%M%S.txt")
+    await bot.send_document(
+        chat_id=chat_id, document=io.BytesIO(report.encode()), filename=filename,
+        caption=f"📊 Profile of the last {seconds} seconds."
     )
+
+@admin_only
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Profiles the bot for a number of seconds (default 30) and sends the report as a
+    document: time spent in the database, the Bot API and the shortener, the busiest
+    functions on the event loop and the callbacks that blocked it.
+    """
+    try:
+        seconds = int(context.args[0]) if context.args else 30
+    except ValueError:
+        await update.message.reply_text("⚠️ Please use the correct format: `/profile [seconds]`")
+        return
+    if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+        await update.message.reply_text(f"⚠️ Profile between 1 and {PROFILE_MAX_SECONDS} seconds.")
+        return
+    if profiler.is_running():
+        await update.message.reply_text("⚠️ A profile is already running.")
+        return
+
+    # Runs in the background, so the admin's next commands do not wait for the profile
+    context.application.create_task(_send_profile(context.bot, update.effective_chat.id, seconds))
+    await update.message.reply_text(f"⏱ Profiling for {seconds} seconds, the report follows as a document.")
@@ -1,39 +1,120 @@
+import asyncio
 import logging
 import time
-from datetime import datetime, timedelta
+from typing import NamedTuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
 from telegram.ext import ContextTypes
 from telegram.error import TelegramError
 
-from database import admin_settings, users_collection, get_admin_settings
-from shortener import shorten_link
-from jobs import remove_member_job
-from config import ADMIN_ID
+from database import get_admin_settings, get_user, get_or_create_user, update_user, user_writes
+from shortener import shorten_link, shortener_client
+from jobs import schedule_removal
+from permissions import bot_has_channel_permissions, update_from_member
+from link_pool import invite_link_pool, create_invite_link, link_settings_key
+from notifications import join_notifier, join_forwarder, get_join_notify_mode
+from sharding import owns_admin_chat
+from counters import counters, NEW_USERS, LINKS_FREE, LINKS_SHORTENED, LINKS_DIRECT, JOINS
+from coalescing import start_links
+from known_users import known_users
+from config import ADMIN_ID, LINK_POOL_MIN_REMAINING
 
 logger = logging.getLogger(__name__)
 
+
+class IssuedLink(NamedTuple):
+    # The link the user gets: shortened, or the invite link itself
+    url: str
+    # The counter event describing what kind of link it is (free, shortened or direct)
+    kind: str
+    # Epoch seconds at which the invite link stops working
+    expires_at: float
+    # Epoch seconds at which the user will be removed from the channel again
+    remove_at: float
+    # Channel and shortener settings the link was made for
+    settings_key: tuple
+
+
+async def _issue_link(update: Update, context: ContextTypes.DEFAULT_TYPE, user: dict, settings: dict):
+    """
+    Creates (or takes from the pool) an invite link for the user, shortens it if needed,
+    saves the user and schedules their removal. Returns None if the link could not be shortened.
+    """
+    user_id = user["_id"]
+    channel_id = settings["channel_id"]
+
+    # Take a ready-made single-use invite link from the pool, or create one if the pool is empty
+    link = invite_link_pool.pop(context.bot, settings) or await create_invite_link(context.bot, channel_id)
+    url = link.invite_link
+
+    duration_seconds = settings.get("invite_duration_seconds", 86400)
+
+    # Decide whether to give a free link or a different link for returning users
+    if not user.get("has_received_free_link"):
+        # First time user gets a free link
+        kind = LINKS_FREE
+    else:
+        # --- LOGIC CHANGE: Optional Shortener ---
+        shortener_domain = settings.get("shortener_domain")
+        shortener_api = settings.get("shortener_api")
+
+        use_shortener = shortener_domain and shortener_api
+
+        # While the shortener is unhealthy, fall back to a direct link instead of making users wait
+        if use_shortener and not shortener_client.is_available():
+            logger.warning("Shortener is unavailable, giving user %s a direct link.", user_id)
+            use_shortener = False
+
+        # If shortener is configured, provide a shortened link
+        if use_shortener:
+            kind = LINKS_SHORTENED
+            # Pooled links are usually shortened already
+            url = link.short_link
+            if not url:
+                await update.message.reply_text("⏳ Please wait, your monetized link is being generated...")
+                url = await shorten_link(shortener_domain, shortener_api, link.invite_link)
+            if not url:
+                # Nobody will use this single-use link, so it must not stay valid
+                invite_link_pool.discard(context.bot, channel_id, link)
+                return None
+        else:
+            # If shortener is NOT configured (or unavailable), provide a direct link
+            kind = LINKS_DIRECT
+
+    counters.incr(kind)
+    issued = IssuedLink(url, kind, link.expires_at, time.time() + duration_seconds, link_settings_key(settings))
+
+    # A link was successfully provided, so store the removal deadline and update the DB
+    update_data = {"last_link_timestamp": time.time()}
+    if kind != LINKS_FREE:
+        # Only the timestamp changes for returning users, so it is written lazily
+        user_writes.set(user_id, update_data)
+        await schedule_removal(context.job_queue, user_id, channel_id, duration_seconds)
+    else:
+        update_data["has_received_free_link"] = True
+        await asyncio.gather(
+            schedule_removal(context.job_queue, user_id, channel_id, duration_seconds),
+            update_user(user_id, update_data)
+        )
+    logger.info("Scheduled removal for user %s in %s seconds.", user_id, duration_seconds)
+    return issued
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handles the /start command. Adds user to DB, generates an invite link,
-    and schedules their removal.
+    and schedules their removal. Repeated /starts from the same user share one
+    link while it is still valid, instead of minting a new one each time.
     """
     user_id = update.effective_user.id
-    update_data = None # Initialize update_data to handle different paths
 
     try:
-        # Get or create the user in the database
-        user = users_collection.find_one({"_id": user_id})
-        if not user:
-            users_collection.insert_one({
-                "_id": user_id,
-                "has_received_free_link": False,
-                "last_link_timestamp": None
-            })
-            user = users_collection.find_one({"_id": user_id})
-            logger.info(f"New user added to the database: {user_id}")
-
-        # Get admin settings
-        settings = get_admin_settings()
+        # Get or create the user and fetch the admin settings at the same time
+        (user, created), settings = await asyncio.gather(get_or_create_user(user_id), get_admin_settings())
+        known_users.add(user_id)
+        if created:
+            counters.incr(NEW_USERS)
+            logger.info("New user added to the database: %s", user_id)
+
         channel_id = settings.get("channel_id")
 
         if not channel_id:
@@ -42,82 +123,54 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
         # Check if the bot has the necessary permissions in the channel
         try:
-            bot_member = await context.bot.get_chat_member(channel_id, context.bot.id)
-            if not bot_member.status == 'administrator' or not bot_member.can_invite_users or not bot_member.can_restrict_members:
+            if not await bot_has_channel_permissions(context.bot, channel_id):
                 await update.message.reply_text(
                     "⚠️ Bot is missing Admin permissions (Invite & Ban) in the channel. Please contact the admin."
                 )
                 return
         except TelegramError as e:
             await update.message.reply_text(f"⚠️ Could not access the channel (`{channel_id}`): {e.message}")
-            logger.error(f"Channel access error for {channel_id}: {e}")
+            logger.error("Channel access error for %s: %s", channel_id, e)
             return
-            
-        # Generate a new, single-use invite link valid for 10 minutes
-        expire_date = datetime.now() + timedelta(minutes=10)
-        invite_link_obj = await context.bot.create_chat_invite_link(
-            chat_id=channel_id,
-            expire_date=expire_date,
-            member_limit=1
-        )
-        invite_link = invite_link_obj.invite_link
-        
-        duration_seconds = settings.get("invite_duration_seconds", 86400)
-        
-        # Decide whether to give a free link or a different link for returning users
-        if not user.get("has_received_free_link"):
-            # First time user gets a free link
-            update_data = {"$set": {"has_received_free_link": True, "last_link_timestamp": time.time()}}
-            keyboard = [[InlineKeyboardButton("🔗 Join Channel (Free Access)", url=invite_link)]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await update.message.reply_text(
-                "🎉 Here is your free access link! It is valid for one use and will expire in 10 minutes.",
-                reply_markup=reply_markup
+
+        settings_key = link_settings_key(settings)
+
+        def is_reusable(issued: IssuedLink) -> bool:
+            now = time.time()
+            return (
+                issued.settings_key == settings_key
+                and issued.expires_at - now >= LINK_POOL_MIN_REMAINING
+                and issued.remove_at > now
             )
+
+        issued = await start_links.run(
+            user_id, lambda: _issue_link(update, context, user, settings), is_reusable=is_reusable
+        )
+
+        if issued is None:
+            await update.message.reply_text("❌ An error occurred while creating the short link. Please try again later.")
+            return
+
+        if issued.kind == LINKS_FREE:
+            minutes_left = int((issued.expires_at - time.time()) // 60)
+            button_text = "🔗 Join Channel (Free Access)"
+            text = f"🎉 Here is your free access link! It is valid for one use and will expire in {minutes_left} minutes."
+        elif issued.kind == LINKS_SHORTENED:
+            button_text = "🔗 Watch Ad & Join Channel"
+            text = "Here is your new link. Please watch the ad to join the channel."
         else:
-            # --- LOGIC CHANGE: Optional Shortener ---
-            shortener_domain = settings.get("shortener_domain")
-            shortener_api = settings.get("shortener_api")
-            
-            # If shortener is configured, provide a shortened link
-            if shortener_domain and shortener_api:
-                await update.message.reply_text("⏳ Please wait, your monetized link is being generated...")
-                shortened_link = await shorten_link(shortener_domain, shortener_api, invite_link)
-                
-                if shortened_link:
-                    keyboard = [[InlineKeyboardButton("🔗 Watch Ad & Join Channel", url=shortened_link)]]
-                    reply_markup = InlineKeyboardMarkup(keyboard)
-                    await update.message.reply_text(
-                        "Here is your new link. Please watch the ad to join the channel.",
-                        reply_markup=reply_markup
-                    )
-                    update_data = {"$set": {"last_link_timestamp": time.time()}}
-                else:
-                    await update.message.reply_text("❌ An error occurred while creating the short link. Please try again later.")
-                    return
+            button_text = "🔗 Join Channel (Direct Link)"
+            if settings.get("shortener_domain") and settings.get("shortener_api"):
+                text = "Here is your new direct link to the channel."
             else:
-                # If shortener is NOT configured, provide a direct link
-                keyboard = [[InlineKeyboardButton("🔗 Join Channel (Direct Link)", url=invite_link)]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(
-                    "Here is your new direct link to the channel. The admin has not set up the shortener.",
-                    reply_markup=reply_markup
-                )
-                update_data = {"$set": {"last_link_timestamp": time.time()}}
-
-        # If a link was successfully provided, schedule the removal job and update the DB
-        if update_data:
-            context.job_queue.run_once(
-                remove_member_job,
-                when=duration_seconds,
-                data={"user_id": user_id, "channel_id": channel_id},
-                name=f"remove_{user_id}_{channel_id}"
-            )
-            users_collection.update_one({"_id": user_id}, update_data)
-            logger.info(f"Scheduled removal job for user {user_id} in {duration_seconds} seconds.")
+                text = "Here is your new direct link to the channel. The admin has not set up the shortener."
+
+        keyboard = [[InlineKeyboardButton(button_text, url=issued.url)]]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await update.message.reply_text(text, reply_markup=reply_markup)
 
     except Exception as e:
-        logger.error(f"Error in /start command for user {user_id}: {e}", exc_info=True)
+        logger.error("Error in /start command for user %s: %s", user_id, e, exc_info=True)
         await update.message.reply_text("🤖 An internal error occurred. Please contact the admin.")
 
 
@@ -148,9 +201,13 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         help_text += "   `/setapi [your_api_key]`\n"
         help_text += "   (If you don't set this, the bot will give direct links).\n\n"
         help_text += "<b><u>Other Admin Commands:</u></b>\n"
-        help_text += "• /stats - Get total bot users.\n"
+        help_text += "• /stats - Get user, link, join, removal and blocked user counts.\n"
         help_text += "• /broadcast `[message]` - Send a message to all users.\n"
+        help_text += "• /broadcast status - Show the progress of the running broadcast.\n"
+        help_text += "• /broadcast cancel - Stop the running broadcast.\n"
+        help_text += "• /joinmode `[realtime|digest]` - Get join notifications one by one or as a summary.\n"
         help_text += "• /dltall - Delete and reset all admin settings.\n"
+        help_text += "• /profile `[seconds]` - Profile the bot and get a report of where the time goes.\n"
         
     await update.message.reply_html(help_text)
 
@@ -169,7 +226,7 @@ async def track_joins(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     chat_id = result.chat.id
     
     # Get the channel ID configured by the admin
-    settings = get_admin_settings()
+    settings = await get_admin_settings()
     admin_channel_id = settings.get("channel_id")
 
     # Only track joins for the configured channel
@@ -181,22 +238,33 @@ async def track_joins(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     is_member = result.new_chat_member.status in [ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER]
 
     if not was_member and is_member:
-        logger.info(f"{user.full_name} (ID: {user.id}) joined the channel {chat_id}.")
+        logger.info("%s (ID: %s) joined the channel %s.", user.full_name, user.id, chat_id)
+        counters.incr(JOINS)
+
+        # The single-use link from their last /start is used up now
+        start_links.forget(user.id)
         
-        # Check if this user is a known user of our bot
-        bot_user = users_collection.find_one({"_id": user.id})
+        # Check if this user is a known user of our bot, from memory once the index is loaded
+        is_bot_user = known_users.contains(user.id)
+        if is_bot_user is None:
+            is_bot_user = await get_user(user.id) is not None
         
-        if bot_user:
-            # If they are a known bot user, notify the admin
-            notification_message = (
-                f"✅ **User Joined Confirmation**\n\n"
-                f"👤 **User:** {user.mention_html()}\n"
-                f"🆔 **ID:** `{user.id}`\n\n"
-                f"They have successfully joined the channel."
-            )
-            try:
-                await context.bot.send_message(
-                    chat_id=ADMIN_ID, text=notification_message, parse_mode='HTML'
-                )
-            except Exception as e:
-                logger.error(f"Failed to send join notification to admin: {e}")
+        if is_bot_user and owns_admin_chat():
+            # If they are a known bot user, notify the admin (right away or in the next digest).
+            # Sent in the background, so this update does not wait for the admin chat's rate limit.
+            join_notifier.notify(context.bot, user, get_join_notify_mode(settings))
+        elif is_bot_user:
+            # Another worker messages the admin; it gets the join over HTTP
+            join_forwarder.forward(user)
+
+
+async def track_bot_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    This handler is called whenever the bot's own status changes in a chat.
+    It keeps the cached channel permission check up to date.
+    """
+    result = update.my_chat_member
+    if not result:
+        return
+
+    update_from_member(result.chat.id, result.new_chat_member)
@@ -1,43 +1,218 @@
+import asyncio
 import logging
-from telegram.ext import ContextTypes
-from telegram.error import Forbidden, BadRequest
+import time
+from telegram import Bot
+from telegram.ext import ContextTypes, JobQueue
+from telegram.error import Forbidden, BadRequest, RetryAfter, TelegramError
+
+from config import (
+    REMOVAL_BATCH_SIZE, REMOVAL_RETRY_SECONDS, REMOVAL_FORBIDDEN_RETRY_SECONDS, SWEEPER_MAX_SLEEP_SECONDS,
+    DEAD_USER_ARCHIVE_DAYS, DEAD_USER_ARCHIVE_INTERVAL
+)
+from counters import counters, REMOVALS
+from database import (
+    set_removal, get_due_removals, delete_removals, postpone_removal, get_next_removal_time, archive_unreachable_users
+)
+from cluster import owns_shard
+from scheduler import PRIORITY_REMOVALS
+from reachability import is_permanent_failure, mark_unreachable
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-async def remove_member_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+# There is only ever one sweeper job in the JobQueue, no matter how many removals are pending
+SWEEPER_JOB_NAME = "expiry_sweeper"
+ARCHIVER_JOB_NAME = "unreachable_user_archiver"
+# How many unreachable users the archiver moves per database round trip
+ARCHIVE_BATCH_SIZE = 500
+# BadRequest messages (lower case) after which retrying a removal cannot help
+PERMANENT_REMOVAL_ERRORS = ("user not found", "participant_id_invalid", "user_id_invalid")
+
+# Prevents two sweeps from running at the same time
+_sweep_lock = asyncio.Lock()
+# Time (epoch seconds) at which the currently scheduled sweeper job will run
+_next_wake_at = None
+
+
+async def schedule_removal(job_queue: JobQueue, user_id: int, channel_id: int, delay_seconds: int) -> None:
     """
-    This job function is called by the JobQueue to remove a user from the channel
-    after their designated time has expired.
+    Stores the removal deadline for a user in the database and makes sure the
+    sweeper wakes up in time for it. Scheduling the same user and channel again
+    replaces the earlier deadline.
     """
-    # Get user_id and channel_id from the job's data payload
-    job_context = context.job.data
-    user_id = job_context["user_id"]
-    channel_id = job_context["channel_id"]
-    
-    logger.info(f"Attempting to remove user {user_id} from channel {channel_id}.")
-    
+    remove_at = time.time() + delay_seconds
+    await set_removal(user_id, channel_id, remove_at)
+    wake_sweeper(job_queue, remove_at)
+
+
+def wake_sweeper(job_queue: JobQueue, wake_at: float) -> None:
+    """
+    (Re)schedules the single sweeper job so that it runs no later than `wake_at`.
+    """
+    global _next_wake_at
+
+    if _next_wake_at is not None and _next_wake_at <= wake_at and job_queue.get_jobs_by_name(SWEEPER_JOB_NAME):
+        return
+
+    for job in job_queue.get_jobs_by_name(SWEEPER_JOB_NAME):
+        job.schedule_removal()
+
+    _next_wake_at = wake_at
+    job_queue.run_once(
+        remove_member_job,
+        when=max(0.0, wake_at - time.time()),
+        name=SWEEPER_JOB_NAME
+    )
+
+
+async def start_sweeper(job_queue: JobQueue) -> None:
+    """
+    Called once at startup. Loads the next pending deadline and schedules the sweeper
+    for it, so removals which became overdue while the bot was offline are processed
+    right away and nothing is swept when nothing is due.
+    """
+    next_removal_at = await get_next_removal_time()
+    if next_removal_at is None:
+        next_removal_at = time.time() + SWEEPER_MAX_SLEEP_SECONDS
+    wake_sweeper(job_queue, next_removal_at)
+
+
+async def remove_member(bot: Bot, user_id: int, channel_id: int) -> float | None:
+    """
+    Removes a single user from the channel after their designated time has expired.
+    Returns None when the removal is finished, either done or failed for good, and
+    otherwise the number of seconds after which it should be tried again.
+    """
+    logger.info("Attempting to remove user %s from channel %s.", user_id, channel_id)
+
     try:
         # Kick (ban) the user to remove them from the channel
-        await context.bot.ban_chat_member(chat_id=channel_id, user_id=user_id)
-        
+        await bot.ban_chat_member(chat_id=channel_id, user_id=user_id)
+
         # Immediately unban the user so they can rejoin later with a new link
-        await context.bot.unban_chat_member(chat_id=channel_id, user_id=user_id)
-        
-        logger.info(f"Successfully removed user {user_id} from channel {channel_id}.")
-        
-        # Optionally, notify the user that their access has expired
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="Your access to the channel has expired. Use /start to get a new link."
-        )
+        await bot.unban_chat_member(chat_id=channel_id, user_id=user_id)
+
+        logger.info("Successfully removed user %s from channel %s.", user_id, channel_id)
+        counters.incr(REMOVALS)
 
     except Forbidden:
+        # Kept until the admin gives the rights back, so no removal is lost meanwhile
         logger.error(
-            f"Failed to remove user {user_id}. Bot lacks administrator rights "
-            f"to ban members in channel {channel_id}."
+            "Failed to remove user %s. Bot lacks administrator rights "
+            "to ban members in channel %s, will retry in %s seconds.",
+            user_id, channel_id, REMOVAL_FORBIDDEN_RETRY_SECONDS
         )
+        return REMOVAL_FORBIDDEN_RETRY_SECONDS
     except BadRequest as e:
-        logger.error(f"Failed to remove user {user_id} from {channel_id}: {e.message}")
+        if any(text in e.message.lower() for text in PERMANENT_REMOVAL_ERRORS):
+            logger.error("Failed to remove user %s from %s: %s", user_id, channel_id, e.message)
+            return None
+        logger.warning("Failed to remove user %s from %s, will retry: %s", user_id, channel_id, e.message)
+        return REMOVAL_RETRY_SECONDS
+    except RetryAfter as e:
+        logger.warning("Flood limit while removing user %s, will retry in %s seconds.", user_id, e.retry_after)
+        return max(REMOVAL_RETRY_SECONDS, e.retry_after)
     except Exception as e:
-        logger.error(f"An unexpected error occurred in the remove job for user {user_id}: {e}")
+        logger.error("An unexpected error occurred in the remove job for user %s, will retry: %s", user_id, e)
+        return REMOVAL_RETRY_SECONDS
+
+    # Optionally, notify the user that their access has expired
+    try:
+        await bot.send_message(
+            chat_id=user_id,
+            text="Your access to the channel has expired. Use /start to get a new link.",
+            rate_limit_args={"priority": PRIORITY_REMOVALS}
+        )
+    except TelegramError as e:
+        if is_permanent_failure(e):
+            await mark_unreachable(user_id, e)
+        else:
+            logger.warning("Could not tell user %s that their access expired: %s", user_id, e)
+    return None
+
+
+async def remove_member_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    This job function is called by the JobQueue whenever the next removal deadline
+    is reached. It removes all expired members in batches and then goes back to
+    sleep until the next deadline stored in the database.
+    """
+    global _next_wake_at
+
+    if _sweep_lock.locked():
+        # A sweep is already running; it will pick up anything that is due
+        return
+
+    async with _sweep_lock:
+        _next_wake_at = None
+        next_wake_at = time.time() + SWEEPER_MAX_SLEEP_SECONDS
+        try:
+            while True:
+                if not owns_shard():
+                    # Another worker has taken over these users' removals
+                    logger.warning("Expiry sweeper stopped because this worker no longer owns its shard.")
+                    return
+
+                due = await get_due_removals(time.time(), REMOVAL_BATCH_SIZE)
+                if not due:
+                    break
+
+                retry_after = await asyncio.gather(
+                    *(remove_member(context.bot, doc["user_id"], doc["channel_id"]) for doc in due)
+                )
+
+                # Only touch entries whose deadline was not moved while we were removing. Transient
+                # failures keep their entry with a later deadline, so they are tried again.
+                finished = [doc for doc, delay in zip(due, retry_after) if delay is None]
+                now = time.time()
+                await asyncio.gather(
+                    delete_removals(finished),
+                    *(postpone_removal(doc, now + delay) for doc, delay in zip(due, retry_after) if delay is not None)
+                )
+                logger.info(
+                    "Expiry sweeper removed a batch of %s users, %s will be retried.",
+                    len(finished), len(due) - len(finished)
+                )
+
+                if len(due) < REMOVAL_BATCH_SIZE:
+                    break
+
+            next_removal_at = await get_next_removal_time()
+            if next_removal_at is not None:
+                next_wake_at = min(next_wake_at, next_removal_at)
+        except Exception as e:
+            logger.error("An unexpected error occurred in the expiry sweeper: %s", e, exc_info=True)
+        finally:
+            wake_sweeper(context.job_queue, next_wake_at)
+
+
+async def archive_unreachable_users_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Moves users who have been unreachable for DEAD_USER_ARCHIVE_DAYS to the archive
+    collection, in batches, so the users collection only holds people the bot can
+    still talk to. Archived users are restored when they send /start again.
+    """
+    before = time.time() - DEAD_USER_ARCHIVE_DAYS * 86400
+    archived = 0
+    try:
+        while True:
+            moved = await archive_unreachable_users(before, ARCHIVE_BATCH_SIZE)
+            archived += moved
+            if moved < ARCHIVE_BATCH_SIZE:
+                break
+    except Exception as e:
+        logger.error("An unexpected error occurred while archiving unreachable users: %s", e, exc_info=True)
+    if archived:
+        logger.info("Archived %s users who have been unreachable for %s days.", archived, DEAD_USER_ARCHIVE_DAYS)
+
+
+def start_archiver(job_queue: JobQueue) -> None:
+    """Schedules the archive job if DEAD_USER_ARCHIVE_DAYS is set. Called once at startup."""
+    if DEAD_USER_ARCHIVE_DAYS <= 0 or job_queue.get_jobs_by_name(ARCHIVER_JOB_NAME):
+        return
+    job_queue.run_repeating(
+        archive_unreachable_users_job,
+        interval=DEAD_USER_ARCHIVE_INTERVAL,
+        first=60,
+        name=ARCHIVER_JOB_NAME
+    )
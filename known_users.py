@@ -0,0 +1,138 @@
+import asyncio
+import bisect
+import heapq
+import logging
+from array import array
+
+from database import iter_user_ids
+from sharding import is_sharded, shard_for
+from config import WORKER_INDEX
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# New users are kept in a set until this many have arrived, then merged into the sorted arrays
+MERGE_THRESHOLD = 4096
+# IDs read from the database per round trip while loading
+LOAD_BATCH_SIZE = 10_000
+# Seconds between attempts to load the index after a failure
+LOAD_RETRY_SECONDS = 60
+
+
+def _unique(sorted_values):
+    """Drops repeated values from a sorted iterable."""
+    previous = None
+    for value in sorted_values:
+        if value != previous:
+            yield value
+            previous = value
+
+
+class KnownUserIndex:
+    """
+    The IDs of every user who has started the bot, so join events can be matched
+    without a database read. IDs are split by their upper 32 bits (Telegram user IDs
+    use very few distinct values there) into sorted arrays of the lower 32 bits, so
+    each user costs 4 bytes: about 4 MB per million users. Lookups are a binary search.
+
+    New users go into a small set first and are merged into the arrays in batches,
+    which keeps inserts cheap. In sharded mode only this worker's users are kept.
+    Users archived later are still reported as known until the next restart.
+    """
+
+    def __init__(self, merge_threshold: int = MERGE_THRESHOLD):
+        self.merge_threshold = merge_threshold
+        # upper 32 bits of the ID -> sorted array of the lower 32 bits
+        self._buckets = {}
+        self._recent = set()
+        self._loaded = False
+        self._task = None
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self._buckets.values()) + len(self._recent)
+
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the sorted arrays (the set of recent users is not counted)."""
+        return sum(bucket.itemsize * len(bucket) for bucket in self._buckets.values())
+
+    def _in_buckets(self, user_id: int) -> bool:
+        bucket = self._buckets.get(user_id >> 32)
+        if bucket is None:
+            return False
+        low = user_id & 0xFFFFFFFF
+        i = bisect.bisect_left(bucket, low)
+        return i < len(bucket) and bucket[i] == low
+
+    def contains(self, user_id: int) -> bool | None:
+        """Whether the user has started the bot, or None while the index is still loading."""
+        if not self._loaded:
+            return None
+        return user_id in self._recent or self._in_buckets(user_id)
+
+    def add(self, user_id: int) -> None:
+        """Records a user who started the bot. Cheap if they are already known."""
+        if user_id in self._recent or self._in_buckets(user_id):
+            return
+        self._recent.add(user_id)
+        # While loading, new users wait in the set so the load does not overwrite them
+        if self._loaded and len(self._recent) >= self.merge_threshold:
+            self._merge()
+
+    def _merge(self) -> None:
+        """Moves the recent users into the sorted arrays."""
+        lows_by_high = {}
+        for user_id in self._recent:
+            lows_by_high.setdefault(user_id >> 32, []).append(user_id & 0xFFFFFFFF)
+        for high, lows in lows_by_high.items():
+            bucket = self._buckets.get(high, array("I"))
+            # Streamed into the new array, so no list of the whole bucket is built
+            self._buckets[high] = array("I", _unique(heapq.merge(bucket, sorted(lows))))
+        self._recent = set()
+
+    async def load(self) -> None:
+        """Reads every user ID from the database and replaces the index with them."""
+        buckets = {}
+        sharded = is_sharded()
+        # IDs arrive in ascending order, so every bucket is filled in sorted order
+        async for user_id in iter_user_ids(LOAD_BATCH_SIZE, include_unreachable=True):
+            if sharded and shard_for(user_id) != WORKER_INDEX:
+                continue
+            high = user_id >> 32
+            bucket = buckets.get(high)
+            if bucket is None:
+                bucket = buckets[high] = array("I")
+            bucket.append(user_id & 0xFFFFFFFF)
+
+        self._buckets = buckets
+        self._merge()
+        self._loaded = True
+        logger.info("Loaded %s known users into memory (%.1f MB).", len(self), self.memory_bytes() / 1_000_000)
+
+    async def _load_until_done(self) -> None:
+        while True:
+            try:
+                await self.load()
+                return
+            except Exception as e:
+                logger.error("Could not load the known users, retrying in %s seconds: %s", LOAD_RETRY_SECONDS, e)
+                await asyncio.sleep(LOAD_RETRY_SECONDS)
+
+    def start(self) -> None:
+        """
+        Loads the index in the background. Until it is loaded, contains() returns None
+        and callers ask the database, so a large users collection does not delay startup.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._load_until_done())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+# The single index shared by all handlers
+known_users = KnownUserIndex()
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import NamedTuple
+from telegram import Bot
+from telegram.error import TelegramError
+
+from config import LINK_POOL_SIZE, INVITE_LINK_TTL, LINK_POOL_MIN_REMAINING
+from shortener import shorten_link, shortener_client
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class PooledLink(NamedTuple):
+    invite_link: str
+    # Shortened version of invite_link, or None if no shortener was configured or it failed
+    short_link: str | None
+    # Epoch seconds at which the invite link stops working
+    expires_at: float
+
+
+def link_settings_key(settings: dict) -> tuple:
+    """The settings a pooled or issued link depends on. If any of them change, the link is stale."""
+    return settings.get("channel_id"), settings.get("shortener_domain"), settings.get("shortener_api")
+
+
+async def create_invite_link(bot: Bot, channel_id: int) -> PooledLink:
+    """
+    Creates a new single-use invite link for the channel, valid for INVITE_LINK_TTL seconds.
+    """
+    expires_at = time.time() + INVITE_LINK_TTL
+    invite_link_obj = await bot.create_chat_invite_link(
+        chat_id=channel_id,
+        expire_date=datetime.fromtimestamp(expires_at, tz=timezone.utc),
+        member_limit=1
+    )
+    return PooledLink(invite_link_obj.invite_link, None, expires_at)
+
+
+class InviteLinkPool:
+    """
+    Keeps a bounded pool of ready-made single-use invite links (already shortened when
+    a shortener is configured) so /start does not have to wait for the Telegram API
+    and the shortener. The pool only holds as many links as were taken
+    during one link's usable lifetime (minus the one just taken), up to `size`: at
+    low traffic it stays empty and links are created on demand, so pooled links are
+    not left to expire unused. Links that are discarded are revoked.
+    """
+
+    def __init__(self, size: int = LINK_POOL_SIZE, min_remaining: int = LINK_POOL_MIN_REMAINING):
+        self.size = size
+        self.min_remaining = min_remaining
+        # How long a new link can be handed out before it is too close to expiring
+        self.usable_seconds = max(1, INVITE_LINK_TTL - min_remaining)
+        self._links = deque()
+        # Times (epoch seconds) of the pops within the last usable_seconds
+        self._pops = deque()
+        # link_settings_key() of the settings the pooled links were made for
+        self._key = None
+        self._bot = None
+        self._refill_task = None
+        self._revoke_tasks = set()
+
+    def _target(self) -> int:
+        """Links to keep ready: those that will probably be taken before they stop being usable."""
+        cutoff = time.time() - self.usable_seconds
+        while self._pops and self._pops[0] < cutoff:
+            self._pops.popleft()
+        return min(self.size, max(0, len(self._pops) - 1))
+
+    def pop(self, bot: Bot, settings: dict) -> PooledLink | None:
+        """
+        Takes a link made for the current settings from the pool, or returns None if none
+        is ready. If traffic is high enough to use them, a background refill is started.
+        """
+        if self.size <= 0:
+            return None
+
+        key = link_settings_key(settings)
+        if key != self._key:
+            self.flush(bot)
+            self._key = key
+        channel_id = settings.get("channel_id")
+        self._bot = bot
+        now = time.time()
+        self._pops.append(now)
+
+        # Links are stored oldest first, so those about to expire are always at the front
+        cutoff = now + self.min_remaining
+        discarded = []
+        while self._links and self._links[0].expires_at < cutoff:
+            discarded.append(self._links.popleft())
+        self._revoke_later(bot, channel_id, discarded)
+
+        link = self._links.popleft() if self._links else None
+        if len(self._links) < self._target():
+            self._start_refill(bot, settings)
+        return link
+
+    def flush(self, bot: Bot | None = None) -> None:
+        """
+        Empties the pool. Called when the channel or shortener settings change.
+        If a bot is given, the discarded links are revoked in the background.
+        """
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            self._refill_task = None
+
+        links, self._links = list(self._links), deque()
+        channel_id = self._key[0] if self._key else None
+        self._key = None
+        self._pops.clear()
+        if bot is not None:
+            self._revoke_later(bot, channel_id, links)
+
+    async def close(self) -> None:
+        """Stops the background refill and revokes the pooled links. Called at application shutdown."""
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            self._refill_task = None
+        links, self._links = list(self._links), deque()
+        if self._bot is not None and links and self._key is not None and self._key[0] is not None:
+            await self._revoke(self._bot, self._key[0], links)
+        if self._revoke_tasks:
+            await asyncio.gather(*self._revoke_tasks, return_exceptions=True)
+
+    def discard(self, bot: Bot, channel_id: int, link: PooledLink) -> None:
+        """Revokes in the background a link that was taken or created but could not be handed out."""
+        self._revoke_later(bot, channel_id, [link])
+
+    def _revoke_later(self, bot: Bot, channel_id: int | None, links: list) -> None:
+        if not links or channel_id is None:
+            return
+        task = asyncio.create_task(self._revoke(bot, channel_id, links))
+        self._revoke_tasks.add(task)
+        task.add_done_callback(self._revoke_tasks.discard)
+
+    def _start_refill(self, bot: Bot, settings: dict) -> None:
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill(bot, settings))
+
+    async def _refill(self, bot: Bot, settings: dict) -> None:
+        channel_id = settings.get("channel_id")
+        shortener_domain = settings.get("shortener_domain")
+        shortener_api = settings.get("shortener_api")
+        key = link_settings_key(settings)
+
+        try:
+            while len(self._links) < self._target() and self._key == key:
+                link = await create_invite_link(bot, channel_id)
+                if shortener_domain and shortener_api and shortener_client.is_available():
+                    short_link = await shorten_link(shortener_domain, shortener_api, link.invite_link)
+                    link = link._replace(short_link=short_link)
+                if self._key != key:
+                    self._revoke_later(bot, channel_id, [link])
+                    break
+                self._links.append(link)
+        except TelegramError as e:
+            logger.warning("Could not refill the invite link pool for channel %s: %s", channel_id, e)
+        except Exception as e:
+            logger.error("An unexpected error occurred while refilling the invite link pool: %s", e, exc_info=True)
+
+    @staticmethod
+    async def _revoke(bot: Bot, channel_id: int, links: list) -> None:
+        now = time.time()
+        for link in links:
+            if link.expires_at <= now:
+                continue
+            try:
+                await bot.revoke_chat_invite_link(chat_id=channel_id, invite_link=link.invite_link)
+            except TelegramError as e:
+                logger.warning("Could not revoke pooled invite link in channel %s: %s", channel_id, e)
+
+
+# The single pool shared by all /start requests
+invite_link_pool = InviteLinkPool()
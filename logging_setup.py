@@ -0,0 +1,147 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_RATE_LIMIT, LOG_RATE_INTERVAL
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `limit` records with the same logger, level and message
+    template per `interval` seconds; the rest are dropped before they are queued.
+    The next record that gets through carries the number dropped in `suppressed`.
+    Works because messages use lazy %-style arguments: "Failed to send broadcast
+    to user %s" is one template no matter how many users fail.
+    """
+
+    def __init__(self, limit: int = LOG_RATE_LIMIT, interval: float = LOG_RATE_INTERVAL):
+        super().__init__()
+        self.limit = limit
+        self.interval = interval
+        self.suppressed_total = 0
+        # (logger, level, template) -> [window start, records let through, records dropped]
+        self._windows = {}
+        # Records come from the event loop and from the database threads
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.limit <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                if len(self._windows) >= 1000:
+                    self._forget_old(now)
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.limit:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                self.suppressed_total += 1
+                return False
+        record.suppressed = suppressed
+        return True
+
+    def _forget_old(self, now: float) -> None:
+        # Dropped counts of old windows are lost; only matters with very many distinct templates
+        for key, window in list(self._windows.items()):
+            if now - window[0] >= self.interval:
+                del self._windows[key]
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Puts records on a bounded queue for the listener thread, which formats and
+    writes them. The calling thread never formats or waits: the record is queued
+    as it is, and when the queue is full it is dropped and counted.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The default merges the arguments into the message right here; the listener does that instead
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class TextFormatter(logging.Formatter):
+    """The usual one-line format, noting how many similar records were suppressed."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" [{suppressed} similar messages suppressed]"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log collectors."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# Set by setup_logging()
+queue_handler = None
+rate_limit_filter = None
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT) -> None:
+    """
+    Sends all logging through a queue to a background thread, so log calls on the
+    event loop cost only a queue put. Replaces logging.basicConfig(); call once at
+    startup. Records still queued at exit are written before the process ends.
+    """
+    global queue_handler, rate_limit_filter
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter(TEXT_FORMAT))
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    rate_limit_filter = RateLimitFilter()
+    queue_handler.addFilter(rate_limit_filter)
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def logging_stats() -> dict:
+    """Records dropped because the queue was full, and records suppressed as repetitive."""
+    return {
+        "dropped": queue_handler.dropped if queue_handler else 0,
+        "suppressed": rate_limit_filter.suppressed_total if rate_limit_filter else 0,
+    }
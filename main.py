@@ -1,45 +1,123 @@
+# Imported first so the cold start is measured from as early as possible
+from startup import mark_ready
+
 import logging
 import asyncio
+import signal
 from telegram import Update
-from telegram.ext import Application, CommandHandler, JobQueue, ChatMemberHandler
+from telegram.ext import Application, CommandHandler, JobQueue, ChatMemberHandler, TypeHandler
+from telegram.request import HTTPXRequest
 
 # Import variables from the config file
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET,
+    WORKER_COUNT, WORKER_INDEX, STATUS_PORT
+)
 
 # Import command handlers
-from handlers.user_commands import start, help_command, track_joins
+from handlers.user_commands import start, help_command, track_joins, track_bot_status
 from handlers.admin_commands import (
-    set_channel, my_set_channel, set_domain, set_api, set_time, stats, broadcast, delete_all_settings
+    set_channel, my_set_channel, set_domain, set_api, set_time, stats, broadcast, delete_all_settings,
+    set_join_mode, profile
 )
+from jobs import start_sweeper, start_archiver
+from shortener import shortener_client
+from link_pool import invite_link_pool
+from broadcaster import broadcaster
+from status_server import start_status_server, stop_status_server
+from database import connect, disconnect, ensure_indexes, refresh_admin_settings, user_writes
+from notifications import join_notifier, join_forwarder
+from counters import counters
+from known_users import known_users
+from metrics import InstrumentedRequest, instrument_handlers
+from scheduler import telegram_scheduler
+from concurrency import update_processor
+from sharding import is_sharded, owns_broadcasts
+from cluster import start_shard, stop_shard
+from logging_setup import setup_logging
+from capture import update_recorder
 
-# Set up basic logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-)
-logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 
-def main() -> None:
+async def post_init(application: Application) -> None:
     """
-    The main function to set up and run the bot.
+    Runs once after the application is initialized and before polling starts.
+    Connects to the database and warms up what the first updates need, in parallel.
     """
-    
-    logger.info("Building bot application...")
-    
-    # Explicitly create the JobQueue
-    job_queue = JobQueue()
-    
-    # Build the application and set longer timeouts and the job queue
-    application = (
-        Application.builder()
-        .token(BOT_TOKEN)
-        .connect_timeout(30)  # Timeout increased to 30 seconds
-        .read_timeout(30)     # Timeout increased to 30 seconds
-        .job_queue(job_queue)
-        .build()
+    # Serve the health endpoints right away; /readyz answers 503 until the warm-up is done
+    await start_status_server(application)
+
+    # Connect to MongoDB here, with retries, instead of blocking at import time
+    await connect()
+
+    # In sharded mode, wait until no other process serves this worker's shard
+    await start_shard(application)
+
+    await asyncio.gather(
+        # Load the admin settings into the cache before the first /start needs them
+        refresh_admin_settings(),
+        # Create the indexes the expiry sweeper relies on
+        ensure_indexes(),
+        # Schedule the sweeper for the next pending deadline; removals that became
+        # due while the bot was offline are processed right away
+        start_sweeper(application.job_queue),
+        # Initialize the user counter once for databases created before the counters existed
+        counters.seed(),
+        # Open the pooled HTTP session used for the shortener API
+        shortener_client.start(),
     )
 
+    if update_recorder is not None:
+        update_recorder.start()
+
+    # Load the IDs of all bot users into memory for join events; until then they are looked up
+    known_users.start()
+
+    # Move long-unreachable users out of the users collection every day, if enabled
+    start_archiver(application.job_queue)
+
+    # Continue a broadcast that was interrupted by a restart (only the admin's worker runs broadcasts)
+    if owns_broadcasts():
+        await broadcaster.resume(application.bot)
+
+    mark_ready()
+
+
+async def post_stop(application: Application) -> None:
+    """
+    Runs once after the application has stopped, while the bot can still send messages.
+    """
+    # Don't lose joins that were collected for the next digest or are still going to the admin's worker
+    await join_notifier.flush(application.bot)
+    await join_forwarder.close()
+
+
+async def post_shutdown(application: Application) -> None:
+    """
+    Runs once after the application has stopped.
+    """
+    await stop_status_server()
+    await broadcaster.close()
+    await invite_link_pool.close()
+    await shortener_client.close()
+    await known_users.close()
+    if update_recorder is not None:
+        await update_recorder.close()
+
+    # Write any buffered user updates and counters before exiting
+    await user_writes.close()
+    await counters.close()
+
+    # Let the next worker for this shard take over right away
+    await stop_shard()
+    await disconnect()
+
+
+def register_handlers(application: Application) -> None:
+    """
+    Registers all update handlers on the application.
+    """
     # --- Register User Command Handlers ---
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
@@ -53,17 +131,139 @@ def main() -> None:
     application.add_handler(CommandHandler("stats", stats))
     application.add_handler(CommandHandler("broadcast", broadcast))
     application.add_handler(CommandHandler("dltall", delete_all_settings))
+    application.add_handler(CommandHandler("joinmode", set_join_mode))
+    application.add_handler(CommandHandler("profile", profile))
 
     # --- Register the join tracker handler ---
     application.add_handler(ChatMemberHandler(track_joins, ChatMemberHandler.CHAT_MEMBER))
 
-    logger.info("Starting bot polling...")
+    # --- Keep the cached channel permission check in sync with the bot's status ---
+    application.add_handler(ChatMemberHandler(track_bot_status, ChatMemberHandler.MY_CHAT_MEMBER))
+
+
+def get_allowed_updates(application: Application) -> list[str]:
+    """
+    Returns only the update types that the registered handlers consume, so
+    Telegram does not send us updates that would be thrown away.
+    """
+    allowed_updates = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, CommandHandler):
+                allowed_updates.add(Update.MESSAGE)
+            elif isinstance(handler, ChatMemberHandler):
+                if handler.chat_member_types in (ChatMemberHandler.CHAT_MEMBER, ChatMemberHandler.ANY_CHAT_MEMBER):
+                    allowed_updates.add(Update.CHAT_MEMBER)
+                if handler.chat_member_types in (ChatMemberHandler.MY_CHAT_MEMBER, ChatMemberHandler.ANY_CHAT_MEMBER):
+                    allowed_updates.add(Update.MY_CHAT_MEMBER)
+            else:
+                # Unknown handler type: don't guess, receive everything
+                return Update.ALL_TYPES
+    return sorted(allowed_updates)
+
+
+def run_worker(application: Application) -> None:
+    """
+    Runs the application as one shard of a multi-worker deployment. There is no
+    updater: the router sends this worker's updates to the status server. Mirrors
+    run_polling(), so the post_* hooks run the same way and SIGINT, SIGTERM or
+    application.stop_running() stop the worker.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, loop.stop)
+
+    try:
+        loop.run_until_complete(application.initialize())
+        if application.post_init:
+            loop.run_until_complete(application.post_init(application))
+        loop.run_until_complete(application.start())
+        loop.run_forever()
+    finally:
+        try:
+            if application.running:
+                loop.run_until_complete(application.stop())
+                if application.post_stop:
+                    loop.run_until_complete(application.post_stop(application))
+            loop.run_until_complete(application.shutdown())
+            if application.post_shutdown:
+                loop.run_until_complete(application.post_shutdown(application))
+        finally:
+            loop.close()
+
+
+def main() -> None:
+    """
+    The main function to set up and run the bot.
+    """
+    # Log through a queue to a background thread, so logging never blocks the event loop
+    setup_logging()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    logger.info("Building bot application...")
     
-    # The application.run_polling() method automatically starts the job queue.
-    # We do NOT need to call application.job_queue.start() manually.
+    # Explicitly create the JobQueue
+    job_queue = JobQueue()
     
+    # Every Bot API call goes through the instrumented request, so its latency shows up in /metrics
+    request = InstrumentedRequest(HTTPXRequest(
+        connection_pool_size=256,  # Same pool size the builder would use
+        connect_timeout=30,  # Timeout increased to 30 seconds
+        read_timeout=30      # Timeout increased to 30 seconds
+    ))
+
+    # Build the application and set longer timeouts and the job queue
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(request)
+        .rate_limiter(telegram_scheduler)
+        # Unrelated users' updates are processed in parallel, each user's in order
+        .concurrent_updates(update_processor)
+        .job_queue(job_queue)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if is_sharded():
+        # Updates come from the router, not from Telegram
+        builder = builder.updater(None)
+    application = builder.build()
+
+    register_handlers(application)
+    instrument_handlers(application)
+
+    # Computed before the recorder is added: its catch-all handler would subscribe to every update type
+    allowed_updates = get_allowed_updates(application)
+
+    # Record incoming updates for offline replay, if CAPTURE_PATH is set. Added after the
+    # instrumentation and in a group of its own, so it is not measured and does not stop other handlers.
+    if update_recorder is not None:
+        application.add_handler(TypeHandler(Update, update_recorder.handle), group=-1)
+
+    # The application.run_polling() / run_webhook() methods automatically start the job queue.
+    # We do NOT need to call application.job_queue.start() manually.
+
     # Run the bot until the user presses Ctrl-C
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if is_sharded():
+        logger.info(
+            "Starting bot worker %s of %s, receiving updates on port %s...", WORKER_INDEX, WORKER_COUNT, STATUS_PORT
+        )
+        run_worker(application)
+    elif BOT_MODE == "webhook":
+        logger.info("Starting bot webhook on %s:%s/%s...", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates,
+        )
+    else:
+        logger.info("Starting bot polling...")
+        application.run_polling(allowed_updates=allowed_updates)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+import bisect
+import time
+from functools import wraps
+from telegram.ext import Application, CommandHandler, ChatMemberHandler
+from telegram.request import BaseRequest
+
+from startup import mark_update_handled
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """
+    A latency histogram with one series per combination of label values.
+    Observing is a bisect and two additions, so it is cheap enough for every update.
+    """
+
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> [per-bucket counts (last one is +Inf), sum of observed values]
+        self._series = {}
+
+    def observe(self, labels: tuple, value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def snapshot(self) -> dict:
+        """Observation count and sum per label values, e.g. to compare before and after a time window."""
+        return {labels: (sum(counts), total) for labels, (counts, total) in self._series.items()}
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = _format_labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Counter:
+    """A monotonically increasing counter with one series per combination of label values."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._series = {}
+
+    def incr(self, labels: tuple, amount: float = 1) -> None:
+        self._series[labels] = self._series.get(labels, 0) + amount
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._series.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+def sample(name: str, help_text: str, value: float, kind: str = "gauge") -> list[str]:
+    """Renders a single unlabeled value that is read at scrape time, e.g. a queue length."""
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+
+handler_latency = Histogram("bot_handler_duration_seconds", "Time spent in an update handler.", ("handler",))
+handler_errors = Counter("bot_handler_errors_total", "Exceptions raised by an update handler.", ("handler",))
+telegram_latency = Histogram("bot_telegram_request_duration_seconds", "Bot API request latency.", ("method",))
+telegram_errors = Counter(
+    "bot_telegram_request_errors_total", "Bot API requests that failed, by HTTP status.", ("method", "status")
+)
+telegram_queue_wait = Histogram(
+    "bot_telegram_queue_wait_seconds", "Time a Bot API request waited for the rate limits.", ("priority",)
+)
+db_latency = Histogram("bot_db_operation_duration_seconds", "Database operation latency.", ("operation",))
+db_errors = Counter("bot_db_operation_errors_total", "Database operations that raised.", ("operation",))
+shortener_latency = Histogram(
+    "bot_shortener_duration_seconds", "Time to shorten a link, including retries.", ("result",)
+)
+
+REGISTRY = (handler_latency, handler_errors, telegram_latency, telegram_errors, telegram_queue_wait, db_latency,
+            db_errors, shortener_latency)
+
+
+def render(extra_lines: list[str] = ()) -> str:
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+def _handler_name(handler) -> str:
+    if isinstance(handler, CommandHandler):
+        return "/" + min(handler.commands)
+    if isinstance(handler, ChatMemberHandler):
+        if handler.chat_member_types == ChatMemberHandler.MY_CHAT_MEMBER:
+            return "my_chat_member"
+        return "chat_member"
+    return getattr(handler.callback, "__name__", type(handler).__name__)
+
+
+def _timed_callback(callback, name: str):
+    labels = (name,)
+
+    @wraps(callback)
+    async def wrapped(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors.incr(labels)
+            raise
+        finally:
+            handler_latency.observe(labels, time.perf_counter() - started)
+            mark_update_handled()
+    return wrapped
+
+
+def instrument_handlers(application: Application) -> None:
+    """
+    Wraps the callback of every registered handler so its latency and errors are recorded.
+    Must be called after all handlers are registered.
+    """
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = _timed_callback(handler.callback, _handler_name(handler))
+
+
+class InstrumentedRequest(BaseRequest):
+    """
+    Wraps the request object of the Bot and records the latency and failures of every
+    Bot API method.
+    """
+
+    def __init__(self, request: BaseRequest):
+        self._request = request
+
+    @property
+    def read_timeout(self) -> float | None:
+        return self._request.read_timeout
+
+    async def initialize(self) -> None:
+        await self._request.initialize()
+
+    async def shutdown(self) -> None:
+        await self._request.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE) -> tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await self._request.do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout
+            )
+        except Exception as e:
+            telegram_errors.incr((api_method, type(e).__name__))
+            raise
+        finally:
+            telegram_latency.observe((api_method,), time.perf_counter() - started)
+        if code >= 400:
+            telegram_errors.incr((api_method, str(code)))
+        return code, payload
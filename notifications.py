@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import logging
+from collections import deque
+import aiohttp
+from telegram import Bot, User
+
+from config import (
+    ADMIN_ID, JOIN_NOTIFY_MODE, JOIN_DIGEST_WINDOW_SECONDS, JOIN_DIGEST_MAX_BATCH, JOIN_DIGEST_MAX_LISTED,
+    JOIN_REALTIME_MAX_BACKLOG, SHARD_URLS, SHARD_SECRET, SHARD_QUEUE_SIZE, SHARD_BATCH_SIZE
+)
+from scheduler import PRIORITY_NOTIFICATIONS
+from sharding import is_sharded, shard_for
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+JOIN_NOTIFY_MODES = ("realtime", "digest")
+
+# Longest wait (seconds) between attempts to reach the admin's worker
+MAX_RETRY_DELAY_SECONDS = 30
+# How long (seconds) shutdown waits for the admin's worker to take the joins that are still queued
+DRAIN_TIMEOUT_SECONDS = 10
+
+
+def get_join_notify_mode(settings: dict) -> str:
+    """Returns the join notification mode from the admin settings, or the configured default."""
+    return settings.get("join_notify_mode") or JOIN_NOTIFY_MODE
+
+
+class JoinNotifier:
+    """
+    Tells the admin when a bot user joins the channel. In realtime mode every join is
+    sent as its own message. In digest mode joins are buffered and sent as one summary
+    every `window_seconds`, or as soon as `max_batch` joins have been collected.
+
+    Messages are sent in the background, so handlers never wait for the admin chat's
+    rate limit. Realtime messages are sent one at a time at the pace that limit allows;
+    while `max_realtime_backlog` of them are waiting, further joins go into the digest.
+    """
+
+    def __init__(
+        self,
+        window_seconds: int = JOIN_DIGEST_WINDOW_SECONDS,
+        max_batch: int = JOIN_DIGEST_MAX_BATCH,
+        max_listed: int = JOIN_DIGEST_MAX_LISTED,
+        max_realtime_backlog: int = JOIN_REALTIME_MAX_BACKLOG,
+    ):
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self.max_listed = max_listed
+        self.max_realtime_backlog = max_realtime_backlog
+        # Only the first `max_listed` joins are kept, the rest are just counted
+        self._listed = []
+        self._count = 0
+        self._timer = None
+        # Users whose realtime message has not been sent yet, and the task sending them
+        self._realtime = deque()
+        self._sender = None
+        # Digests being sent, kept so they are not garbage collected
+        self._tasks = set()
+
+    def notify(self, bot: Bot, user: User, mode: str) -> None:
+        """Reports that `user` joined the channel. Only queues the message."""
+        if mode != "digest" and len(self._realtime) < self.max_realtime_backlog:
+            self._realtime.append(user)
+            if self._sender is None or self._sender.done():
+                self._sender = asyncio.create_task(self._send_realtime_queue(bot))
+            return
+
+        self._add_to_digest(user)
+        if self._count >= self.max_batch:
+            task = asyncio.create_task(self._send(bot, self._take_digest(), "join digest"))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later(bot))
+
+    def _add_to_digest(self, user: User) -> None:
+        self._count += 1
+        if len(self._listed) < self.max_listed:
+            self._listed.append((user.id, user.mention_html()))
+
+    def _take_digest(self) -> str | None:
+        """Empties the digest buffer and returns its message, or None if it was empty."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._count:
+            return None
+
+        count, listed = self._count, self._listed
+        self._count, self._listed = 0, []
+
+        lines = [f"• {mention} (<code>{user_id}</code>)" for user_id, mention in listed]
+        if count > len(listed):
+            lines.append(f"…and {count - len(listed)} more.")
+        return (
+            f"✅ <b>Join Digest</b>\n\n"
+            f"👥 <b>{count}</b> bot user(s) joined the channel.\n\n"
+            + "\n".join(lines)
+        )
+
+    async def _flush_later(self, bot: Bot) -> None:
+        await asyncio.sleep(self.window_seconds)
+        self._timer = None
+        await self._send(bot, self._take_digest(), "join digest")
+
+    async def flush(self, bot: Bot) -> None:
+        """
+        Sends everything still queued as one digest: the buffered joins and the realtime
+        messages that have not gone out yet. Called at shutdown and when switching modes.
+        """
+        while self._realtime:
+            self._add_to_digest(self._realtime.popleft())
+        await self._send(bot, self._take_digest(), "join digest")
+        # The sender stops after the message it is sending now, since its queue is empty
+        pending = [*self._tasks, *([self._sender] if self._sender is not None else [])]
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def _send_realtime_queue(self, bot: Bot) -> None:
+        while self._realtime:
+            user = self._realtime.popleft()
+            notification_message = (
+                f"✅ **User Joined Confirmation**\n\n"
+                f"👤 **User:** {user.mention_html()}\n"
+                f"🆔 **ID:** `{user.id}`\n\n"
+                f"They have successfully joined the channel."
+            )
+            await self._send(bot, notification_message, "join notification")
+
+    @staticmethod
+    async def _send(bot: Bot, text: str | None, what: str) -> None:
+        if text is None:
+            return
+        try:
+            await bot.send_message(
+                chat_id=ADMIN_ID, text=text, parse_mode='HTML',
+                rate_limit_args={"priority": PRIORITY_NOTIFICATIONS}
+            )
+        except Exception as e:
+            logger.error("Failed to send %s to admin: %s", what, e)
+
+
+class JoinForwarder:
+    """
+    In sharded mode only the admin's worker (see owns_admin_chat()) messages the admin,
+    so all workers together stay within the admin chat's rate limit. The other workers
+    hand their joins to it: they are posted to its /joins endpoint in batches of up to
+    `batch_size`, in the background. While it cannot be reached they are retried with
+    backoff; beyond `max_pending` waiting joins, new ones are dropped.
+    """
+
+    def __init__(self, url: str | None = None, max_pending: int = SHARD_QUEUE_SIZE, batch_size: int = SHARD_BATCH_SIZE):
+        if url is None and is_sharded():
+            url = SHARD_URLS[shard_for(ADMIN_ID)]
+        self.url = f"{url}/joins" if url else None
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.dropped = 0
+        # User dicts not accepted yet, oldest first
+        self._pending = deque()
+        self._session = None
+        self._sender = None
+
+    def forward(self, user: User) -> None:
+        """Queues `user`'s join for the admin's worker."""
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            logger.warning("Dropping join of user %s, the admin's worker is not taking joins.", user.id)
+            return
+        self._pending.append(user.to_dict())
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.create_task(self._send_pending())
+
+    async def close(self) -> None:
+        """Waits a little for the queued joins to be taken, then closes the HTTP session."""
+        if self._sender is not None:
+            try:
+                await asyncio.wait_for(self._sender, DRAIN_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._sender = None
+        if self._pending:
+            logger.warning("Dropping %s joins that the admin's worker did not take.", len(self._pending))
+            self._pending.clear()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _post(self, batch: list) -> bool:
+        try:
+            async with self._session.post(self.url, json=batch, headers={"X-Shard-Secret": SHARD_SECRET}) as response:
+                if response.status == 200:
+                    return True
+                logger.warning("The admin's worker answered %s to forwarded joins, will retry.", response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Could not reach the admin's worker at %s, will retry: %s", self.url, e)
+        return False
+
+    async def _send_pending(self) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        delay = 0.5
+        while self._pending:
+            batch = list(itertools.islice(self._pending, self.batch_size))
+            if not await self._post(batch):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY_SECONDS)
+                continue
+            delay = 0.5
+            # Only new joins were appended meanwhile, so the batch is still at the front
+            for _ in batch:
+                self._pending.popleft()
+
+
+# The single notifier shared by the whole bot
+join_notifier = JoinNotifier()
+# Hands joins to the admin's worker, on the other workers in sharded mode
+join_forwarder = JoinForwarder()
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+from telegram import Bot, ChatMember
+from telegram.error import TelegramError
+
+from config import PERMISSION_CACHE_TTL
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# channel_id -> (bot has the required rights, time.monotonic() of the check)
+_cache = {}
+# channel_id -> task currently fetching the bot's membership in that channel
+_pending = {}
+
+
+def _has_required_rights(member: ChatMember) -> bool:
+    """
+    The bot needs to be an administrator that can create invite links and ban members.
+    """
+    return (
+        member.status == ChatMember.ADMINISTRATOR
+        and getattr(member, "can_invite_users", False)
+        and getattr(member, "can_restrict_members", False)
+    )
+
+
+async def _fetch(bot: Bot, channel_id: int) -> bool:
+    try:
+        member = await bot.get_chat_member(channel_id, bot.id)
+        has_rights = _has_required_rights(member)
+        _cache[channel_id] = (has_rights, time.monotonic())
+        return has_rights
+    finally:
+        _pending.pop(channel_id, None)
+
+
+async def _refresh(bot: Bot, channel_id: int) -> None:
+    try:
+        await _fetch(bot, channel_id)
+    except TelegramError as e:
+        # Drop the entry so the next /start checks again and reports the error
+        logger.warning("Background permission check for channel %s failed: %s", channel_id, e)
+        _cache.pop(channel_id, None)
+
+
+async def bot_has_channel_permissions(bot: Bot, channel_id: int) -> bool:
+    """
+    Returns True if the bot is an admin with invite and restrict rights in the channel.
+    The answer is cached for PERMISSION_CACHE_TTL seconds; after that the cached answer
+    is still returned while a fresh check runs in the background. Concurrent callers
+    share a single get_chat_member request. Raises TelegramError if the channel cannot
+    be accessed and nothing is cached yet.
+    """
+    entry = _cache.get(channel_id)
+    if entry is None:
+        task = _pending.get(channel_id)
+        if task is None:
+            task = _pending[channel_id] = asyncio.create_task(_fetch(bot, channel_id))
+        return await task
+
+    has_rights, checked_at = entry
+    if time.monotonic() - checked_at > PERMISSION_CACHE_TTL and channel_id not in _pending:
+        _pending[channel_id] = asyncio.create_task(_refresh(bot, channel_id))
+    return has_rights
+
+
+def update_from_member(channel_id: int, member: ChatMember) -> None:
+    """
+    Updates the cached answer from a my_chat_member update, which tells us the bot's
+    new status and rights without another API call. Channels that were never
+    checked are ignored.
+    """
+    if channel_id in _cache:
+        _cache[channel_id] = (_has_required_rights(member), time.monotonic())
+        logger.info("Bot permissions changed in channel %s; cache updated.", channel_id)
+
+
+def invalidate_permissions(channel_id: int | None = None) -> None:
+    """
+    Forgets the cached answer for one channel, or for all channels if none is given.
+    """
+    if channel_id is None:
+        _cache.clear()
+    else:
+        _cache.pop(channel_id, None)
@@ -0,0 +1,222 @@
+"""
+On-demand profiling for the /profile admin command. Nothing here runs or is
+installed until a profile is started, and everything is removed when it ends.
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import PROFILE_SAMPLE_INTERVAL, PROFILE_SLOW_CALLBACK_SECONDS
+from metrics import db_latency, telegram_latency, telegram_queue_wait, shortener_latency, handler_latency
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Rows per table in the report
+TOP = 25
+
+# asyncio logs "Executing <Handle ...> took 0.123 seconds" for callbacks slower than slow_callback_duration
+_SLOW_CALLBACK = re.compile(r"Executing (?P<callback>.*) took (?P<seconds>[\d.]+) seconds")
+# Details that make every occurrence of the same callback look different
+_ADDRESSES = re.compile(r" at 0x[0-9a-f]+| id=0x[0-9a-f]+|created at \S+")
+
+
+def _short_path(filename: str) -> str:
+    for prefix in sorted({os.getcwd(), *sys.path}, key=len, reverse=True):
+        if prefix and filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+class StackSampler:
+    """
+    Samples what one thread is executing every `interval` seconds from a background
+    thread. Costs one sys._current_frames() call per sample and nothing in the
+    sampled thread itself. Samples taken while the event loop waits in its selector
+    are counted as idle.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.idle = 0
+        # function -> samples in which it was running itself / anywhere on the stack
+        self.own = Counter()
+        self.total = Counter()
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        self.samples += 1
+        if frame.f_code.co_filename.endswith("selectors.py"):
+            self.idle += 1
+            return
+        self.own[self._label(frame.f_code)] += 1
+        seen = set()
+        while frame is not None:
+            label = self._label(frame.f_code)
+            if label not in seen:
+                seen.add(label)
+                self.total[label] += 1
+            frame = frame.f_back
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class SlowCallbackRecorder(logging.Handler):
+    """Collects asyncio's slow callback warnings, grouped by callback."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        # callback -> [occurrences, total seconds, longest seconds]
+        self.callbacks = {}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        match = _SLOW_CALLBACK.match(record.getMessage())
+        if match is None:
+            return
+        callback = _ADDRESSES.sub("", match["callback"])[:300]
+        seconds = float(match["seconds"])
+        entry = self.callbacks.setdefault(callback, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+
+def _timing_delta(histogram, before: dict) -> list:
+    """(label, count, total seconds) observed by a histogram since `before`, slowest in total first."""
+    rows = []
+    for labels, (count, total) in histogram.snapshot().items():
+        old_count, old_total = before.get(labels, (0, 0.0))
+        if count > old_count:
+            rows.append(("/".join(map(str, labels)), count - old_count, total - old_total))
+    return sorted(rows, key=lambda row: row[2], reverse=True)
+
+
+# Where the time goes outside of the bot's own code, in report order
+TIMINGS = (
+    ("Update handlers", handler_latency),
+    ("Database operations", db_latency),
+    ("Bot API requests", telegram_latency),
+    ("Bot API rate limit waits", telegram_queue_wait),
+    ("Shortener", shortener_latency),
+)
+
+
+class Profiler:
+    """
+    Profiles the running bot for a bounded time: samples the event loop thread,
+    turns on asyncio's slow callback detection (debug mode, which adds some overhead
+    while it is on) and records how much time handlers, the database, the Bot API
+    and the shortener took meanwhile. Only one profile runs at a time.
+    """
+
+    def __init__(self):
+        self._running = False
+
+    def is_running(self) -> bool:
+        return self._running
+
+    async def run(self, seconds: float) -> str:
+        """Profiles for `seconds` and returns the report as text."""
+        if self._running:
+            raise RuntimeError("A profile is already running.")
+        self._running = True
+
+        loop = asyncio.get_running_loop()
+        debug, slow_callback_duration = loop.get_debug(), loop.slow_callback_duration
+        sampler = StackSampler(threading.get_ident())
+        recorder = SlowCallbackRecorder()
+        asyncio_logger = logging.getLogger("asyncio")
+        before = [histogram.snapshot() for _, histogram in TIMINGS]
+        started_at = time.time()
+        started = time.perf_counter()
+
+        logger.info("Profiling for %s seconds.", seconds)
+        asyncio_logger.addHandler(recorder)
+        loop.slow_callback_duration = PROFILE_SLOW_CALLBACK_SECONDS
+        loop.set_debug(True)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+            loop.set_debug(debug)
+            loop.slow_callback_duration = slow_callback_duration
+            asyncio_logger.removeHandler(recorder)
+            self._running = False
+
+        elapsed = time.perf_counter() - started
+        timings = [(title, _timing_delta(histogram, old)) for (title, histogram), old in zip(TIMINGS, before)]
+        return self._report(started_at, elapsed, sampler, recorder, timings)
+
+    @staticmethod
+    def _report(started_at: float, elapsed: float, sampler: StackSampler, recorder: SlowCallbackRecorder,
+                timings: list) -> str:
+        lines = [
+            f"Profile started {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started_at))}, {elapsed:.1f} seconds",
+            "",
+        ]
+
+        for title, rows in timings:
+            lines.append(f"== {title} ==")
+            if not rows:
+                lines.append("(none)")
+            for label, count, total in rows[:TOP]:
+                lines.append(f"{total:9.3f}s total {count:8} calls {total / count * 1000:9.1f} ms avg  {label}")
+            lines.append("")
+
+        busy = sampler.samples - sampler.idle
+        lines.append("== Event loop ==")
+        if sampler.samples:
+            lines.append(
+                f"{sampler.samples} samples every {sampler.interval * 1000:.0f} ms, "
+                f"busy in {busy / sampler.samples:.0%} of them"
+            )
+        lines.append("")
+        for title, counts in (("running itself", sampler.own), ("anywhere on the stack", sampler.total)):
+            lines.append(f"== Top functions, {title} (share of busy samples) ==")
+            if not counts:
+                lines.append("(none)")
+            for label, count in counts.most_common(TOP):
+                lines.append(f"{count / busy:7.1%} {count:8}  {label}")
+            lines.append("")
+
+        lines.append(f"== Callbacks that blocked the event loop for over {PROFILE_SLOW_CALLBACK_SECONDS}s ==")
+        if not recorder.callbacks:
+            lines.append("(none)")
+        slowest = sorted(recorder.callbacks.items(), key=lambda item: item[1][1], reverse=True)
+        for callback, (count, total, longest) in slowest[:TOP]:
+            lines.append(f"{total:9.3f}s total {count:6} times {longest:7.3f}s longest  {callback}")
+        return "\n".join(lines) + "\n"
+
+
+# The single profiler used by /profile
+profiler = Profiler()
@@ -0,0 +1,46 @@
+import logging
+import time
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+from counters import counters, UNREACHABLE
+from database import update_user
+from storage.base import USER_UNREACHABLE
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# BadRequest messages (lower case) which mean that the user's chat is gone for good
+PERMANENT_BAD_REQUESTS = ("chat not found", "user not found", "user is deactivated", "peer_id_invalid")
+
+
+def is_permanent_failure(error: TelegramError) -> bool:
+    """
+    True if a message to a user's private chat failed because the user can never be
+    reached again: they blocked the bot or deleted their account. Flood limits,
+    timeouts and network errors are transient.
+    """
+    if isinstance(error, Forbidden):
+        return True
+    if isinstance(error, BadRequest):
+        message = error.message.lower()
+        return any(text in message for text in PERMANENT_BAD_REQUESTS)
+    return False
+
+
+async def mark_unreachable(user_id: int, error: TelegramError) -> None:
+    """
+    Flags the user so broadcasts skip them from now on. The flag is cleared when the
+    user sends /start again. Written right away, like /start clears it: through the
+    write-behind buffer a flush after a new /start would flag an active user again.
+    """
+    logger.info("User %s is unreachable and will be skipped by broadcasts: %s", user_id, error.message)
+    try:
+        await update_user(user_id, {
+            "status": USER_UNREACHABLE,
+            "unreachable_since": time.time(),
+            "unreachable_reason": error.message,
+        })
+    except Exception as e:
+        logger.error("Could not mark user %s as unreachable: %s", user_id, e)
+        return
+    counters.incr(UNREACHABLE)
@@ -0,0 +1,179 @@
+"""
+Front process for the sharded multi-worker mode (WORKER_COUNT > 1).
+
+Receives updates from Telegram by long polling or webhook, exactly like main.py
+does in BOT_MODE, and forwards each one to the worker that owns its user
+(user ID modulo WORKER_COUNT). Updates for one worker are sent in arrival order,
+so every user's updates are processed in order. It does not need the database.
+
+    python router.py
+
+Opt-in: it is not part of the default Procfile. To shard, set WORKER_COUNT and
+SHARD_URLS (the workers' reachable base URLs) for every process, scale the
+worker process to WORKER_COUNT and add a `router: python router.py` process.
+Workers only listen on 127.0.0.1 by default; if the router runs on another machine,
+set STATUS_LISTEN=0.0.0.0 for them. They only accept updates carrying SHARD_SECRET.
+"""
+import asyncio
+import logging
+import aiohttp
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+from config import (
+    BOT_TOKEN, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET,
+    WORKER_COUNT, SHARD_URLS, SHARD_SECRET, SHARD_QUEUE_SIZE, SHARD_BATCH_SIZE
+)
+from sharding import shard_for_update, ALL_SHARDS
+from logging_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Longest wait (seconds) between attempts to reach a worker that is down
+MAX_RETRY_DELAY_SECONDS = 30
+# How long (seconds) shutdown waits for the workers to take the updates that are still queued
+DRAIN_TIMEOUT_SECONDS = 10
+
+
+class ShardForwarder:
+    """
+    Forwards updates to one worker. Updates wait in a bounded queue and are posted in
+    batches of up to `batch_size`, one batch at a time, so their order is kept. A batch
+    the worker does not accept is retried with backoff until it does. When the queue is
+    full, receiving from Telegram waits, so a worker that is down slows the router
+    instead of losing updates.
+    """
+
+    def __init__(self, index: int, url: str, max_queue: int = SHARD_QUEUE_SIZE, batch_size: int = SHARD_BATCH_SIZE):
+        self.index = index
+        self.url = f"{url}/updates"
+        self.batch_size = batch_size
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._session = None
+        self._task = None
+
+    def start(self, session: aiohttp.ClientSession) -> None:
+        self._session = session
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, update: dict) -> None:
+        await self._queue.put(update)
+
+    async def drain(self) -> None:
+        """Waits until every queued update has been accepted by the worker."""
+        await self._queue.join()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if not self._queue.empty():
+            logger.warning("Dropping %s updates that worker %s did not take.", self._queue.qsize(), self.index)
+
+    async def _post(self, batch: list) -> bool:
+        try:
+            async with self._session.post(self.url, json=batch, headers={"X-Shard-Secret": SHARD_SECRET}) as response:
+                if response.status == 200:
+                    return True
+                logger.warning("Worker %s answered %s, will retry.", self.index, response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Could not reach worker %s at %s, will retry: %s", self.index, self.url, e)
+        return False
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            delay = 0.5
+            while not await self._post(batch):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY_SECONDS)
+
+            for _ in batch:
+                self._queue.task_done()
+
+
+forwarders = [ShardForwarder(index, url) for index, url in enumerate(SHARD_URLS)]
+_session = None
+
+
+async def route(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Queues the update for the worker that owns its user, or for every worker."""
+    shard = shard_for_update(update)
+    data = update.to_dict()
+    targets = forwarders if shard is ALL_SHARDS else [forwarders[shard]]
+    for forwarder in targets:
+        await forwarder.put(data)
+
+
+def worker_allowed_updates() -> list[str]:
+    """The update types the workers' handlers consume, derived from the handlers main.py registers."""
+    # Imported here because main.py pulls in every handler module, which only this needs
+    from main import register_handlers, get_allowed_updates
+
+    workers = Application.builder().token(BOT_TOKEN).build()
+    register_handlers(workers)
+    return get_allowed_updates(workers)
+
+
+async def post_init(application: Application) -> None:
+    """Opens the HTTP session to the workers and starts forwarding."""
+    global _session
+    _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+    for forwarder in forwarders:
+        forwarder.start(_session)
+
+
+async def post_shutdown(application: Application) -> None:
+    """Hands the queued updates to the workers, then closes the session."""
+    try:
+        await asyncio.wait_for(asyncio.gather(*(forwarder.drain() for forwarder in forwarders)), DRAIN_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        pass
+    for forwarder in forwarders:
+        await forwarder.close()
+    await _session.close()
+
+
+def main() -> None:
+    """
+    Sets up and runs the router.
+    """
+    # Log through a queue to a background thread, so logging never blocks the event loop
+    setup_logging()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if WORKER_COUNT < 2:
+        raise SystemExit("router.py is only needed when WORKER_COUNT is greater than 1; run main.py instead.")
+
+    logger.info("Building router for %s workers: %s", WORKER_COUNT, ", ".join(SHARD_URLS))
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, route))
+    allowed_updates = worker_allowed_updates()
+
+    # Run the router until the user presses Ctrl-C
+    if BOT_MODE == "webhook":
+        logger.info("Starting router webhook on %s:%s/%s...", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates,
+        )
+    else:
+        logger.info("Starting router polling...")
+        application.run_polling(allowed_updates=allowed_updates)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import (
+    TELEGRAM_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_GROUP_RATE_PER_MINUTE,
+    TELEGRAM_MAX_RETRIES, TELEGRAM_FLOOD_CHATS, TELEGRAM_FLOOD_WINDOW_SECONDS, WORKER_COUNT
+)
+from metrics import telegram_queue_wait
+from ratelimit import TokenBucket
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first. Pass one as rate_limit_args={"priority": ...}
+# on a bot call; otherwise it is taken from ENDPOINT_PRIORITIES.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_INVITES = 1
+PRIORITY_NOTIFICATIONS = 2
+PRIORITY_REMOVALS = 3
+PRIORITY_BROADCAST = 4
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_INVITES: "invites",
+    PRIORITY_NOTIFICATIONS: "notifications",
+    PRIORITY_REMOVALS: "removals",
+    PRIORITY_BROADCAST: "broadcast",
+}
+
+# Default priority of methods that are not replies to a user
+ENDPOINT_PRIORITIES = {
+    "createChatInviteLink": PRIORITY_INVITES,
+    "revokeChatInviteLink": PRIORITY_INVITES,
+    "banChatMember": PRIORITY_REMOVALS,
+    "unbanChatMember": PRIORITY_REMOVALS,
+}
+
+# Methods that post into a chat and therefore count against that chat's limit
+PER_CHAT_PREFIXES = ("send", "edit", "copy", "forward")
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """
+    Every Bot API call goes through here (it is the Bot's rate limiter). Calls wait
+    for their chat's limit first, then for a token from the global budget, which is
+    handed out strictly by priority: a /start reply waiting for a token is served
+    before any queued removal or broadcast message, so background work only uses
+    what user-facing traffic leaves over.
+
+    RetryAfter only holds back what caused it, for the time Telegram asks for: a
+    message to a chat pauses that chat, and a call of a background priority also
+    pauses that priority and the less urgent ones, so a flooded broadcast never
+    delays a /start reply. Only when `flood_chats` different chats get RetryAfter
+    within `flood_window` seconds are all calls paused. The call is retried up to
+    `max_retries` times.
+    """
+
+    def __init__(
+        self,
+        rate: float = TELEGRAM_RATE / WORKER_COUNT,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        chat_burst: int = TELEGRAM_CHAT_BURST,
+        group_rate_per_minute: float = TELEGRAM_GROUP_RATE_PER_MINUTE,
+        max_retries: int = TELEGRAM_MAX_RETRIES,
+        flood_chats: int = TELEGRAM_FLOOD_CHATS,
+        flood_window: float = TELEGRAM_FLOOD_WINDOW_SECONDS,
+    ):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_minute / 60
+        self.max_retries = max_retries
+        self.flood_chats = flood_chats
+        self.flood_window = flood_window
+
+        # Global token bucket
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        # priority -> time.monotonic() until which it and all less urgent priorities are paused
+        self._priorities_paused_until = {}
+        # chat_id -> time.monotonic() of its last RetryAfter, oldest first
+        self._flooded_chats = OrderedDict()
+
+        # (priority, arrival number, future) of calls waiting for a global token
+        self._waiters = []
+        self._arrivals = itertools.count()
+        self._dispatcher = None
+        # Wakes the dispatcher when a call arrives while the queued ones are paused
+        self._arrived = asyncio.Event()
+
+        # chat_id -> (TokenBucket, time.monotonic() of its last use); least recently used first
+        self._chats = OrderedDict()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        for _, _, future in self._waiters:
+            future.cancel()
+        self._waiters = []
+
+    def waiting(self) -> int:
+        """Calls currently waiting for a global token."""
+        return len(self._waiters)
+
+    def pause(self, seconds: float) -> None:
+        """Stops handing out tokens for the given number of seconds. The budget is empty afterwards."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated_at = self._paused_until
+
+    def pause_priority(self, priority: int, seconds: float) -> None:
+        """Holds back calls of `priority` and of every less urgent priority for the given number of seconds."""
+        until = time.monotonic() + seconds
+        self._priorities_paused_until[priority] = max(self._priorities_paused_until.get(priority, 0.0), until)
+
+    def _resume_at(self, priority: int, now: float) -> float:
+        """time.monotonic() at which calls of `priority` may go again; at most `now` if they are not paused."""
+        for paused, until in list(self._priorities_paused_until.items()):
+            if until <= now:
+                del self._priorities_paused_until[paused]
+        return max(
+            (until for paused, until in self._priorities_paused_until.items() if paused <= priority), default=now
+        )
+
+    def _record_flood(self, chat_id) -> bool:
+        """Remembers a RetryAfter for the chat. Returns True if enough chats got one recently to pause everything."""
+        now = time.monotonic()
+        self._flooded_chats.pop(chat_id, None)
+        self._flooded_chats[chat_id] = now
+        while now - next(iter(self._flooded_chats.values())) > self.flood_window:
+            self._flooded_chats.popitem(last=False)
+        if len(self._flooded_chats) < self.flood_chats:
+            return False
+        self._flooded_chats.clear()
+        return True
+
+    def _delay(self, now: float) -> float:
+        """Seconds until a global token is available (0 if one is available now)."""
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            delay = self._delay(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            priority, _, future = self._waiters[0]
+            if future.done():
+                # The caller was cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            now = time.monotonic()
+            resume_at = self._resume_at(priority, now)
+            if resume_at > now:
+                # The most urgent waiting call is paused, so all others are too; a more urgent one may arrive
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), resume_at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._waiters)
+            self._tokens -= 1
+            future.set_result(None)
+        self._dispatcher = None
+
+    async def _acquire(self, priority: int) -> None:
+        now = time.monotonic()
+        if not self._waiters and self._resume_at(priority, now) <= now and self._delay(now) == 0:
+            self._tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), future))
+        self._arrived.set()
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        now = time.monotonic()
+        entry = self._chats.pop(chat_id, None)
+        if entry is None:
+            if str(chat_id).startswith(("-", "@")):
+                bucket = TokenBucket(self.group_rate, capacity=self.group_rate * 60)
+            else:
+                bucket = TokenBucket(self.chat_rate, capacity=self.chat_burst)
+        else:
+            bucket = entry[0]
+        self._chats[chat_id] = (bucket, now)
+
+        # A bucket that has not been used for a minute is full again and can be forgotten
+        while self._chats:
+            oldest_chat_id, (_, last_used) = next(iter(self._chats.items()))
+            if now - last_used < 60:
+                break
+            del self._chats[oldest_chat_id]
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = (rate_limit_args or {}).get("priority", ENDPOINT_PRIORITIES.get(endpoint, PRIORITY_INTERACTIVE))
+        chat_id = data.get("chat_id")
+        per_chat = chat_id is not None and endpoint.startswith(PER_CHAT_PREFIXES)
+        labels = (PRIORITY_NAMES.get(priority, str(priority)),)
+
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            if per_chat:
+                await self._chat_bucket(chat_id).acquire()
+            await self._acquire(priority)
+            telegram_queue_wait.observe(labels, time.perf_counter() - started)
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                if per_chat and self._record_flood(chat_id):
+                    logger.warning(
+                        "%s hit the flood limit in %s chats, pausing all Bot API calls for %s seconds.",
+                        endpoint, self.flood_chats, e.retry_after
+                    )
+                    self.pause(e.retry_after)
+                    continue
+                if per_chat:
+                    logger.warning(
+                        "%s hit the flood limit, pausing chat %s for %s seconds.", endpoint, chat_id, e.retry_after
+                    )
+                    self._chat_bucket(chat_id).pause(e.retry_after)
+                if not per_chat or priority > PRIORITY_INTERACTIVE:
+                    logger.warning(
+                        "%s hit the flood limit, pausing %s calls and less urgent ones for %s seconds.",
+                        endpoint, labels[0], e.retry_after
+                    )
+                    self.pause_priority(priority, e.retry_after)
+
+
+# The single scheduler shared by every Bot API call of this process
+telegram_scheduler = OutboundScheduler()
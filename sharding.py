@@ -0,0 +1,58 @@
+from telegram import Update
+
+from config import ADMIN_ID, WORKER_COUNT, WORKER_INDEX
+
+# Updates that every worker needs to see, because they change state each worker keeps in memory
+ALL_SHARDS = None
+
+
+def is_sharded() -> bool:
+    """True when users are split across more than one worker process."""
+    return WORKER_COUNT > 1
+
+
+def shard_for(user_id: int, count: int = WORKER_COUNT) -> int:
+    """The worker that owns a user: everything for that user is handled there."""
+    return user_id % count
+
+
+def owns_broadcasts() -> bool:
+    """
+    Broadcasts are started by the admin, so the admin's worker runs them and is
+    the only one that resumes an interrupted broadcast.
+    """
+    return shard_for(ADMIN_ID) == WORKER_INDEX
+
+
+def owns_admin_chat() -> bool:
+    """
+    Only the admin's worker sends notifications to the admin, so the admin chat's
+    rate limit is not multiplied by the number of workers. True when not sharded.
+    """
+    return owns_broadcasts()
+
+
+def current_shard() -> tuple | None:
+    """
+    (WORKER_COUNT, WORKER_INDEX) for storage queries that should only see this
+    worker's users, or None when not sharded. Users are matched by their ID, so
+    changing WORKER_COUNT needs no migration.
+    """
+    if not is_sharded():
+        return None
+    return WORKER_COUNT, WORKER_INDEX
+
+
+def shard_for_update(update: Update) -> int | None:
+    """
+    Returns the worker an update has to go to, or ALL_SHARDS if every worker needs it.
+    Joins are routed by the user who joined, commands by their sender.
+    """
+    if update.my_chat_member:
+        # The bot's own status in the channel feeds every worker's permission cache
+        return ALL_SHARDS
+    if update.chat_member:
+        return shard_for(update.chat_member.new_chat_member.user.id)
+    if update.effective_user:
+        return shard_for(update.effective_user.id)
+    return 0
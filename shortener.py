@@ -1,56 +1,198 @@
+import asyncio
 import logging
+import random
+import time
 import aiohttp
 
+from config import (
+    SHORTENER_TIMEOUT, SHORTENER_MAX_RETRIES, SHORTENER_POOL_SIZE,
+    SHORTENER_FAILURE_THRESHOLD, SHORTENER_RESET_SECONDS
+)
+from metrics import shortener_latency
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Base delay (seconds) for the exponential backoff between retries
+RETRY_BACKOFF_SECONDS = 0.5
+
+
+class ShortenerClient:
+    """
+    A long-lived client for the shortener API. It keeps one pooled aiohttp session,
+    applies a timeout to every request, retries transient failures with jittered
+    backoff and stops calling the provider for a while after repeated failures
+    (circuit breaker).
+    """
+
+    def __init__(
+        self,
+        timeout: float = SHORTENER_TIMEOUT,
+        max_retries: int = SHORTENER_MAX_RETRIES,
+        pool_size: int = SHORTENER_POOL_SIZE,
+        failure_threshold: int = SHORTENER_FAILURE_THRESHOLD,
+        reset_seconds: int = SHORTENER_RESET_SECONDS,
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._session = None
+
+        # Circuit breaker state
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+
+        # Counters
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.circuit_opens = 0
+        self.total_latency = 0.0
+
+    async def start(self) -> None:
+        """Creates the pooled HTTP session. Called once at application startup."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+
+    async def close(self) -> None:
+        """Closes the HTTP session. Called once at application shutdown."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def is_available(self) -> bool:
+        """
+        Returns False while the circuit breaker is open, i.e. the provider has failed
+        repeatedly and should not be called until the reset period has passed.
+        """
+        return time.monotonic() >= self._open_until
+
+    def stats(self) -> dict:
+        """Returns the latency and error counters of this client."""
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "retries": self.retries,
+            "circuit_opens": self.circuit_opens,
+            "circuit_open": not self.is_available(),
+            "avg_latency_seconds": self.total_latency / self.requests if self.requests else 0.0,
+        }
+
+    def _record_success(self) -> None:
+        self.successes += 1
+        self._consecutive_failures = 0
+
+    def _record_failure(self) -> None:
+        self.failures += 1
+        self._consecutive_failures += 1
+        if self._consecutive_failures >= self.failure_threshold and self.is_available():
+            self._open_until = time.monotonic() + self.reset_seconds
+            self.circuit_opens += 1
+            logger.warning(
+                "Shortener failed %s times in a row. Falling back to direct links for %s seconds.",
+                self._consecutive_failures, self.reset_seconds
+            )
+
+    async def shorten(self, domain: str, api_key: str, long_url: str) -> str | None:
+        """
+        Shortens a given URL using the specified shortener service by parsing its JSON response.
+        Returns None if the link could not be shortened.
+        """
+        if not domain or not api_key:
+            logger.warning("Shortener domain or API key is not configured.")
+            return None
+
+        if not self.is_available():
+            return None
+
+        if self._session is None or self._session.closed:
+            await self.start()
+
+        # Construct the API URL for the shortener service
+        api_url = f"https://{domain}/api"
+
+        # The parameters might differ based on your shortener service
+        params = {
+            'api': api_key,
+            'url': long_url,
+        }
+
+        self.requests += 1
+        started = time.monotonic()
+        short_url = None
+        try:
+            for attempt in range(self.max_retries + 1):
+                if attempt:
+                    self.retries += 1
+                    delay = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                    await asyncio.sleep(delay + random.uniform(0, delay))
+
+                try:
+                    short_url, retryable = await self._request(api_url, params, long_url)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.error("An error occurred during the API request to the shortener: %r", e)
+                    short_url, retryable = None, True
+
+                if short_url:
+                    self._record_success()
+                    return short_url
+                if not retryable:
+                    break
+
+            self._record_failure()
+            return None
+        finally:
+            elapsed = time.monotonic() - started
+            self.total_latency += elapsed
+            shortener_latency.observe(("success" if short_url else "failure",), elapsed)
+
+    async def _request(self, api_url: str, params: dict, long_url: str) -> tuple[str | None, bool]:
+        """
+        Makes a single request to the shortener API.
+        Returns the short URL (or None) and whether a failure is worth retrying.
+        """
+        async with self._session.get(api_url, params=params) as response:
+            if response.status == 200:
+                try:
+                    # Parse the JSON response from the API
+                    data = await response.json()
+                except aiohttp.ContentTypeError:
+                    # This error happens if the response is not valid JSON
+                    logger.error("Failed to parse JSON from shortener API response.")
+                    return None, False
+
+                # Check if the API call was successful and extract the URL from the 'shortenedUrl' key
+                if data.get("status") == "success" and data.get("shortenedUrl"):
+                    short_url = data["shortenedUrl"]
+                    logger.info("Successfully shortened URL: %s -> %s", long_url, short_url)
+                    return short_url, False
+
+                # Log the error message from the API if available
+                error_message = data.get('message', 'Unknown API error')
+                logger.error("Shortener API returned an error: %s", error_message)
+                return None, False
+
+            error_text = await response.text()
+            logger.error(
+                "Failed to shorten link. HTTP Status: %s, Response: %s", response.status, error_text
+            )
+            # Server errors and rate limiting are usually temporary
+            return None, response.status >= 500 or response.status == 429
+
+
+# The single client shared by the whole bot
+shortener_client = ShortenerClient()
+
+
 async def shorten_link(domain: str, api_key: str, long_url: str) -> str | None:
     """
-    Shortens a given URL using the specified shortener service by parsing its JSON response.
+    Shortens a given URL using the shared shortener client.
     """
-    if not domain or not api_key:
-        logger.warning("Shortener domain or API key is not configured.")
-        return None
-
-    # Construct the API URL for the shortener service
-    api_url = f"https://{domain}/api"
-    
-    # The parameters might differ based on your shortener service
-    params = {
-        'api': api_key,
-        'url': long_url,
-    }
-
-    try:
-        # Make an asynchronous GET request to the shortener API
-        async with aiohttp.ClientSession() as session:
-            async with session.get(api_url, params=params) as response:
-                if response.status == 200:
-                    try:
-                        # Parse the JSON response from the API
-                        data = await response.json()
-                        
-                        # Check if the API call was successful and extract the URL from the 'shortenedUrl' key
-                        if data.get("status") == "success" and data.get("shortenedUrl"):
-                            short_url = data["shortenedUrl"]
-                            logger.info(f"Successfully shortened URL: {long_url} -> {short_url}")
-                            return short_url
-                        else:
-                            # Log the error message from the API if available
-                            error_message = data.get('message', 'Unknown API error')
-                            logger.error(f"Shortener API returned an error: {error_message}")
-                            return None
-                            
-                    except aiohttp.ContentTypeError:
-                        # This error happens if the response is not valid JSON
-                        logger.error("Failed to parse JSON from shortener API response.")
-                        return None
-                else:
-                    error_text = await response.text()
-                    logger.error(
-                        f"Failed to shorten link. HTTP Status: {response.status}, Response: {error_text}"
-                    )
-                    return None
-    except aiohttp.ClientError as e:
-        logger.error(f"An error occurred during the API request to the shortener: {e}")
-        return None
+    return await shortener_client.shorten(domain, api_key, long_url)
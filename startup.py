@@ -0,0 +1,40 @@
+import logging
+import time
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# main.py imports this module first, so this is as close to process start as we get
+PROCESS_STARTED_AT = time.monotonic()
+
+# Seconds from process start until warm-up finished / the first update was handled
+_ready_after = None
+_first_update_after = None
+
+
+def mark_ready() -> None:
+    """Called when warm-up has finished and the bot is about to take updates."""
+    global _ready_after
+    if _ready_after is None:
+        _ready_after = time.monotonic() - PROCESS_STARTED_AT
+        logger.info("Ready to take updates %.2f seconds after start.", _ready_after)
+
+
+def is_ready() -> bool:
+    return _ready_after is not None
+
+
+def mark_update_handled() -> None:
+    """Called after every handled update; only the first one is recorded."""
+    global _first_update_after
+    if _first_update_after is None:
+        _first_update_after = time.monotonic() - PROCESS_STARTED_AT
+        logger.info("Handled the first update %.2f seconds after start.", _first_update_after)
+
+
+def startup_times() -> dict:
+    """Seconds until ready and until the first handled update, NaN while not reached yet."""
+    return {
+        "ready": _ready_after if _ready_after is not None else float("nan"),
+        "first_update": _first_update_after if _first_update_after is not None else float("nan"),
+    }
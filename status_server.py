@@ -0,0 +1,172 @@
+import hmac
+import logging
+import time
+from aiohttp import web
+from telegram import Update, User
+from telegram.ext import Application
+
+from config import BOT_MODE, STATUS_LISTEN, STATUS_PORT, SHARD_SECRET, WORKER_COUNT, WORKER_INDEX
+from database import count_pending_removals, user_writes, get_admin_settings
+from cluster import owns_shard
+from sharding import is_sharded, owns_admin_chat
+from notifications import join_notifier, get_join_notify_mode
+from shortener import shortener_client
+from metrics import render, sample
+from scheduler import telegram_scheduler
+from concurrency import update_processor
+from logging_setup import logging_stats
+from startup import is_ready, startup_times
+from known_users import known_users
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+_started_at = time.monotonic()
+_runner = None
+
+
+async def _healthz(request: web.Request) -> web.Response:
+    """Liveness check for load balancers: 200 while the application is running."""
+    application = request.app["application"]
+    healthy = application.running and owns_shard()
+    body = {
+        "status": "ok" if healthy else "stopped",
+        "mode": BOT_MODE,
+        "uptime_seconds": round(time.monotonic() - _started_at, 1),
+    }
+    if is_sharded():
+        body["shard"] = WORKER_INDEX
+        body["shards"] = WORKER_COUNT
+    return web.json_response(body, status=200 if healthy else 503)
+
+
+async def _readyz(request: web.Request) -> web.Response:
+    """Readiness check: 200 once the warm-up has finished and updates are being processed."""
+    application = request.app["application"]
+    ready = is_ready() and application.running and owns_shard()
+    return web.json_response({"status": "ready" if ready else "starting"}, status=200 if ready else 503)
+
+
+async def _metrics(request: web.Request) -> web.Response:
+    """All metrics in the Prometheus text format."""
+    application = request.app["application"]
+    shortener = shortener_client.stats()
+    startup = startup_times()
+    logs = logging_stats()
+
+    try:
+        pending_removals = await count_pending_removals()
+    except Exception as e:
+        logger.warning("Could not count pending removals for /metrics: %s", e)
+        pending_removals = float("nan")
+
+    extra_lines = [
+        *sample("bot_startup_ready_seconds", "Seconds from process start until the warm-up finished.",
+                startup["ready"]),
+        *sample("bot_startup_first_update_seconds", "Seconds from process start until the first handled update.",
+                startup["first_update"]),
+        *sample("bot_update_queue_size", "Updates received but not yet processed.",
+                application.update_queue.qsize()),
+        *sample("bot_updates_in_progress", "Updates being processed right now.", update_processor.in_progress()),
+        *sample("bot_updates_waiting", "Updates waiting for an earlier update of the same user or a free slot.",
+                update_processor.waiting()),
+        *sample("bot_telegram_queue_size", "Bot API requests waiting for the rate limits.",
+                telegram_scheduler.waiting()),
+        *sample("bot_pending_removals", "Members waiting to be removed from the channel.", pending_removals),
+        *sample("bot_known_users", "Users in the in-memory index used for join events, NaN while loading.",
+                len(known_users) if known_users.is_loaded() else float("nan")),
+        *sample("bot_known_users_bytes", "Approximate memory used by the known user index.",
+                known_users.memory_bytes()),
+        *sample("bot_write_buffer_size", "Users with buffered writes that are not in the database yet.",
+                len(user_writes)),
+        *sample("bot_log_records_dropped_total", "Log records dropped because the log queue was full.",
+                logs["dropped"], "counter"),
+        *sample("bot_log_records_suppressed_total", "Repetitive log records left out by the rate limit.",
+                logs["suppressed"], "counter"),
+        *sample("bot_shortener_requests_total", "Links sent to the shortener.", shortener["requests"], "counter"),
+        *sample("bot_shortener_failures_total", "Links the shortener failed to shorten.",
+                shortener["failures"], "counter"),
+        *sample("bot_shortener_retries_total", "Retried shortener requests.", shortener["retries"], "counter"),
+        *sample("bot_shortener_circuit_opens_total", "Times the shortener circuit breaker opened.",
+                shortener["circuit_opens"], "counter"),
+        *sample("bot_shortener_circuit_open", "1 while the shortener is skipped because it keeps failing.",
+                int(shortener["circuit_open"])),
+    ]
+    return web.Response(text=render(extra_lines), content_type="text/plain", charset="utf-8",
+                        headers={"Cache-Control": "no-store"})
+
+
+def _from_shard(request: web.Request) -> bool:
+    """True if the request carries SHARD_SECRET, i.e. comes from the router or another worker."""
+    return hmac.compare_digest(request.headers.get("X-Shard-Secret", ""), SHARD_SECRET)
+
+
+async def _updates(request: web.Request) -> web.Response:
+    """
+    Receives a batch of updates from the router in sharded mode and queues them in order.
+    Answers 503 while this worker cannot process them, so the router keeps and retries them.
+    """
+    if not _from_shard(request):
+        return web.json_response({"error": "forbidden"}, status=403)
+
+    application = request.app["application"]
+    if not application.running or not owns_shard():
+        return web.json_response({"error": "not ready"}, status=503)
+
+    payload = await request.json()
+    for data in payload:
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    return web.json_response({"accepted": len(payload)})
+
+
+async def _joins(request: web.Request) -> web.Response:
+    """
+    Receives the joins other workers saw, on the admin's worker in sharded mode, and
+    notifies the admin about them like about its own.
+    """
+    if not _from_shard(request):
+        return web.json_response({"error": "forbidden"}, status=403)
+
+    application = request.app["application"]
+    if not application.running:
+        return web.json_response({"error": "not ready"}, status=503)
+
+    payload = await request.json()
+    mode = get_join_notify_mode(await get_admin_settings())
+    for data in payload:
+        join_notifier.notify(application.bot, User.de_json(data, application.bot), mode)
+    return web.json_response({"accepted": len(payload)})
+
+
+async def start_status_server(application: Application) -> None:
+    """
+    Starts the local HTTP status server (/healthz, /readyz and /metrics) if STATUS_PORT is set.
+    In sharded mode it also receives this worker's updates from the router on /updates,
+    and on the admin's worker the other workers' joins on /joins.
+    """
+    global _runner
+    if not STATUS_PORT or _runner is not None:
+        return
+
+    app = web.Application()
+    app["application"] = application
+    app.router.add_get("/healthz", _healthz)
+    app.router.add_get("/readyz", _readyz)
+    app.router.add_get("/metrics", _metrics)
+    if is_sharded():
+        app.router.add_post("/updates", _updates)
+        if owns_admin_chat():
+            app.router.add_post("/joins", _joins)
+
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, STATUS_LISTEN, STATUS_PORT).start()
+    logger.info("Status server listening on %s:%s.", STATUS_LISTEN, STATUS_PORT)
+
+
+async def stop_status_server() -> None:
+    """Stops the status server."""
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,24 @@
+"""
+Storage backends. database.py talks to one of these through the Storage interface;
+STORAGE_BACKEND picks which one. Backends are imported only when chosen, so pymongo
+is not needed for SQLite or in-memory storage.
+"""
+from storage.base import Storage
+
+BACKENDS = ("mongo", "sqlite", "memory")
+
+
+def create_storage(backend: str) -> Storage:
+    """Creates the (not yet opened) storage for a STORAGE_BACKEND value."""
+    if backend == "mongo":
+        from config import MONGO_URI, DB_CONNECT_TIMEOUT
+        from storage.mongo import MongoStorage
+        return MongoStorage(MONGO_URI, DB_CONNECT_TIMEOUT)
+    if backend == "sqlite":
+        from config import SQLITE_PATH, DB_CONNECT_TIMEOUT
+        from storage.sqlite import SQLiteStorage
+        return SQLiteStorage(SQLITE_PATH, busy_timeout=DB_CONNECT_TIMEOUT)
+    if backend == "memory":
+        from storage.memory import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend {backend!r}, expected one of: {', '.join(BACKENDS)}")
@@ -0,0 +1,171 @@
+from abc import ABC, abstractmethod
+
+# Users that can no longer be messaged get status USER_UNREACHABLE; reachable users have no status
+USER_UNREACHABLE = "unreachable"
+UNREACHABLE_FIELDS = ("status", "unreachable_since", "unreachable_reason")
+
+# Fields of a user who has just been created
+USER_DEFAULTS = {
+    "has_received_free_link": False,
+    "last_link_timestamp": None
+}
+
+# The admin settings before the admin has configured anything
+DEFAULT_SETTINGS = {
+    "_id": 1,
+    "channel_id": None,
+    "shortener_api": None,
+    "shortener_domain": None,
+    "invite_duration_seconds": 86400  # Default: 1 day in seconds
+}
+
+
+class Storage(ABC):
+    """
+    Everything the bot keeps: admin settings, users, pending removals, broadcasts,
+    stats counters and leases. Methods are blocking; database.py runs them on its
+    thread pool unless `blocking` is False, in which case they are called directly
+    on the event loop.
+
+    Documents are plain dicts shaped like the MongoDB documents, with the ID in "_id".
+    `shard` arguments are (worker count, worker index) to only see the users of one
+    worker (user ID modulo count equals index), or None for all users.
+    """
+
+    # Whether calls may wait on disk or network and must be kept off the event loop
+    blocking = True
+
+    # Name used in log messages
+    name = "storage"
+
+    @abstractmethod
+    def open(self) -> None:
+        """Connects or opens the files and checks that the storage answers."""
+
+    def close(self) -> None:
+        """Releases connections and files."""
+
+    @abstractmethod
+    def ensure_indexes(self) -> None:
+        """Creates the indexes (or tables) the queries rely on. Cheap when they already exist."""
+
+    # --- Admin Settings ---
+
+    @abstractmethod
+    def load_settings(self) -> dict:
+        """Returns the admin settings, storing DEFAULT_SETTINGS first if there are none."""
+
+    @abstractmethod
+    def update_settings(self, fields: dict) -> None:
+        """Sets the given fields on the admin settings."""
+
+    @abstractmethod
+    def delete_settings(self) -> bool:
+        """Deletes the admin settings. Returns True if there were any."""
+
+    # --- Users ---
+
+    @abstractmethod
+    def get_user(self, user_id: int) -> dict | None:
+        """Returns the user, or None if they are not stored."""
+
+    @abstractmethod
+    def get_or_create_user(self, user_id: int) -> tuple[dict, bool]:
+        """
+        Returns the user as it was before this call and whether it was just created,
+        atomically. Clears UNREACHABLE_FIELDS, since the user just talked to the bot.
+        A user that is missing but archived is restored and not reported as created.
+        """
+
+    @abstractmethod
+    def insert_users(self, users: list) -> None:
+        """Stores whole user documents, replacing existing ones. For bulk loading."""
+
+    @abstractmethod
+    def update_users(self, fields_by_user: dict) -> None:
+        """Sets fields on several existing users at once: user ID -> fields."""
+
+    @abstractmethod
+    def count_users(self, reachable_only: bool = False) -> int:
+        """Returns the number of users, optionally only those not marked unreachable."""
+
+    @abstractmethod
+    def get_user_ids_after(self, last_id, limit: int, include_unreachable: bool = False) -> list:
+        """
+        Returns up to `limit` IDs of reachable users (or of all users) greater than
+        `last_id` in ascending order, or from the beginning if `last_id` is None.
+        """
+
+    @abstractmethod
+    def archive_unreachable_users(self, before: float, limit: int, shard: tuple | None) -> int:
+        """
+        Moves up to `limit` users marked unreachable before `before` (epoch seconds)
+        to the archive. Returns how many were moved.
+        """
+
+    # --- Pending Removals ---
+
+    @abstractmethod
+    def set_removal(self, user_id: int, channel_id: int, remove_at: float) -> None:
+        """Stores the removal deadline for a user, replacing one for the same user and channel."""
+
+    @abstractmethod
+    def get_due_removals(self, now: float, limit: int, shard: tuple | None) -> list:
+        """Returns up to `limit` removals with a deadline at or before `now`, oldest first."""
+
+    @abstractmethod
+    def delete_removals(self, removals: list) -> None:
+        """Deletes the given removals, skipping any whose deadline changed after they were read."""
+
+    @abstractmethod
+    def postpone_removal(self, removal: dict, remove_at: float) -> None:
+        """Moves the deadline of a removal that was read earlier, unless it changed in the meantime."""
+
+    @abstractmethod
+    def count_pending_removals(self) -> int:
+        """Returns the number of pending removals, cheaply and possibly approximately."""
+
+    @abstractmethod
+    def get_next_removal_time(self, shard: tuple | None) -> float | None:
+        """Returns the earliest pending removal deadline, or None."""
+
+    # --- Broadcasts ---
+
+    @abstractmethod
+    def create_broadcast(self, broadcast: dict) -> None:
+        """Stores a new broadcast."""
+
+    @abstractmethod
+    def get_running_broadcast(self) -> dict | None:
+        """Returns the broadcast with status "running", or None."""
+
+    @abstractmethod
+    def update_broadcast(self, broadcast_id, fields: dict) -> None:
+        """Sets the given fields on a broadcast."""
+
+    # --- Stats Counters ---
+
+    @abstractmethod
+    def increment_stats(self, increments: dict) -> None:
+        """Applies stats document ID -> field -> amount increments in one batch."""
+
+    @abstractmethod
+    def get_stats(self, doc_ids: list) -> dict:
+        """Returns the requested stats documents that exist, keyed by their ID."""
+
+    @abstractmethod
+    def set_stat(self, doc_id: str, field: str, value: int) -> None:
+        """Sets one counter to an absolute value."""
+
+    # --- Leases ---
+
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, now: float, ttl: float) -> bool:
+        """
+        Takes or renews the lease `name` for `owner` until `now + ttl`. Returns False if
+        another owner holds it and it has not expired at `now`.
+        """
+
+    @abstractmethod
+    def release_lease(self, name: str, owner: str) -> None:
+        """Deletes the lease `name` if `owner` holds it."""
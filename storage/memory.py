@@ -0,0 +1,202 @@
+import bisect
+import copy
+import heapq
+import logging
+
+from storage.base import Storage, USER_UNREACHABLE, UNREACHABLE_FIELDS, USER_DEFAULTS, DEFAULT_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+def _in_shard(user_id: int, shard: tuple | None) -> bool:
+    return shard is None or user_id % shard[0] == shard[1]
+
+
+class MemoryStorage(Storage):
+    """
+    Keeps everything in this process's memory, so nothing survives a restart and
+    only a single worker can use it. Meant for tests, local development and
+    deployments that can afford to lose their users and pending removals.
+
+    Every call is a few dict operations, so it runs directly on the event loop.
+    Returned documents are copies; changing them does not change what is stored.
+    """
+
+    blocking = False
+    name = "in-memory storage"
+
+    def __init__(self):
+        self.settings = None
+        self.users = {}
+        # Sorted IDs of all users, for the broadcaster's range scans
+        self.user_ids = []
+        self.unreachable_ids = set()
+        self.users_archive = {}
+        self.removals = {}
+        self.broadcasts = {}
+        self.stats = {}
+        self.leases = {}
+
+    def open(self) -> None:
+        pass
+
+    def ensure_indexes(self) -> None:
+        pass
+
+    # --- Admin Settings ---
+
+    def load_settings(self) -> dict:
+        if self.settings is None:
+            self.settings = dict(DEFAULT_SETTINGS)
+        return dict(self.settings)
+
+    def update_settings(self, fields: dict) -> None:
+        self.settings = {**(self.settings or {"_id": 1}), **fields}
+
+    def delete_settings(self) -> bool:
+        existed, self.settings = self.settings is not None, None
+        return existed
+
+    # --- Users ---
+
+    def _store_user(self, user: dict) -> None:
+        user_id = user["_id"]
+        if user_id not in self.users:
+            bisect.insort(self.user_ids, user_id)
+        self.users[user_id] = user
+        if user.get("status") == USER_UNREACHABLE:
+            self.unreachable_ids.add(user_id)
+        else:
+            self.unreachable_ids.discard(user_id)
+
+    def _delete_user(self, user_id: int) -> None:
+        del self.users[user_id]
+        del self.user_ids[bisect.bisect_left(self.user_ids, user_id)]
+        self.unreachable_ids.discard(user_id)
+
+    def get_user(self, user_id: int) -> dict | None:
+        user = self.users.get(user_id)
+        return copy.deepcopy(user) if user is not None else None
+
+    def get_or_create_user(self, user_id: int) -> tuple[dict, bool]:
+        previous = self.users.get(user_id)
+        if previous is not None:
+            self._store_user({key: value for key, value in previous.items() if key not in UNREACHABLE_FIELDS})
+            return copy.deepcopy(previous), False
+
+        archived = self.users_archive.pop(user_id, None)
+        if archived is not None:
+            user = {key: value for key, value in archived.items() if key not in UNREACHABLE_FIELDS}
+            self._store_user(user)
+            logger.info("Restored archived user %s.", user_id)
+            return copy.deepcopy(user), False
+
+        user = {"_id": user_id, **USER_DEFAULTS}
+        self._store_user(user)
+        return dict(user), True
+
+    def insert_users(self, users: list) -> None:
+        for user in users:
+            self._store_user(copy.deepcopy(user))
+
+    def update_users(self, fields_by_user: dict) -> None:
+        for user_id, fields in fields_by_user.items():
+            user = self.users.get(user_id)
+            if user is not None:
+                self._store_user({**user, **copy.deepcopy(fields)})
+
+    def count_users(self, reachable_only: bool = False) -> int:
+        return len(self.users) - (len(self.unreachable_ids) if reachable_only else 0)
+
+    def get_user_ids_after(self, last_id, limit: int, include_unreachable: bool = False) -> list:
+        start = 0 if last_id is None else bisect.bisect_right(self.user_ids, last_id)
+        if include_unreachable:
+            return self.user_ids[start:start + limit]
+        result = []
+        for user_id in self.user_ids[start:start + limit + len(self.unreachable_ids)]:
+            if user_id not in self.unreachable_ids:
+                result.append(user_id)
+                if len(result) == limit:
+                    break
+        return result
+
+    def archive_unreachable_users(self, before: float, limit: int, shard: tuple | None) -> int:
+        user_ids = [
+            user_id for user_id in self.unreachable_ids
+            if _in_shard(user_id, shard) and self.users[user_id]["unreachable_since"] < before
+        ][:limit]
+        for user_id in user_ids:
+            self.users_archive[user_id] = self.users[user_id]
+            self._delete_user(user_id)
+        return len(user_ids)
+
+    # --- Pending Removals ---
+
+    def set_removal(self, user_id: int, channel_id: int, remove_at: float) -> None:
+        removal_id = f"{user_id}_{channel_id}"
+        self.removals[removal_id] = {"_id": removal_id, "user_id": user_id, "channel_id": channel_id, "remove_at": remove_at}
+
+    def get_due_removals(self, now: float, limit: int, shard: tuple | None) -> list:
+        due = (doc for doc in self.removals.values() if doc["remove_at"] <= now and _in_shard(doc["user_id"], shard))
+        return [dict(doc) for doc in heapq.nsmallest(limit, due, key=lambda doc: doc["remove_at"])]
+
+    def delete_removals(self, removals: list) -> None:
+        for doc in removals:
+            stored = self.removals.get(doc["_id"])
+            if stored is not None and stored["remove_at"] == doc["remove_at"]:
+                del self.removals[doc["_id"]]
+
+    def postpone_removal(self, removal: dict, remove_at: float) -> None:
+        stored = self.removals.get(removal["_id"])
+        if stored is not None and stored["remove_at"] == removal["remove_at"]:
+            stored["remove_at"] = remove_at
+
+    def count_pending_removals(self) -> int:
+        return len(self.removals)
+
+    def get_next_removal_time(self, shard: tuple | None) -> float | None:
+        return min(
+            (doc["remove_at"] for doc in self.removals.values() if _in_shard(doc["user_id"], shard)), default=None
+        )
+
+    # --- Broadcasts ---
+
+    def create_broadcast(self, broadcast: dict) -> None:
+        self.broadcasts[broadcast["_id"]] = copy.deepcopy(broadcast)
+
+    def get_running_broadcast(self) -> dict | None:
+        for broadcast in self.broadcasts.values():
+            if broadcast.get("status") == "running":
+                return copy.deepcopy(broadcast)
+        return None
+
+    def update_broadcast(self, broadcast_id, fields: dict) -> None:
+        if broadcast_id in self.broadcasts:
+            self.broadcasts[broadcast_id].update(copy.deepcopy(fields))
+
+    # --- Stats Counters ---
+
+    def increment_stats(self, increments: dict) -> None:
+        for doc_id, fields in increments.items():
+            doc = self.stats.setdefault(doc_id, {"_id": doc_id})
+            for field, amount in fields.items():
+                doc[field] = doc.get(field, 0) + amount
+
+    def get_stats(self, doc_ids: list) -> dict:
+        return {doc_id: dict(self.stats[doc_id]) for doc_id in doc_ids if doc_id in self.stats}
+
+    def set_stat(self, doc_id: str, field: str, value: int) -> None:
+        self.stats.setdefault(doc_id, {"_id": doc_id})[field] = value
+
+    # --- Leases ---
+
+    def acquire_lease(self, name: str, owner: str, now: float, ttl: float) -> bool:
+        lease = self.leases.get(name)
+        if lease is not None and lease["owner"] != owner and lease["expires_at"] >= now:
+            return False
+        self.leases[name] = {"_id": name, "owner": owner, "expires_at": now + ttl}
+        return True
+
+    def release_lease(self, name: str, owner: str) -> None:
+        if self.leases.get(name, {}).get("owner") == owner:
+            del self.leases[name]
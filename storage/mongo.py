@@ -0,0 +1,208 @@
+import logging
+from pymongo import MongoClient, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from storage.base import Storage, USER_UNREACHABLE, UNREACHABLE_FIELDS, USER_DEFAULTS, DEFAULT_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+def _shard_filter(field: str, shard: tuple | None) -> dict:
+    """Query fragment matching only the given shard's users."""
+    if shard is None:
+        return {}
+    count, index = shard
+    return {field: {"$mod": [count, index]}}
+
+
+class MongoStorage(Storage):
+    """
+    Stores everything in MongoDB. Each call is one or a few round trips; bulk
+    operations use unordered bulk_write.
+    """
+
+    name = "MongoDB"
+
+    def __init__(self, uri: str, connect_timeout: float, database_name: str = "TelegramBotDB"):
+        self.uri = uri
+        self.connect_timeout = connect_timeout
+        self.database_name = database_name
+        self.client = None
+
+    def open(self) -> None:
+        client = MongoClient(self.uri, serverSelectionTimeoutMS=int(self.connect_timeout * 1000))
+        try:
+            # The ping command is cheap and does not require auth. Used to check the connection.
+            client.admin.command("ping")
+        except Exception:
+            client.close()
+            raise
+
+        self.client = client
+        db = client.get_database(self.database_name)
+        self.admin_settings = db.get_collection("admin_settings")
+        self.users_collection = db.get_collection("users")
+        self.users_archive_collection = db.get_collection("users_archive")
+        self.removals_collection = db.get_collection("pending_removals")
+        self.broadcasts_collection = db.get_collection("broadcasts")
+        self.stats_collection = db.get_collection("stats")
+        self.leases_collection = db.get_collection("leases")
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+
+    def ensure_indexes(self) -> None:
+        # Index used by the expiry sweeper to find the next due removal
+        self.removals_collection.create_index("remove_at")
+        # Index used to find unreachable users to archive; reachable users have no status and are not in it
+        self.users_collection.create_index([("status", 1), ("unreachable_since", 1)], sparse=True)
+
+    # --- Admin Settings ---
+
+    def load_settings(self) -> dict:
+        settings = self.admin_settings.find_one({"_id": 1})
+        if not settings:
+            # Create default settings if none exist
+            settings = dict(DEFAULT_SETTINGS)
+            self.admin_settings.insert_one(dict(settings))
+        return settings
+
+    def update_settings(self, fields: dict) -> None:
+        self.admin_settings.update_one({"_id": 1}, {"$set": fields}, upsert=True)
+
+    def delete_settings(self) -> bool:
+        return self.admin_settings.delete_one({"_id": 1}).deleted_count > 0
+
+    # --- Users ---
+
+    def get_user(self, user_id: int) -> dict | None:
+        return self.users_collection.find_one({"_id": user_id})
+
+    def get_or_create_user(self, user_id: int) -> tuple[dict, bool]:
+        previous = self.users_collection.find_one_and_update(
+            {"_id": user_id},
+            {"$setOnInsert": USER_DEFAULTS, "$unset": {field: "" for field in UNREACHABLE_FIELDS}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+        if previous is not None:
+            return previous, False
+
+        archived = self.users_archive_collection.find_one({"_id": user_id})
+        if archived is None:
+            return {"_id": user_id, **USER_DEFAULTS}, True
+        fields = {key: value for key, value in archived.items() if key not in ("_id", *UNREACHABLE_FIELDS)}
+        self.users_collection.update_one({"_id": user_id}, {"$set": fields})
+        self.users_archive_collection.delete_one({"_id": user_id})
+        logger.info("Restored archived user %s.", user_id)
+        return {"_id": user_id, **fields}, False
+
+    def insert_users(self, users: list) -> None:
+        if users:
+            operations = [ReplaceOne({"_id": user["_id"]}, user, upsert=True) for user in users]
+            self.users_collection.bulk_write(operations, ordered=False)
+
+    def update_users(self, fields_by_user: dict) -> None:
+        if fields_by_user:
+            operations = [UpdateOne({"_id": user_id}, {"$set": fields}) for user_id, fields in fields_by_user.items()]
+            self.users_collection.bulk_write(operations, ordered=False)
+
+    def count_users(self, reachable_only: bool = False) -> int:
+        query = {"status": {"$ne": USER_UNREACHABLE}} if reachable_only else {}
+        return self.users_collection.count_documents(query)
+
+    def get_user_ids_after(self, last_id, limit: int, include_unreachable: bool = False) -> list:
+        query = {} if include_unreachable else {"status": {"$ne": USER_UNREACHABLE}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        return [doc["_id"] for doc in self.users_collection.find(query, {"_id": 1}).sort("_id", 1).limit(limit)]
+
+    def archive_unreachable_users(self, before: float, limit: int, shard: tuple | None) -> int:
+        query = {"status": USER_UNREACHABLE, "unreachable_since": {"$lt": before}, **_shard_filter("_id", shard)}
+        docs = list(self.users_collection.find(query).limit(limit))
+        if not docs:
+            return 0
+        user_ids = [doc["_id"] for doc in docs]
+        self.users_archive_collection.bulk_write(
+            [UpdateOne({"_id": doc.pop("_id")}, {"$set": doc}, upsert=True) for doc in docs], ordered=False
+        )
+        # A user who came back meanwhile is no longer unreachable and stays
+        self.users_collection.delete_many({"_id": {"$in": user_ids}, "status": USER_UNREACHABLE})
+        return len(docs)
+
+    # --- Pending Removals ---
+
+    def set_removal(self, user_id: int, channel_id: int, remove_at: float) -> None:
+        self.removals_collection.update_one(
+            {"_id": f"{user_id}_{channel_id}"},
+            {"$set": {"user_id": user_id, "channel_id": channel_id, "remove_at": remove_at}},
+            upsert=True
+        )
+
+    def get_due_removals(self, now: float, limit: int, shard: tuple | None) -> list:
+        query = {"remove_at": {"$lte": now}, **_shard_filter("user_id", shard)}
+        return list(self.removals_collection.find(query).sort("remove_at", 1).limit(limit))
+
+    def delete_removals(self, removals: list) -> None:
+        if removals:
+            self.removals_collection.delete_many(
+                {"$or": [{"_id": doc["_id"], "remove_at": doc["remove_at"]} for doc in removals]}
+            )
+
+    def postpone_removal(self, removal: dict, remove_at: float) -> None:
+        self.removals_collection.update_one(
+            {"_id": removal["_id"], "remove_at": removal["remove_at"]}, {"$set": {"remove_at": remove_at}}
+        )
+
+    def count_pending_removals(self) -> int:
+        # From collection metadata, so it stays cheap
+        return self.removals_collection.estimated_document_count()
+
+    def get_next_removal_time(self, shard: tuple | None) -> float | None:
+        doc = self.removals_collection.find_one(_shard_filter("user_id", shard), sort=[("remove_at", 1)])
+        return doc["remove_at"] if doc else None
+
+    # --- Broadcasts ---
+
+    def create_broadcast(self, broadcast: dict) -> None:
+        self.broadcasts_collection.insert_one(dict(broadcast))
+
+    def get_running_broadcast(self) -> dict | None:
+        return self.broadcasts_collection.find_one({"status": "running"})
+
+    def update_broadcast(self, broadcast_id, fields: dict) -> None:
+        self.broadcasts_collection.update_one({"_id": broadcast_id}, {"$set": fields})
+
+    # --- Stats Counters ---
+
+    def increment_stats(self, increments: dict) -> None:
+        if increments:
+            operations = [
+                UpdateOne({"_id": doc_id}, {"$inc": fields}, upsert=True)
+                for doc_id, fields in increments.items()
+            ]
+            self.stats_collection.bulk_write(operations, ordered=False)
+
+    def get_stats(self, doc_ids: list) -> dict:
+        return {doc["_id"]: doc for doc in self.stats_collection.find({"_id": {"$in": doc_ids}})}
+
+    def set_stat(self, doc_id: str, field: str, value: int) -> None:
+        self.stats_collection.update_one({"_id": doc_id}, {"$set": {field: value}}, upsert=True)
+
+    # --- Leases ---
+
+    def acquire_lease(self, name: str, owner: str, now: float, ttl: float) -> bool:
+        try:
+            self.leases_collection.update_one(
+                {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + ttl}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The lease exists and is held by another owner, so the upsert tried to insert a second one
+            return False
+        return True
+
+    def release_lease(self, name: str, owner: str) -> None:
+        self.leases_collection.delete_one({"_id": name, "owner": owner})
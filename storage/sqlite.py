@@ -0,0 +1,329 @@
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from storage.base import Storage, USER_UNREACHABLE, UNREACHABLE_FIELDS, USER_DEFAULTS, DEFAULT_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    status TEXT,
+    unreachable_since REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_unreachable ON users (status, unreachable_since) WHERE status IS NOT NULL;
+CREATE TABLE IF NOT EXISTS users_archive (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS removals (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    remove_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS removals_remove_at ON removals (remove_at);
+CREATE TABLE IF NOT EXISTS broadcasts (id INTEGER PRIMARY KEY, status TEXT, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS stats (
+    id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (id, field)
+);
+CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL);
+"""
+
+
+def _shard_clause(column: str, shard: tuple | None) -> tuple[str, tuple]:
+    """SQL condition and parameters matching only the given shard's users."""
+    if shard is None:
+        return "1", ()
+    return f"{column} % ? = ?", shard
+
+
+def _user_row(user: dict) -> tuple:
+    """(status, unreachable_since, data, id) for writing a user document."""
+    data = {key: value for key, value in user.items() if key != "_id"}
+    return user.get("status"), user.get("unreachable_since"), json.dumps(data), user["_id"]
+
+
+class SQLiteStorage(Storage):
+    """
+    Stores everything in one local SQLite file, so no call leaves the machine.
+
+    The file is opened in WAL mode with synchronous=NORMAL: readers never wait for
+    the writer, and a commit only appends to the log instead of syncing the whole
+    database. Each method is one transaction, so batches (write-behind flushes,
+    counter increments, removal sweeps) are written with one commit. Several worker
+    processes on the same host may share the file; SQLite serializes their writes
+    and a writer waits up to `busy_timeout` seconds for another one.
+
+    Document fields are kept as JSON; the columns next to it are copies of the
+    fields that queries filter on.
+    """
+
+    name = "SQLite"
+
+    def __init__(self, path: str, busy_timeout: float = 10.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.connection = None
+        # One connection is shared by the database thread pool, one call at a time
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        connection = sqlite3.connect(
+            self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False
+        )
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            # The tables are needed by everything else, so they are created here and not in ensure_indexes()
+            connection.executescript(SCHEMA)
+        except Exception:
+            connection.close()
+            raise
+        self.connection = connection
+
+    def close(self) -> None:
+        if self.connection is not None:
+            with self._lock:
+                self.connection.close()
+                self.connection = None
+
+    @contextmanager
+    def _transaction(self):
+        """Runs the block as one write transaction and commits it, or rolls it back on an error."""
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def _query(self, sql: str, parameters=()) -> list:
+        with self._lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def ensure_indexes(self) -> None:
+        # Created together with the tables in open()
+        pass
+
+    # --- Admin Settings ---
+
+    def load_settings(self) -> dict:
+        with self._transaction() as connection:
+            row = connection.execute("SELECT data FROM settings WHERE id = 1").fetchone()
+            if row is not None:
+                return {"_id": 1, **json.loads(row[0])}
+            # Create default settings if none exist
+            settings = dict(DEFAULT_SETTINGS)
+            connection.execute("INSERT INTO settings (id, data) VALUES (1, ?)", (json.dumps(settings),))
+            return settings
+
+    def update_settings(self, fields: dict) -> None:
+        with self._transaction() as connection:
+            row = connection.execute("SELECT data FROM settings WHERE id = 1").fetchone()
+            settings = {**(json.loads(row[0]) if row else {}), **fields}
+            connection.execute("INSERT OR REPLACE INTO settings (id, data) VALUES (1, ?)", (json.dumps(settings),))
+
+    def delete_settings(self) -> bool:
+        with self._transaction() as connection:
+            return connection.execute("DELETE FROM settings WHERE id = 1").rowcount > 0
+
+    # --- Users ---
+
+    @staticmethod
+    def _load_user(connection, user_id: int) -> dict | None:
+        row = connection.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+        return {"_id": user_id, **json.loads(row[0])} if row else None
+
+    def get_user(self, user_id: int) -> dict | None:
+        with self._lock:
+            return self._load_user(self.connection, user_id)
+
+    def get_or_create_user(self, user_id: int) -> tuple[dict, bool]:
+        with self._transaction() as connection:
+            previous = self._load_user(connection, user_id)
+            if previous is not None:
+                if any(field in previous for field in UNREACHABLE_FIELDS):
+                    user = {key: value for key, value in previous.items() if key not in UNREACHABLE_FIELDS}
+                    connection.execute(
+                        "UPDATE users SET status = ?, unreachable_since = ?, data = ? WHERE id = ?", _user_row(user)
+                    )
+                return previous, False
+
+            row = connection.execute("SELECT data FROM users_archive WHERE id = ?", (user_id,)).fetchone()
+            if row is not None:
+                archived = json.loads(row[0])
+                user = {"_id": user_id, **{key: value for key, value in archived.items() if key not in UNREACHABLE_FIELDS}}
+                connection.execute("DELETE FROM users_archive WHERE id = ?", (user_id,))
+                created = False
+                logger.info("Restored archived user %s.", user_id)
+            else:
+                user = {"_id": user_id, **USER_DEFAULTS}
+                created = True
+            connection.execute(
+                "INSERT INTO users (status, unreachable_since, data, id) VALUES (?, ?, ?, ?)", _user_row(user)
+            )
+            return user, created
+
+    def insert_users(self, users: list) -> None:
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO users (status, unreachable_since, data, id) VALUES (?, ?, ?, ?)",
+                (_user_row(user) for user in users)
+            )
+
+    def update_users(self, fields_by_user: dict) -> None:
+        if not fields_by_user:
+            return
+        with self._transaction() as connection:
+            rows = []
+            for user_id, fields in fields_by_user.items():
+                user = self._load_user(connection, user_id)
+                if user is not None:
+                    rows.append(_user_row({**user, **fields}))
+            connection.executemany("UPDATE users SET status = ?, unreachable_since = ?, data = ? WHERE id = ?", rows)
+
+    def count_users(self, reachable_only: bool = False) -> int:
+        if reachable_only:
+            sql, parameters = "SELECT COUNT(*) FROM users WHERE status IS NOT ?", (USER_UNREACHABLE,)
+        else:
+            sql, parameters = "SELECT COUNT(*) FROM users", ()
+        return self._query(sql, parameters)[0][0]
+
+    def get_user_ids_after(self, last_id, limit: int, include_unreachable: bool = False) -> list:
+        condition, parameters = ("1", ()) if include_unreachable else ("status IS NOT ?", (USER_UNREACHABLE,))
+        rows = self._query(
+            f"SELECT id FROM users WHERE id > ? AND {condition} ORDER BY id LIMIT ?",
+            (last_id if last_id is not None else -2**63, *parameters, limit)
+        )
+        return [row[0] for row in rows]
+
+    def archive_unreachable_users(self, before: float, limit: int, shard: tuple | None) -> int:
+        condition, parameters = _shard_clause("id", shard)
+        with self._transaction() as connection:
+            rows = connection.execute(
+                f"SELECT id, data FROM users WHERE status = ? AND unreachable_since < ? AND {condition} LIMIT ?",
+                (USER_UNREACHABLE, before, *parameters, limit)
+            ).fetchall()
+            connection.executemany("INSERT OR REPLACE INTO users_archive (id, data) VALUES (?, ?)", rows)
+            connection.executemany("DELETE FROM users WHERE id = ?", ((row[0],) for row in rows))
+            return len(rows)
+
+    # --- Pending Removals ---
+
+    def set_removal(self, user_id: int, channel_id: int, remove_at: float) -> None:
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO removals (id, user_id, channel_id, remove_at) VALUES (?, ?, ?, ?)",
+                (f"{user_id}_{channel_id}", user_id, channel_id, remove_at)
+            )
+
+    def get_due_removals(self, now: float, limit: int, shard: tuple | None) -> list:
+        condition, parameters = _shard_clause("user_id", shard)
+        rows = self._query(
+            f"SELECT id, user_id, channel_id, remove_at FROM removals WHERE remove_at <= ? AND {condition} "
+            "ORDER BY remove_at LIMIT ?",
+            (now, *parameters, limit)
+        )
+        return [
+            {"_id": removal_id, "user_id": user_id, "channel_id": channel_id, "remove_at": remove_at}
+            for removal_id, user_id, channel_id, remove_at in rows
+        ]
+
+    def delete_removals(self, removals: list) -> None:
+        if not removals:
+            return
+        with self._transaction() as connection:
+            connection.executemany(
+                "DELETE FROM removals WHERE id = ? AND remove_at = ?",
+                ((doc["_id"], doc["remove_at"]) for doc in removals)
+            )
+
+    def postpone_removal(self, removal: dict, remove_at: float) -> None:
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE removals SET remove_at = ? WHERE id = ? AND remove_at = ?",
+                (remove_at, removal["_id"], removal["remove_at"])
+            )
+
+    def count_pending_removals(self) -> int:
+        return self._query("SELECT COUNT(*) FROM removals")[0][0]
+
+    def get_next_removal_time(self, shard: tuple | None) -> float | None:
+        condition, parameters = _shard_clause("user_id", shard)
+        return self._query(f"SELECT MIN(remove_at) FROM removals WHERE {condition}", parameters)[0][0]
+
+    # --- Broadcasts ---
+
+    def create_broadcast(self, broadcast: dict) -> None:
+        data = {key: value for key, value in broadcast.items() if key != "_id"}
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT INTO broadcasts (id, status, data) VALUES (?, ?, ?)",
+                (broadcast["_id"], broadcast.get("status"), json.dumps(data))
+            )
+
+    def get_running_broadcast(self) -> dict | None:
+        rows = self._query("SELECT id, data FROM broadcasts WHERE status = 'running' LIMIT 1")
+        return {"_id": rows[0][0], **json.loads(rows[0][1])} if rows else None
+
+    def update_broadcast(self, broadcast_id, fields: dict) -> None:
+        with self._transaction() as connection:
+            row = connection.execute("SELECT data FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+            if row is None:
+                return
+            data = {**json.loads(row[0]), **fields}
+            connection.execute(
+                "UPDATE broadcasts SET status = ?, data = ? WHERE id = ?",
+                (data.get("status"), json.dumps(data), broadcast_id)
+            )
+
+    # --- Stats Counters ---
+
+    def increment_stats(self, increments: dict) -> None:
+        if not increments:
+            return
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT INTO stats (id, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (id, field) DO UPDATE SET value = value + excluded.value",
+                ((doc_id, field, amount) for doc_id, fields in increments.items() for field, amount in fields.items())
+            )
+
+    def get_stats(self, doc_ids: list) -> dict:
+        if not doc_ids:
+            return {}
+        rows = self._query(
+            f"SELECT id, field, value FROM stats WHERE id IN ({', '.join('?' * len(doc_ids))})", doc_ids
+        )
+        docs = {}
+        for doc_id, field, value in rows:
+            docs.setdefault(doc_id, {"_id": doc_id})[field] = value
+        return docs
+
+    def set_stat(self, doc_id: str, field: str, value: int) -> None:
+        with self._transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO stats (id, field, value) VALUES (?, ?, ?)", (doc_id, field, value))
+
+    # --- Leases ---
+
+    def acquire_lease(self, name: str, owner: str, now: float, ttl: float) -> bool:
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                (name, owner, now + ttl, now)
+            )
+            return cursor.rowcount > 0
+
+    def release_lease(self, name: str, owner: str) -> None:
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
@@ -0,0 +1,21 @@
+"""
+Shared setup for the tests. config.py refuses to load without a bot token and an
+admin, so harmless values are set before any bot module is imported. Nothing here
+talks to Telegram or to a real database.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Set rather than defaulted, so values from a developer's .env cannot leak into the tests
+os.environ.update({
+    "TELEGRAM_BOT_TOKEN": "123456:test",
+    "ADMIN_USER_ID": "1",
+    "STORAGE_BACKEND": "memory",
+    "WORKER_COUNT": "1",
+    "WORKER_INDEX": "0",
+    "CAPTURE_PATH": "",
+})
@@ -0,0 +1,65 @@
+import asyncio
+from collections import Counter
+from types import SimpleNamespace
+
+import database
+from broadcaster import Broadcaster
+from storage.base import USER_DEFAULTS
+from storage.memory import MemoryStorage
+
+ADMIN_CHAT = -1
+USERS = list(range(100, 130))
+
+
+class SlowBot:
+    """Takes a moment per message and signals once `stop_after` users got one."""
+
+    def __init__(self, stop_after: int | None = None):
+        self.sent = Counter()
+        self.stop_after = stop_after
+        self.reached = asyncio.Event()
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == ADMIN_CHAT:
+            return SimpleNamespace(message_id=1)
+        await asyncio.sleep(0.001)
+        self.sent[chat_id] += 1
+        if sum(self.sent.values()) == self.stop_after:
+            self.reached.set()
+
+    async def edit_message_text(self, **kwargs):
+        pass
+
+
+def test_interrupted_broadcast_resumes_from_a_recent_checkpoint(monkeypatch):
+    storage = MemoryStorage()
+    storage.insert_users([{"_id": user_id, **USER_DEFAULTS} for user_id in USERS])
+    monkeypatch.setattr(database, "storage", storage)
+
+    async def main():
+        first_bot = SlowBot(stop_after=12)
+        first = Broadcaster(rate=1000, batch_size=len(USERS), checkpoint_size=5)
+        broadcast = await first.start(first_bot, "Hello", ADMIN_CHAT)
+        await first_bot.reached.wait()
+        # A restart in the middle of the only batch
+        await first.close()
+        saved = dict(storage.broadcasts[broadcast["_id"]])
+
+        second_bot = SlowBot()
+        second = Broadcaster(rate=1000, batch_size=len(USERS), checkpoint_size=5)
+        await second.resume(second_bot)
+        await second.wait()
+        return first_bot.sent, saved, second_bot.sent, storage.broadcasts[broadcast["_id"]]
+
+    first_sent, saved, second_sent, finished = asyncio.run(main())
+    # Progress was saved within the batch, not only at its end
+    assert saved["last_user_id"] is not None
+    assert saved["sent"] >= 10
+
+    # Everyone got the message, and only the users after the checkpoint could get it twice
+    delivered = first_sent + second_sent
+    assert set(delivered) == set(USERS)
+    twice = [user_id for user_id, count in delivered.items() if count > 1]
+    assert all(user_id > saved["last_user_id"] for user_id in twice)
+    assert len(twice) <= len(first_sent) - saved["sent"]
+    assert finished["status"] == "done"
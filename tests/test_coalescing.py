@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from coalescing import Coalescer
+
+
+def test_concurrent_calls_share_one_result():
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "link"
+
+    async def main():
+        coalescer = Coalescer(reuse_seconds=0)
+        return await asyncio.gather(*(coalescer.run("user", factory) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["link"] * 5
+    assert len(calls) == 1
+
+
+def test_recent_result_is_reused_while_reusable():
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        coalescer = Coalescer(reuse_seconds=60)
+        first = await coalescer.run("user", factory)
+        reused = await coalescer.run("user", factory, is_reusable=lambda result: True)
+        fresh = await coalescer.run("user", factory, is_reusable=lambda result: False)
+        coalescer.forget("user")
+        after_forget = await coalescer.run("user", factory)
+        other_key = await coalescer.run("other", factory)
+        return first, reused, fresh, after_forget, other_key
+
+    assert asyncio.run(main()) == (1, 1, 2, 3, 4)
+
+
+def test_exception_reaches_every_waiter_and_is_not_remembered():
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("shortener down")
+
+    async def succeeding():
+        return "link"
+
+    async def main():
+        coalescer = Coalescer(reuse_seconds=60)
+        results = await asyncio.gather(*(coalescer.run("user", failing) for _ in range(3)), return_exceptions=True)
+        return results, await coalescer.run("user", succeeding)
+
+    results, retried = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert len(attempts) == 1
+    assert retried == "link"
+
+
+def test_none_results_are_not_remembered():
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        return None
+
+    async def main():
+        coalescer = Coalescer(reuse_seconds=60)
+        await coalescer.run("user", factory)
+        await coalescer.run("user", factory)
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("reuse_seconds", [0, 60])
+def test_cancelled_call_lets_the_next_one_run(reuse_seconds):
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def fast():
+        return "link"
+
+    async def main():
+        coalescer = Coalescer(reuse_seconds)
+        task = asyncio.create_task(coalescer.run("user", slow))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await coalescer.run("user", fast)
+
+    assert asyncio.run(main()) == "link"
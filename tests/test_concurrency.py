@@ -0,0 +1,113 @@
+import asyncio
+
+from telegram import Update
+
+from concurrency import OrderedUpdateProcessor, ordering_key
+
+
+def _start(update_id: int, user_id: int) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+            "text": "/start",
+        },
+    }, None)
+
+
+def _join(update_id: int, user_id: int, channel_id: int = -100) -> Update:
+    user = {"id": user_id, "is_bot": False, "first_name": "User"}
+    return Update.de_json({
+        "update_id": update_id,
+        "chat_member": {
+            "chat": {"id": channel_id, "type": "channel", "title": "Channel"},
+            "from": user,
+            "date": 0,
+            "old_chat_member": {"status": "left", "user": user},
+            "new_chat_member": {"status": "member", "user": user},
+        },
+    }, None)
+
+
+def test_ordering_key_groups_a_users_start_and_join():
+    assert ordering_key(_start(1, 10)) == ordering_key(_join(2, 10)) == ("user", 10)
+    assert ordering_key(_join(3, 11)) != ordering_key(_join(4, 12))
+    assert ordering_key(object()) is None
+
+
+def test_updates_of_one_user_run_in_order_and_users_run_in_parallel():
+    events = []
+
+    async def handle(name: str, seconds: float) -> None:
+        events.append(("start", name))
+        await asyncio.sleep(seconds)
+        events.append(("end", name))
+
+    async def main():
+        processor = OrderedUpdateProcessor(max_concurrent_updates=10)
+        updates = [
+            (_start(1, 10), handle("a1", 0.03)),
+            (_start(2, 10), handle("a2", 0.0)),
+            (_start(3, 20), handle("b1", 0.01)),
+        ]
+        await asyncio.gather(*(processor.process_update(update, coroutine) for update, coroutine in updates))
+        return processor
+
+    processor = asyncio.run(main())
+    # User 10's second update waited for the first, even though it was quicker
+    assert events.index(("end", "a1")) < events.index(("start", "a2"))
+    # User 20 did not wait for user 10
+    assert events.index(("end", "b1")) < events.index(("end", "a1"))
+    assert processor.in_progress() == 0
+    assert processor.waiting() == 0
+
+
+def test_a_burst_from_one_user_takes_a_single_slot():
+    running = []
+    peak = []
+
+    async def handle() -> None:
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+
+    async def main():
+        processor = OrderedUpdateProcessor(max_concurrent_updates=2)
+        started = asyncio.get_running_loop().time()
+        # The burst arrives first
+        burst_task = asyncio.gather(*(processor.process_update(_start(i, 10), handle()) for i in range(5)))
+        other_task = asyncio.create_task(processor.process_update(_start(99, 20), handle()))
+        await other_task
+        other_done = asyncio.get_running_loop().time() - started
+        await burst_task
+        return other_done
+
+    other_done = asyncio.run(main())
+    assert max(peak) <= 2
+    # The other user got the second slot instead of queueing behind the whole burst
+    assert other_done < 0.03
+
+
+def test_cancelled_waiting_update_never_runs():
+    ran = []
+
+    async def handle(name: str, seconds: float) -> None:
+        ran.append(name)
+        await asyncio.sleep(seconds)
+
+    async def main():
+        processor = OrderedUpdateProcessor(max_concurrent_updates=1)
+        first = asyncio.create_task(processor.process_update(_start(1, 10), handle("first", 0.05)))
+        second = asyncio.create_task(processor.process_update(_start(2, 10), handle("second", 0)))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        await asyncio.gather(first, second, return_exceptions=True)
+        return processor
+
+    processor = asyncio.run(main())
+    assert ran == ["first"]
+    assert processor.waiting() == 0
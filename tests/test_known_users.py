@@ -0,0 +1,41 @@
+import asyncio
+
+import database
+from known_users import KnownUserIndex
+from storage.base import USER_DEFAULTS, USER_UNREACHABLE
+from storage.memory import MemoryStorage
+
+
+def test_unknown_until_loaded_then_answers_from_memory(monkeypatch):
+    storage = MemoryStorage()
+    # One ID above 2**32, so more than one bucket is used
+    user_ids = [5, 7, 2**33 + 1]
+    storage.insert_users([{"_id": user_id, **USER_DEFAULTS} for user_id in user_ids])
+    storage.update_users({7: {"status": USER_UNREACHABLE, "unreachable_since": 1.0}})
+    monkeypatch.setattr(database, "storage", storage)
+
+    index = KnownUserIndex()
+    assert index.contains(5) is None
+
+    asyncio.run(index.load())
+    assert index.is_loaded()
+    # Unreachable users have still started the bot
+    assert all(index.contains(user_id) for user_id in user_ids)
+    assert not index.contains(6)
+    assert not index.contains(2**32 + 1)
+    assert len(index) == 3
+
+
+def test_added_users_are_known_before_and_after_merging(monkeypatch):
+    monkeypatch.setattr(database, "storage", MemoryStorage())
+    index = KnownUserIndex(merge_threshold=3)
+    # Users who start the bot while the index loads are kept
+    index.add(100)
+    asyncio.run(index.load())
+
+    for user_id in (300, 200, 200, 400):
+        index.add(user_id)
+    assert len(index) == 4
+    assert index.memory_bytes() > 0
+    assert all(index.contains(user_id) for user_id in (100, 200, 300, 400))
+    assert not index.contains(250)
@@ -0,0 +1,103 @@
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import link_pool
+from link_pool import InviteLinkPool
+
+SETTINGS = {"channel_id": -100, "shortener_domain": "short.example", "shortener_api": "key"}
+
+
+class FakeBot:
+    def __init__(self):
+        self._numbers = itertools.count()
+        self.revoked = []
+
+    async def create_chat_invite_link(self, chat_id, expire_date, member_limit):
+        return SimpleNamespace(invite_link=f"https://t.me/+{chat_id}_{next(self._numbers)}")
+
+    async def revoke_chat_invite_link(self, chat_id, invite_link):
+        self.revoked.append(invite_link)
+
+
+def _shortener(monkeypatch) -> list:
+    shortened = []
+
+    async def shorten_link(domain, api_key, long_url):
+        shortened.append((domain, long_url))
+        return f"https://{domain}/{long_url.rsplit('_', 1)[1]}"
+    monkeypatch.setattr(link_pool, "shorten_link", shorten_link)
+    monkeypatch.setattr(link_pool.shortener_client, "is_available", lambda: True)
+    return shortened
+
+
+async def _drain(pool: InviteLinkPool) -> None:
+    if pool._refill_task is not None:
+        await pool._refill_task
+
+
+def test_pool_stays_empty_without_demand(monkeypatch):
+    shortened = _shortener(monkeypatch)
+
+    async def main():
+        pool = InviteLinkPool(size=5)
+        bot = FakeBot()
+        assert pool.pop(bot, SETTINGS) is None
+        await _drain(pool)
+        assert pool.pop(bot, dict(SETTINGS)) is None
+        await pool.close()
+
+    asyncio.run(main())
+    assert shortened == []
+
+
+def test_refilled_links_are_shortened_for_the_current_settings(monkeypatch):
+    shortened = _shortener(monkeypatch)
+
+    async def main():
+        pool = InviteLinkPool(size=5)
+        bot = FakeBot()
+        for _ in range(3):
+            pool.pop(bot, SETTINGS)
+        await _drain(pool)
+        link = pool.pop(bot, SETTINGS)
+        await pool.close()
+        return link
+
+    link = asyncio.run(main())
+    assert link.short_link == f"https://short.example/{link.invite_link.rsplit('_', 1)[1]}"
+    assert all(domain == "short.example" for domain, _ in shortened)
+
+
+def test_settings_change_empties_the_pool_and_revokes_its_links(monkeypatch):
+    _shortener(monkeypatch)
+
+    async def main():
+        pool = InviteLinkPool(size=5)
+        bot = FakeBot()
+        for _ in range(3):
+            pool.pop(bot, SETTINGS)
+        await _drain(pool)
+        pooled = [link.invite_link for link in pool._links]
+
+        link = pool.pop(bot, {**SETTINGS, "shortener_domain": "other.example"})
+        await pool.close()
+        return bot, pooled, link
+
+    bot, pooled, link = asyncio.run(main())
+    assert pooled
+    assert link is None
+    assert set(pooled) <= set(bot.revoked)
+
+
+def test_discarded_link_is_revoked(monkeypatch):
+    async def main():
+        pool = InviteLinkPool(size=5)
+        bot = FakeBot()
+        link = await link_pool.create_invite_link(bot, -100)
+        pool.discard(bot, -100, link)
+        await pool.close()
+        return bot, link
+
+    bot, link = asyncio.run(main())
+    assert bot.revoked == [link.invite_link]
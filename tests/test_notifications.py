@@ -0,0 +1,81 @@
+import asyncio
+
+from aiohttp import web
+from telegram import User
+
+from config import SHARD_SECRET
+from notifications import JoinForwarder, JoinNotifier
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def test_realtime_backlog_overflows_into_one_digest():
+    bot = RecordingBot()
+
+    async def main():
+        notifier = JoinNotifier(max_realtime_backlog=2)
+        for user_id in range(5):
+            notifier.notify(bot, User(user_id, f"User {user_id}", False), "realtime")
+        # The two realtime messages go out in the background
+        await asyncio.sleep(0.01)
+        await notifier.flush(bot)
+
+    asyncio.run(main())
+    assert len(bot.sent) == 3
+    assert "3</b> bot user(s) joined" in bot.sent[2][1]
+
+
+async def _admin_worker(answers: list) -> tuple[web.AppRunner, str, list]:
+    """An HTTP server standing in for the admin's worker; answers with the given statuses, then 200."""
+    received = []
+
+    async def joins(request: web.Request) -> web.Response:
+        assert request.headers["X-Shard-Secret"] == SHARD_SECRET
+        status = answers.pop(0) if answers else 200
+        if status == 200:
+            received.extend(user["id"] for user in await request.json())
+        return web.json_response({}, status=status)
+
+    app = web.Application()
+    app.router.add_post("/joins", joins)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}", received
+
+
+def test_joins_reach_the_admin_worker_in_order_despite_failures():
+    async def main():
+        runner, url, received = await _admin_worker([503])
+        forwarder = JoinForwarder(url, batch_size=2)
+        for user_id in range(5):
+            forwarder.forward(User(user_id, f"User {user_id}", False))
+        await forwarder.close()
+        await runner.cleanup()
+        return received, forwarder
+
+    received, forwarder = asyncio.run(main())
+    assert received == [0, 1, 2, 3, 4]
+    assert forwarder.dropped == 0
+
+
+def test_joins_beyond_the_limit_are_dropped():
+    async def main():
+        runner, url, received = await _admin_worker([])
+        forwarder = JoinForwarder(url, max_pending=3)
+        for user_id in range(5):
+            forwarder.forward(User(user_id, f"User {user_id}", False))
+        await forwarder.close()
+        await runner.cleanup()
+        return received, forwarder
+
+    received, forwarder = asyncio.run(main())
+    assert received == [0, 1, 2]
+    assert forwarder.dropped == 2
@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+from telegram.error import BadRequest, Forbidden, NetworkError
+
+from config import REMOVAL_RETRY_SECONDS, REMOVAL_FORBIDDEN_RETRY_SECONDS
+from jobs import remove_member
+
+
+class FailingBot:
+    def __init__(self, error: Exception):
+        self.error = error
+
+    async def ban_chat_member(self, chat_id, user_id):
+        raise self.error
+
+
+@pytest.mark.parametrize("error, retry_after", [
+    # The admin took away the bot's rights; the removal must happen once they are back
+    (Forbidden("Forbidden: not enough rights to restrict/unrestrict chat member"), REMOVAL_FORBIDDEN_RETRY_SECONDS),
+    (BadRequest("Chat not found"), REMOVAL_RETRY_SECONDS),
+    (NetworkError("Connection reset"), REMOVAL_RETRY_SECONDS),
+    # Nothing left to remove
+    (BadRequest("User not found"), None),
+    (BadRequest("PARTICIPANT_ID_INVALID"), None),
+])
+def test_failed_removals_are_retried_unless_the_user_is_gone(error, retry_after):
+    assert asyncio.run(remove_member(FailingBot(error), 5, -100)) == retry_after
@@ -0,0 +1,122 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from scheduler import OutboundScheduler, PRIORITY_INTERACTIVE, PRIORITY_BROADCAST
+
+
+def _call(scheduler: OutboundScheduler, order: list, name: str, priority: int, endpoint: str = "getMe",
+          data: dict | None = None):
+    async def callback():
+        order.append(name)
+        return name
+    return scheduler.process_request(callback, (), {}, endpoint, data or {}, {"priority": priority})
+
+
+def test_waiting_calls_are_served_by_priority():
+    order = []
+
+    async def main():
+        scheduler = OutboundScheduler(rate=20, chat_rate=100, chat_burst=100)
+        # Use up the burst, so the next calls have to queue
+        await asyncio.gather(*(_call(scheduler, [], "warmup", PRIORITY_INTERACTIVE) for _ in range(20)))
+        broadcast = [asyncio.create_task(_call(scheduler, order, f"broadcast{i}", PRIORITY_BROADCAST)) for i in range(3)]
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(_call(scheduler, order, "interactive", PRIORITY_INTERACTIVE))
+        await asyncio.gather(*broadcast, interactive)
+
+    asyncio.run(main())
+    # Queued after the broadcast messages, but served before all of them but possibly the first
+    assert order.index("interactive") <= 1
+
+
+def test_messages_to_one_chat_are_paced_by_its_limit():
+    async def main():
+        scheduler = OutboundScheduler(rate=1000, chat_rate=20, chat_burst=1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(*(
+            _call(scheduler, [], "send", PRIORITY_INTERACTIVE, "sendMessage", {"chat_id": 5}) for _ in range(3)
+        ))
+        same_chat = loop.time() - started
+
+        started = loop.time()
+        await asyncio.gather(*(
+            _call(scheduler, [], "send", PRIORITY_INTERACTIVE, "sendMessage", {"chat_id": chat_id})
+            for chat_id in (6, 7, 8)
+        ))
+        return same_chat, loop.time() - started
+
+    same_chat, different_chats = asyncio.run(main())
+    # Two waits of 1/20 s for the same chat, none for different chats
+    assert same_chat >= 0.09
+    assert different_chats < 0.05
+
+
+def _flood_once(scheduler: OutboundScheduler, order: list, name: str, priority: int, chat_id: int,
+                retry_after: float = 0.3):
+    """A sendMessage that Telegram answers with RetryAfter the first time."""
+    attempts = []
+
+    async def callback():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise RetryAfter(retry_after)
+        order.append(name)
+    return scheduler.process_request(
+        callback, (), {}, "sendMessage", {"chat_id": chat_id}, {"priority": priority}
+    )
+
+
+def test_broadcast_flood_limit_does_not_delay_interactive_calls():
+    order = []
+
+    async def main():
+        scheduler = OutboundScheduler(rate=100, chat_rate=100, chat_burst=100)
+        loop = asyncio.get_running_loop()
+        broadcast = asyncio.create_task(_flood_once(scheduler, order, "broadcast", PRIORITY_BROADCAST, 10))
+        await asyncio.sleep(0.01)
+
+        started = loop.time()
+        await _call(scheduler, order, "interactive", PRIORITY_INTERACTIVE, "sendMessage", {"chat_id": 11})
+        interactive_wait = loop.time() - started
+        # Another broadcast message waits for the pause of its priority
+        await _call(scheduler, order, "broadcast2", PRIORITY_BROADCAST, "sendMessage", {"chat_id": 12})
+        await broadcast
+        return interactive_wait, loop.time() - started
+
+    interactive_wait, broadcast_wait = asyncio.run(main())
+    assert interactive_wait < 0.05
+    assert broadcast_wait >= 0.25
+    assert order[0] == "interactive"
+
+
+def test_interactive_flood_limit_only_pauses_that_chat():
+    order = []
+
+    async def main():
+        scheduler = OutboundScheduler(rate=100, chat_rate=100, chat_burst=100)
+        flooded = asyncio.create_task(_flood_once(scheduler, order, "flooded", PRIORITY_INTERACTIVE, 10))
+        await asyncio.sleep(0.01)
+        await _call(scheduler, order, "other", PRIORITY_INTERACTIVE, "sendMessage", {"chat_id": 11})
+        await flooded
+
+    asyncio.run(main())
+    assert order == ["other", "flooded"]
+
+
+def test_flood_limit_in_several_chats_pauses_all_calls():
+    async def main():
+        scheduler = OutboundScheduler(rate=100, chat_rate=100, chat_burst=100, flood_chats=2)
+        loop = asyncio.get_running_loop()
+        flooded = [
+            asyncio.create_task(_flood_once(scheduler, [], "flooded", PRIORITY_INTERACTIVE, chat_id))
+            for chat_id in (10, 11)
+        ]
+        await asyncio.sleep(0.01)
+        started = loop.time()
+        await _call(scheduler, [], "other", PRIORITY_INTERACTIVE, "sendMessage", {"chat_id": 12})
+        await asyncio.gather(*flooded)
+        return loop.time() - started
+
+    assert asyncio.run(main()) >= 0.25
@@ -0,0 +1,36 @@
+import asyncio
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+import status_server
+from config import SHARD_SECRET
+
+
+def _post_updates(headers: dict, running: bool = True) -> int:
+    async def main():
+        app = web.Application()
+        app["application"] = SimpleNamespace(running=running)
+        app.router.add_post("/updates", status_server._updates)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        try:
+            async with aiohttp.ClientSession() as session:
+                url = f"http://127.0.0.1:{runner.addresses[0][1]}/updates"
+                async with session.post(url, json=[], headers=headers) as response:
+                    return response.status
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+def test_updates_are_refused_without_the_shard_secret():
+    assert _post_updates({}) == 403
+    assert _post_updates({"X-Shard-Secret": "guess"}) == 403
+
+
+def test_updates_with_the_shard_secret_get_past_the_check():
+    # Not running, so the worker asks the router to retry later
+    assert _post_updates({"X-Shard-Secret": SHARD_SECRET}, running=False) == 503
@@ -0,0 +1,201 @@
+"""
+The same cases against every storage backend: in-memory, SQLite (a temporary file)
+and MongoDB (the stand-in from bench/fake_mongo.py), so the backends cannot drift apart.
+"""
+import itertools
+
+import pytest
+
+from storage.base import USER_UNREACHABLE, USER_DEFAULTS
+
+# A separate fake MongoDB database per test; the fake client shares data between clients
+_database_names = (f"test_{number}" for number in itertools.count())
+
+
+@pytest.fixture(params=["memory", "sqlite", "mongo"])
+def backend(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        from storage.memory import MemoryStorage
+        storage = MemoryStorage()
+    elif request.param == "sqlite":
+        from storage.sqlite import SQLiteStorage
+        storage = SQLiteStorage(str(tmp_path / "test.db"))
+    else:
+        import storage.mongo
+        from bench.fake_mongo import FakeMongoClient
+        monkeypatch.setattr(storage.mongo, "MongoClient", FakeMongoClient)
+        storage = storage.mongo.MongoStorage("mongodb://test.invalid", 1.0, database_name=next(_database_names))
+    storage.open()
+    storage.ensure_indexes()
+    yield storage
+    storage.close()
+
+
+def _mark_unreachable(backend, user_id: int, since: float) -> None:
+    backend.update_users(
+        {user_id: {"status": USER_UNREACHABLE, "unreachable_since": since, "unreachable_reason": "blocked"}}
+    )
+
+
+# --- Users ---
+
+def test_get_or_create_user_reports_created_once(backend):
+    user, created = backend.get_or_create_user(10)
+    assert created
+    assert user == {"_id": 10, **USER_DEFAULTS}
+
+    user, created = backend.get_or_create_user(10)
+    assert not created
+    assert user["_id"] == 10
+    assert backend.count_users() == 1
+
+
+def test_get_or_create_user_clears_unreachable_flag(backend):
+    backend.get_or_create_user(10)
+    _mark_unreachable(backend, 10, 100.0)
+    assert backend.count_users(reachable_only=True) == 0
+
+    previous, created = backend.get_or_create_user(10)
+    assert not created
+    assert previous["status"] == USER_UNREACHABLE
+    assert "status" not in backend.get_user(10)
+    assert backend.count_users(reachable_only=True) == 1
+
+
+def test_update_users_does_not_create_users(backend):
+    backend.update_users({10: {"has_received_free_link": True}})
+    assert backend.get_user(10) is None
+
+
+def test_get_user_ids_after_skips_unreachable_users(backend):
+    backend.insert_users([{"_id": user_id, **USER_DEFAULTS} for user_id in (5, 1, 3, 4, 2)])
+    _mark_unreachable(backend, 3, 100.0)
+
+    assert backend.get_user_ids_after(None, 2) == [1, 2]
+    assert backend.get_user_ids_after(2, 10) == [4, 5]
+    assert backend.get_user_ids_after(2, 10, include_unreachable=True) == [3, 4, 5]
+
+
+def test_archive_unreachable_users_moves_only_old_unreachable_users(backend):
+    backend.insert_users([{"_id": user_id, **USER_DEFAULTS} for user_id in (1, 2, 3)])
+    _mark_unreachable(backend, 1, 100.0)
+    _mark_unreachable(backend, 2, 500.0)
+
+    assert backend.archive_unreachable_users(200.0, 10, None) == 1
+    assert backend.get_user(1) is None
+    assert backend.get_user(2)["status"] == USER_UNREACHABLE
+    assert backend.get_user(3) is not None
+    assert backend.count_users() == 2
+
+
+def test_archive_unreachable_users_respects_limit_and_shard(backend):
+    backend.insert_users([{"_id": user_id, **USER_DEFAULTS} for user_id in range(1, 7)])
+    for user_id in range(1, 7):
+        _mark_unreachable(backend, user_id, 100.0)
+
+    assert backend.archive_unreachable_users(200.0, 2, (2, 0)) == 2
+    assert backend.archive_unreachable_users(200.0, 10, (2, 0)) == 1
+    # Only the even IDs were this shard's
+    assert backend.get_user_ids_after(None, 10, include_unreachable=True) == [1, 3, 5]
+
+
+def test_archived_user_is_restored_by_get_or_create_user(backend):
+    backend.insert_users([{"_id": 10, "has_received_free_link": True, "last_link_timestamp": 42.0}])
+    _mark_unreachable(backend, 10, 100.0)
+    assert backend.archive_unreachable_users(200.0, 10, None) == 1
+
+    user, created = backend.get_or_create_user(10)
+    assert not created
+    assert user["has_received_free_link"] is True
+    assert user["last_link_timestamp"] == 42.0
+
+    stored = backend.get_user(10)
+    assert stored["has_received_free_link"] is True
+    assert "status" not in stored
+    # Restored from the archive only once
+    assert backend.archive_unreachable_users(float("inf"), 10, None) == 0
+    assert backend.get_or_create_user(10)[1] is False
+
+
+# --- Pending Removals ---
+
+def test_due_removals_are_oldest_first_and_limited(backend):
+    backend.set_removal(1, -100, 30.0)
+    backend.set_removal(2, -100, 10.0)
+    backend.set_removal(3, -100, 20.0)
+    backend.set_removal(4, -100, 99.0)
+
+    due = backend.get_due_removals(50.0, 2, None)
+    assert [(doc["user_id"], doc["channel_id"], doc["remove_at"]) for doc in due] == [(2, -100, 10.0), (3, -100, 20.0)]
+    assert [doc["user_id"] for doc in backend.get_due_removals(50.0, 10, (2, 1))] == [3, 1]
+    assert backend.get_next_removal_time(None) == 10.0
+    assert backend.get_next_removal_time((2, 0)) == 10.0
+    assert backend.count_pending_removals() == 4
+
+
+def test_set_removal_replaces_the_deadline(backend):
+    backend.set_removal(1, -100, 10.0)
+    backend.set_removal(1, -100, 20.0)
+    assert backend.count_pending_removals() == 1
+    assert backend.get_next_removal_time(None) == 20.0
+
+
+def test_delete_removals_skips_entries_with_a_new_deadline(backend):
+    backend.set_removal(1, -100, 10.0)
+    backend.set_removal(2, -100, 10.0)
+    due = backend.get_due_removals(10.0, 10, None)
+    # User 2 got a new link while the sweeper was removing them
+    backend.set_removal(2, -100, 50.0)
+
+    backend.delete_removals(due)
+    assert backend.get_due_removals(float("inf"), 10, None)[0]["user_id"] == 2
+    assert backend.count_pending_removals() == 1
+
+
+def test_postpone_removal_skips_entries_with_a_new_deadline(backend):
+    backend.set_removal(1, -100, 10.0)
+    backend.set_removal(2, -100, 10.0)
+    first, second = backend.get_due_removals(10.0, 10, None)
+    backend.set_removal(second["user_id"], -100, 50.0)
+
+    backend.postpone_removal(first, 30.0)
+    backend.postpone_removal(second, 30.0)
+    deadlines = {doc["user_id"]: doc["remove_at"] for doc in backend.get_due_removals(float("inf"), 10, None)}
+    assert deadlines == {first["user_id"]: 30.0, second["user_id"]: 50.0}
+    assert backend.get_due_removals(20.0, 10, None) == []
+
+
+# --- Stats Counters ---
+
+def test_stats_increments_add_up(backend):
+    backend.increment_stats({"total": {"joins": 2, "removals": 1}, "2026-01-01": {"joins": 1}})
+    backend.increment_stats({"total": {"joins": 3}})
+    backend.set_stat("total", "users", 7)
+
+    stats = backend.get_stats(["total", "2026-01-01", "missing"])
+    assert set(stats) == {"total", "2026-01-01"}
+    assert (stats["total"]["joins"], stats["total"]["removals"], stats["total"]["users"]) == (5, 1, 7)
+    assert stats["2026-01-01"]["joins"] == 1
+
+
+# --- Leases ---
+
+def test_lease_is_exclusive_until_it_expires(backend):
+    assert backend.acquire_lease("shard-0", "a", now=100.0, ttl=30.0)
+    assert not backend.acquire_lease("shard-0", "b", now=110.0, ttl=30.0)
+    # The owner renews it
+    assert backend.acquire_lease("shard-0", "a", now=120.0, ttl=30.0)
+    assert not backend.acquire_lease("shard-0", "b", now=140.0, ttl=30.0)
+    # Expired at 150
+    assert backend.acquire_lease("shard-0", "b", now=151.0, ttl=30.0)
+    assert not backend.acquire_lease("shard-0", "a", now=152.0, ttl=30.0)
+
+
+def test_lease_is_released_only_by_its_owner(backend):
+    assert backend.acquire_lease("shard-0", "a", now=100.0, ttl=30.0)
+    backend.release_lease("shard-0", "b")
+    assert not backend.acquire_lease("shard-0", "b", now=101.0, ttl=30.0)
+    backend.release_lease("shard-0", "a")
+    assert backend.acquire_lease("shard-0", "b", now=102.0, ttl=30.0)
+    # Other leases are independent
+    assert backend.acquire_lease("shard-1", "a", now=102.0, ttl=30.0)
@@ -0,0 +1,84 @@
+import asyncio
+
+import database
+from database import WriteBehindBuffer
+from storage.base import USER_DEFAULTS
+from storage.memory import MemoryStorage
+
+
+class RecordingStorage(MemoryStorage):
+    """Counts batch writes and can be told to fail the next one."""
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+        self.fail_next = False
+
+    def update_users(self, fields_by_user: dict) -> None:
+        if self.fail_next:
+            self.fail_next = False
+            raise RuntimeError("database unavailable")
+        self.batches.append(dict(fields_by_user))
+        super().update_users(fields_by_user)
+
+
+def _storage(monkeypatch) -> RecordingStorage:
+    storage = RecordingStorage()
+    storage.insert_users([{"_id": user_id, **USER_DEFAULTS} for user_id in (1, 2, 3)])
+    monkeypatch.setattr(database, "storage", storage)
+    return storage
+
+
+def test_updates_are_merged_and_written_as_one_batch(monkeypatch):
+    storage = _storage(monkeypatch)
+
+    async def main():
+        buffer = WriteBehindBuffer(max_size=10, flush_seconds=0.01)
+        buffer.set(1, {"last_link_timestamp": 1.0})
+        buffer.set(1, {"last_link_timestamp": 2.0, "has_received_free_link": True})
+        buffer.set(2, {"last_link_timestamp": 3.0})
+        assert len(buffer) == 2
+        await asyncio.sleep(0.05)
+        await buffer.close()
+
+    asyncio.run(main())
+    assert storage.batches == [{
+        1: {"last_link_timestamp": 2.0, "has_received_free_link": True},
+        2: {"last_link_timestamp": 3.0},
+    }]
+    assert storage.get_user(1)["last_link_timestamp"] == 2.0
+
+
+def test_full_buffer_is_flushed_without_waiting_for_the_timer(monkeypatch):
+    storage = _storage(monkeypatch)
+
+    async def main():
+        buffer = WriteBehindBuffer(max_size=2, flush_seconds=60)
+        buffer.set(1, {"last_link_timestamp": 1.0})
+        buffer.set(2, {"last_link_timestamp": 1.0})
+        await asyncio.sleep(0)
+        written = list(storage.batches)
+        buffer.set(3, {"last_link_timestamp": 1.0})
+        await buffer.close()
+        return written
+
+    assert len(asyncio.run(main())) == 1
+    assert len(storage.batches) == 2
+
+
+def test_failed_flush_keeps_updates_without_overwriting_newer_ones(monkeypatch):
+    storage = _storage(monkeypatch)
+
+    async def main():
+        buffer = WriteBehindBuffer(max_size=10, flush_seconds=60)
+        buffer.set(1, {"last_link_timestamp": 1.0, "has_received_free_link": True})
+        storage.fail_next = True
+        flush = asyncio.create_task(buffer.flush())
+        # Arrives while the failing flush is in progress
+        buffer.set(1, {"last_link_timestamp": 2.0})
+        await flush
+        assert len(buffer) == 1
+        await buffer.close()
+
+    asyncio.run(main())
+    assert storage.batches == [{1: {"last_link_timestamp": 2.0, "has_received_free_link": True}}]